@@ -1,10 +1,13 @@
 from django.contrib import admin
 
-from .models import Member, Post, Comment, Friendship, Chat, Message
+from .models import Member, Post, Comment, Friendship, Chat, Message, Task, Media, Upload
 
 admin.site.register(Member)
 admin.site.register(Post)
 admin.site.register(Comment)
 admin.site.register(Friendship)
 admin.site.register(Chat)
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(Task)
+admin.site.register(Media)
+admin.site.register(Upload)
@@ -1,6 +1,43 @@
 from django.apps import AppConfig
 
 
+def update_last_login(sender, user, **kwargs):
+    # Members log in through django.contrib.auth but have no last_login column.
+    if hasattr(user, 'last_login'):
+        from django.contrib.auth.models import update_last_login
+        update_last_login(sender, user, **kwargs)
+
+
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from django.db.models.signals import post_delete, post_save
+
+        from .authentication import invalidate_principal
+        from .comment_tree import comment_deleted
+        from .conditional import bump_profile
+        from .fragments import invalidate_member
+        from .models import Comment, Member, Message, Post
+        from .search import index_instance, unindex_instance
+
+        if user_logged_in.disconnect(dispatch_uid="update_last_login"):
+            user_logged_in.connect(update_last_login, dispatch_uid="update_last_login")
+
+        # Password or is_active changes must not be served from the cache.
+        post_save.connect(invalidate_principal, sender=Member, dispatch_uid="invalidate_principal")
+        post_delete.connect(invalidate_principal, sender=Member, dispatch_uid="invalidate_principal")
+        post_save.connect(bump_profile, sender=Member, dispatch_uid="bump_profile")
+        post_save.connect(invalidate_member, sender=Member, dispatch_uid="invalidate_member_fragments")
+        post_delete.connect(invalidate_member, sender=Member, dispatch_uid="invalidate_member_fragments")
+
+        # Comments created through the API bump the counters with F(); deletes
+        # can come from anywhere, including cascades.
+        post_delete.connect(comment_deleted, sender=Comment, dispatch_uid="comment_deleted")
+
+        # SQLite FTS tables are written in the same transaction as the row.
+        for model in (Member, Post, Message):
+            post_save.connect(index_instance, sender=model, dispatch_uid=f"search_index_{model.__name__}")
+            post_delete.connect(unindex_instance, sender=model, dispatch_uid=f"search_index_{model.__name__}")
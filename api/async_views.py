@@ -0,0 +1,92 @@
+"""
+Async support for DRF views.
+
+DRF dispatches requests synchronously. Views built on ``AsyncAPIViewMixin``
+keep their sync handlers for WSGI workers and add async ones named after the
+method with an ``a`` prefix (``aget``). Under ASGI,
+``api.middleware.AsyncViewMiddleware`` serves the view through ``adispatch``
+instead: async handlers are awaited on the event loop and use the async ORM,
+while the remaining sync handlers and the authentication, permission and
+throttling checks run in a worker thread. So does serialization, as fields
+read the fragment and presence caches, whose backends are sync.
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+
+
+class AsyncAPIViewMixin:
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.adispatch(request, *args, **kwargs)
+
+        view.async_view = async_view
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            method = request.method.lower()
+            if method in self.http_method_names:
+                handler = getattr(self, f'a{method}', None) or getattr(self, method, self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self):
+        """
+        Async counterpart of ``GenericAPIView.get_object``.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, Http404):
+            raise NotFound()
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apage(self, request):
+        """
+        The rows of the requested page, for paginated views.
+        """
+        queryset = await sync_to_async(self.get_queryset)()
+        queryset = self.filter_queryset(queryset)
+        return await self.paginator.apaginate_queryset(queryset, request, view=self)
+
+    async def alist(self, request, *args, **kwargs):
+        """
+        Async counterpart of ``ListModelMixin.list`` for paginated views.
+        """
+        page = await self.apage(request)
+        return self.get_paginated_response(await self.aserialize(page, many=True))
+
+    async def aserialize(self, *args, **kwargs):
+        """
+        The serialized data of ``get_serializer(*args, **kwargs)``, built in a
+        worker thread.
+        """
+        return await sync_to_async(lambda: self.get_serializer(*args, **kwargs).data)()
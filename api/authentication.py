@@ -0,0 +1,206 @@
+"""
+Stateless signed tokens for API clients.
+
+Access and refresh tokens are ``TimestampSigner`` signatures over the member
+id and a digest of the member's ``credential_version``, so no token table is
+needed and changing the password revokes every outstanding token, while
+rehashing it with a newer hasher does not. Verified members are kept in a
+per-process LRU cache, which makes authenticated requests cost no queries.
+Each entry is tagged with the member's version token from the shared cache,
+bumped after commit when the member is saved or deleted, or when
+``is_active`` or ``credential_version`` is changed with ``update()``, so an
+invalidation in one worker is seen by all of them on the next request. A
+token that does not match a cached member is checked against the database
+before it is rejected.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, CSRFCheck, get_authorization_header
+
+from .models import Member
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+SALT = 'api.authentication.token'
+VERSION_KEY = 'auth:principal:{}'
+
+
+class PrincipalCache:
+    """
+    Thread-safe LRU of active members by id and version, with a time-to-live.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, member_id, version=None):
+        with self._lock:
+            entry = self._entries.get(member_id)
+            if entry is None:
+                return None
+            member, cached_version, expires = entry
+            if expires < time.monotonic() or cached_version != version:
+                del self._entries[member_id]
+                return None
+            self._entries.move_to_end(member_id)
+            return member
+
+    def set(self, member_id, member, version=None):
+        with self._lock:
+            self._entries[member_id] = (member, version, time.monotonic() + settings.AUTH_PRINCIPAL_CACHE_TTL)
+            self._entries.move_to_end(member_id)
+            while len(self._entries) > settings.AUTH_PRINCIPAL_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, member_id):
+        with self._lock:
+            self._entries.pop(member_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def _new_version():
+    return format(time.time_ns(), 'x')
+
+
+def get_principal(member_id, fresh=False):
+    """
+    The active member with this id, or None. Callers get their own copy.
+    ``fresh`` skips the cache and reloads the member from the database.
+    """
+    version = cache.get_or_set(VERSION_KEY.format(member_id), _new_version, None)
+    member = None if fresh else principals.get(member_id, version)
+    if member is None:
+        member = Member.objects.filter(id=member_id, is_active=True).first()
+        if member is None:
+            principals.invalidate(member_id)
+            return None
+        principals.set(member_id, member, version)
+    return copy.copy(member)
+
+
+def invalidate_principals(*member_ids):
+    """
+    Drop the members from the cache of every worker once the transaction
+    commits, and from this worker's cache right away.
+    """
+    for member_id in member_ids:
+        principals.invalidate(member_id)
+    keys = [VERSION_KEY.format(member_id) for member_id in member_ids]
+    transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, _new_version()), None))
+
+
+def invalidate_principal(sender, instance, **kwargs):
+    invalidate_principals(instance.pk)
+
+
+def _credential_digest(member):
+    return member.get_session_auth_hash()[:20]
+
+
+def issue_token(member, kind):
+    return signing.TimestampSigner(salt=f'{SALT}.{kind}').sign_object(
+        {'m': member.id, 'h': _credential_digest(member)}
+    )
+
+
+def issue_tokens(member):
+    return {ACCESS: issue_token(member, ACCESS), REFRESH: issue_token(member, REFRESH)}
+
+
+def verify_token(token, kind):
+    """
+    Return the member a token was issued to, or raise AuthenticationFailed.
+    """
+    max_age = settings.ACCESS_TOKEN_LIFETIME if kind == ACCESS else settings.REFRESH_TOKEN_LIFETIME
+    try:
+        payload = signing.TimestampSigner(salt=f'{SALT}.{kind}').unsign_object(token, max_age=max_age)
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed('Token expired.')
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    member = get_principal(payload['m'])
+    if member is not None and not constant_time_compare(payload['h'], _credential_digest(member)):
+        # The cached member may predate a password change in another worker.
+        member = get_principal(payload['m'], fresh=True)
+    if member is None or not constant_time_compare(payload['h'], _credential_digest(member)):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    return member
+
+
+def set_token_cookies(response, tokens):
+    response.set_cookie(
+        settings.ACCESS_TOKEN_COOKIE,
+        tokens[ACCESS],
+        max_age=settings.ACCESS_TOKEN_LIFETIME,
+        httponly=True,
+        samesite='Lax',
+    )
+    response.set_cookie(
+        settings.REFRESH_TOKEN_COOKIE,
+        tokens[REFRESH],
+        max_age=settings.REFRESH_TOKEN_LIFETIME,
+        path='/api/auth/refresh/',
+        httponly=True,
+        samesite='Lax',
+    )
+
+
+def delete_token_cookies(response):
+    response.delete_cookie(settings.ACCESS_TOKEN_COOKIE)
+    response.delete_cookie(settings.REFRESH_TOKEN_COOKIE, path='/api/auth/refresh/')
+
+
+class TokenAuthentication(BaseAuthentication):
+    """
+    Accepts ``Authorization: Bearer <access token>`` or the access token
+    cookie. Like session authentication, cookie requests are CSRF checked,
+    and an invalid cookie is treated as no credentials.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if header and header[0].lower() == self.keyword.lower().encode():
+            if len(header) != 2:
+                raise exceptions.AuthenticationFailed('Invalid token header.')
+            return verify_token(header[1].decode('latin-1'), ACCESS), None
+
+        token = request.COOKIES.get(settings.ACCESS_TOKEN_COOKIE)
+        if not token:
+            return None
+        # A stale cookie must not block anonymous endpoints such as login.
+        try:
+            member = verify_token(token, ACCESS)
+        except exceptions.AuthenticationFailed:
+            return None
+        self.enforce_csrf(request)
+        return member, None
+
+    def enforce_csrf(self, request):
+        def dummy_get_response(request):  # pragma: no cover
+            return None
+
+        check = CSRFCheck(dummy_get_response)
+        check.process_request(request)
+        reason = check.process_view(request, None, (), {})
+        if reason:
+            raise exceptions.PermissionDenied(f'CSRF Failed: {reason}')
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
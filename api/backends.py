@@ -1,5 +1,8 @@
 from django.contrib.auth.backends import BaseBackend
+from django.core.exceptions import PermissionDenied
+from rest_framework.exceptions import Throttled
 
+from . import passwords
 from .models import Member
 
 
@@ -16,14 +19,10 @@ class MemberBackend(BaseBackend):
             return None
 
         try:
-            member = Member.objects.get(username=username)
-            if member.is_active and member.check_password(password):
-                return member
-        except Member.DoesNotExist:
-            # Protect against timing attacks
-            Member().check_password(password)
-
-        return None
+            return passwords.authenticate(request, username, password)
+        except Throttled:
+            # Stops Django from trying the remaining backends.
+            raise PermissionDenied
 
     def get_user(self, user_id):
         try:
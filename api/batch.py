@@ -0,0 +1,142 @@
+"""
+Batched writes for clients that replay offline actions.
+
+Each function takes the validated items of one request, checks all of them
+against the database with a constant number of queries, applies the valid
+ones with bulk statements in a single transaction, and returns one result per
+item in request order: ``{'status': 201, 'data': ...}`` on success or
+``{'status': 404, 'error': '...'}`` when that item was rejected.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import friend_graph, realtime, search
+from .models import Chat, Friendship, Like, Member, Message, Post
+from .serializers import MessageSerializer
+
+
+def _error(status, message):
+    return {'status': status, 'error': message}
+
+
+@transaction.atomic
+def send_messages(member, items):
+    """
+    Post messages to chats the member belongs to.
+    """
+    audiences = {}
+    rows = Chat.members.through.objects.filter(
+        chat_id__in={item['chat_id'] for item in items}
+    ).values_list('chat_id', 'member_id')
+    for chat_id, member_id in rows:
+        audiences.setdefault(chat_id, set()).add(member_id)
+
+    results, messages = [], []
+    for item in items:
+        if member.id not in audiences.get(item['chat_id'], ()):
+            results.append(_error(404, 'Chat not found'))
+            continue
+        message = Message(chat_id=item['chat_id'], author=member, text=item['text'])
+        messages.append(message)
+        results.append(message)
+    if not messages:
+        return results
+
+    Message.objects.bulk_create(messages)
+    search.index(messages)
+    latest = {message.chat_id: message for message in messages}
+    Chat.objects.bulk_update(
+        [
+            Chat(id=chat_id, last_message=message, last_activity=message.created_at)
+            for chat_id, message in latest.items()
+        ],
+        ['last_message', 'last_activity'],
+    )
+    data = iter(MessageSerializer(messages, many=True).data)
+    for index, result in enumerate(results):
+        if isinstance(result, Message):
+            results[index] = {'status': 201, 'data': next(data)}
+            realtime.publish(audiences[result.chat_id], 'message', results[index]['data'])
+    return results
+
+
+@transaction.atomic
+def set_likes(member, items):
+    """
+    Like or unlike posts. Unlike the single toggle endpoint, each item states
+    the wanted outcome, so replaying a batch is harmless. When a post appears
+    more than once the last item wins.
+    """
+    wanted = {item['post_id']: item['liked'] for item in items}
+    existing = set(Post.objects.filter(id__in=wanted).values_list('id', flat=True))
+    liked = set(
+        Like.objects.filter(member=member, post_id__in=existing).values_list('post_id', flat=True)
+    )
+    add = [post_id for post_id in existing if wanted[post_id] and post_id not in liked]
+    remove = [post_id for post_id in existing if not wanted[post_id] and post_id in liked]
+
+    Like.objects.bulk_create([Like(member=member, post_id=post_id) for post_id in add], ignore_conflicts=True)
+    Like.objects.filter(member=member, post_id__in=remove).delete()
+    deltas = [When(id=post_id, then=Value(1)) for post_id in add]
+    deltas += [When(id=post_id, then=Value(-1)) for post_id in remove]
+    if deltas:
+        Post.objects.filter(id__in=add + remove).update(
+            likes_count=Greatest(F('likes_count') + Case(*deltas, default=Value(0)), Value(0)),
+            updated_at=timezone.now(),
+        )
+
+    return [
+        {'status': 200, 'data': {'post_id': item['post_id'], 'liked': wanted[item['post_id']]}}
+        if item['post_id'] in existing
+        else _error(404, 'Post not found')
+        for item in items
+    ]
+
+
+@transaction.atomic
+def send_friend_requests(member, items):
+    """
+    Send friend requests, with the same checks as a single request.
+    """
+    usernames = {item['target_username'] for item in items}
+    targets = {
+        target.username: target
+        for target in Member.objects.filter(username__in=usernames).only('id', 'username')
+    }
+    requested = set(
+        Friendship.objects.filter(from_member=member, to_member__in=targets.values()).values_list(
+            'to_member_id', flat=True
+        )
+    )
+    friends = friend_graph.friend_ids(member.id)
+
+    results, friendships = [], []
+    for item in items:
+        target = targets.get(item['target_username'])
+        if target is None:
+            results.append(_error(404, 'Target user not found'))
+        elif target.id == member.id:
+            results.append(_error(400, 'Cannot send friend request to yourself'))
+        elif target.id in friends:
+            results.append(_error(409, 'Already friends'))
+        elif target.id in requested:
+            results.append(_error(409, 'Friend request already sent'))
+        else:
+            requested.add(target.id)
+            friendship = Friendship(from_member=member, to_member=target)
+            friendships.append(friendship)
+            results.append(friendship)
+    if not friendships:
+        return results
+
+    Friendship.objects.bulk_create(friendships)
+    friend_graph.invalidate(member.id, *(friendship.to_member_id for friendship in friendships))
+    for index, result in enumerate(results):
+        if isinstance(result, Friendship):
+            results[index] = {
+                'status': 201,
+                'data': {'id': result.id, 'target_username': result.to_member.username},
+            }
+    return results
@@ -0,0 +1,72 @@
+"""
+File-system cache shared by the workers of a host.
+
+Django's ``FileBasedCache`` lists the whole cache directory on every ``set``
+to decide whether to cull, and past ``MAX_ENTRIES`` deletes a random share of
+the entries, live or not. ``FileCache`` looks at most every ``CULL_INTERVAL``
+seconds per process, removes expired entries first and only samples live
+ones while the cache is still over ``MAX_ENTRIES``. ``add`` and ``incr`` hold
+an ``flock`` on a lock file next to the entries, so they are atomic across
+the workers.
+"""
+import fcntl
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+LOCK_FILE = 'lock'
+
+
+class FileCache(FileBasedCache):
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = float(params.get('OPTIONS', {}).get('CULL_INTERVAL', 60))
+        self._last_cull = None
+
+    @contextmanager
+    def _exclusive(self):
+        self._createdir()
+        fd = os.open(os.path.join(self._dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._exclusive():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._exclusive():
+            return super().incr(key, delta, version)
+
+    def _cull(self):
+        now = time.monotonic()
+        if self._last_cull is not None and now - self._last_cull < self._cull_interval:
+            return
+        self._last_cull = now
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        live = []
+        for fname in filelist:
+            try:
+                with open(fname, 'rb') as f:
+                    # Deletes the file when it has expired.
+                    if self._is_expired(f):
+                        continue
+            except FileNotFoundError:
+                continue
+            live.append(fname)
+        if len(live) < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+        for fname in random.sample(live, int(len(live) / self._cull_frequency)):
+            self._delete(fname)
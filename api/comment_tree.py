@@ -0,0 +1,86 @@
+"""
+Threaded comment loading.
+
+Every comment stores its thread ``root`` and a materialized ``path``, so the
+replies below a set of sibling comments are one range scan over the
+``(root, path)`` index, already in depth-first order. A page of siblings and
+a bounded window of their replies therefore take two queries, however deep
+the threads are. Comments whose replies were cut off by the window report a
+``replies_count`` larger than the replies loaded, and clients page through
+them with ``?parent=<comment id>``.
+"""
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber, Substr
+from django.utils import timezone
+
+from .models import Comment, Post
+
+
+def siblings_queryset(post, parent=None):
+    """
+    The direct replies of ``parent``, or the top-level comments of the post.
+    """
+    return Comment.objects.filter(post=post, parent=parent).select_related('author')
+
+
+def attach_replies(comments, depth, limit):
+    """
+    Load up to ``limit`` replies below each of the sibling ``comments``, at
+    most ``depth`` levels down, onto ``loaded_replies`` of their parents.
+    """
+    for comment in comments:
+        comment.loaded_replies = []
+    if not comments or depth < 1:
+        return comments
+    level = comments[0].depth
+    prefix = len(comments[0].path)
+    if level == 0:
+        threads = Q(root_id__in=[comment.id for comment in comments])
+    else:
+        threads = Q(root_id=comments[0].root_id) & Q(
+            *[Q(path__startswith=comment.path) for comment in comments], _connector=Q.OR
+        )
+    replies = (
+        Comment.objects.filter(threads, depth__gt=level, depth__lte=level + depth)
+        .select_related('author')
+        .annotate(
+            position=Window(RowNumber(), partition_by=Substr('path', 1, prefix), order_by=F('path').asc())
+        )
+        .filter(position__lte=limit)
+        .order_by('path')
+    )
+    nodes = {comment.path: comment for comment in comments}
+    # Depth-first order and a prefix-closed window guarantee that a reply's
+    # parent has been seen before the reply itself.
+    for reply in replies:
+        reply.loaded_replies = []
+        nodes[reply.path[:-Comment.PATH_STEP]].loaded_replies.append(reply)
+        nodes[reply.path] = reply
+    return comments
+
+
+def flatten(comments):
+    """
+    The comments and every reply loaded below them.
+    """
+    result = []
+    stack = list(reversed(comments))
+    while stack:
+        comment = stack.pop()
+        result.append(comment)
+        stack.extend(reversed(getattr(comment, 'loaded_replies', [])))
+    return result
+
+
+def comment_deleted(sender, instance, **kwargs):
+    """
+    Keep the post's ``comments_count`` and the parent's ``replies_count`` in
+    step when a comment is deleted, including replies deleted with it.
+    """
+    Post.objects.filter(id=instance.post_id, comments_count__gt=0).update(
+        comments_count=F('comments_count') - 1, updated_at=timezone.now()
+    )
+    if instance.parent_id:
+        Comment.objects.filter(id=instance.parent_id, replies_count__gt=0).update(
+            replies_count=F('replies_count') - 1
+        )
@@ -0,0 +1,114 @@
+"""
+Compiled read path for serializers.
+
+DRF serializes a row by walking the serializer's fields, resolving each
+field's source through ``get_attribute`` and calling its
+``to_representation``. Serializers using ``CompiledFieldsMixin`` do that
+work once per serializer instance instead: every readable field is turned
+into a getter, and plain model fields become an ``attrgetter`` plus an
+inline conversion. A list serializer reuses its child, so a page pays for
+the compilation once. Nested serializers, method fields and anything
+unusual keep DRF's own path, and the output is identical to it.
+"""
+from datetime import datetime
+from operator import attrgetter
+
+from rest_framework import ISO_8601, fields
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+
+
+def represent(field, instance):
+    """
+    DRF's representation of one field of ``instance``, as in
+    ``Serializer.to_representation``.
+    """
+    attribute = field.get_attribute(instance)
+    check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+    return None if check_for_none is None else field.to_representation(attribute)
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if not isinstance(output_format, str) or output_format.lower() != ISO_8601 or zone is None:
+        return field.to_representation
+
+    def convert(value):
+        # The current time zone is read once, when the fields are compiled.
+        if type(value) is not datetime or value.utcoffset() is None:
+            return field.to_representation(value)
+        value = value.astimezone(zone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _converter(field):
+    method = type(field).to_representation
+    if method is fields.CharField.to_representation:
+        return lambda value: value if type(value) is str else str(value)
+    if method is fields.IntegerField.to_representation:
+        return lambda value: value if type(value) is int else int(value)
+    if method is fields.BooleanField.to_representation:
+        return lambda value: value if type(value) is bool else field.to_representation(value)
+    if method is fields.DateTimeField.to_representation:
+        return _datetime_converter(field)
+    if method is fields.ReadOnlyField.to_representation or (
+        method is fields.JSONField.to_representation and not field.binary
+    ):
+        return None
+    return field.to_representation
+
+
+def compile_field(field):
+    """
+    A function returning the representation of ``field`` for an instance.
+    """
+    if isinstance(field, (BaseSerializer, fields.SerializerMethodField)) or len(field.source_attrs) != 1:
+        return lambda instance: represent(field, instance)
+    get = attrgetter(field.source_attrs[0])
+    convert = _converter(field)
+
+    def getter(instance):
+        try:
+            value = get(instance)
+        except AttributeError:
+            # Defaults, nulls and skipped fields are left to DRF.
+            return represent(field, instance)
+        if value is None:
+            return None
+        if callable(value):
+            # DRF calls methods named as a source; leave them to it.
+            return represent(field, instance)
+        return value if convert is None else convert(value)
+    return getter
+
+
+class CompiledFieldsMixin:
+    """
+    Serializes with getters compiled from the readable fields on first use.
+    Set ``compile_fields = False`` to go through DRF's field-by-field path.
+    """
+    compile_fields = True
+
+    def compiled_fields(self):
+        plan = self.__dict__.get('_compiled_fields')
+        if plan is None:
+            if self.compile_fields:
+                plan = [(field, compile_field(field)) for field in self._readable_fields]
+            else:
+                plan = [(field, lambda instance, field=field: represent(field, instance))
+                        for field in self._readable_fields]
+            self._compiled_fields = plan
+        return plan
+
+    def to_representation(self, instance):
+        ret = {}
+        for field, getter in self.compiled_fields():
+            try:
+                ret[field.field_name] = getter(instance)
+            except SkipField:
+                continue
+        return ret
@@ -0,0 +1,140 @@
+"""
+Validators for conditional GET requests.
+
+Posts, profiles and feeds are answered with ``304 Not Modified`` when the
+client's ``If-None-Match`` or ``If-Modified-Since`` still matches, before any
+serialization. Validators are built from ``Post.updated_at`` and from opaque
+version tokens kept in the cache: one per member profile, bumped when the
+member is saved, and one per member feed, bumped when a post lands in the
+feed or a friendship changes. Versions are bumped after commit so a request
+can never pair a new version with data read before the change. A feed page
+is validated by the posts on it as well, so likes, comments, edits and
+author profile changes show up without a feed version bump.
+
+ETags are weak: presence is reflected only as online/offline.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import presence
+from .models import Member, Post
+
+PROFILE_KEY = 'conditional:profile:{}'
+FEED_KEY = 'conditional:feed:{}'
+PULL_FEED_KEY = 'conditional:feed:pull'
+
+
+def _new_version():
+    return format(time.time_ns(), 'x')
+
+
+def _version(key):
+    return cache.get_or_set(key, _new_version, None)
+
+
+def _versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+    return [versions.get(key) or missing[key] for key in keys]
+
+
+def _bump(keys):
+    keys = list(keys)
+    transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, _new_version()), None))
+
+
+def bump_profiles(*member_ids):
+    _bump(PROFILE_KEY.format(member_id) for member_id in member_ids)
+
+
+def bump_profile(sender, instance, **kwargs):
+    bump_profiles(instance.pk)
+
+
+def bump_feeds(member_ids):
+    _bump(FEED_KEY.format(member_id) for member_id in member_ids)
+
+
+def bump_pulled_feeds():
+    """
+    Invalidate every feed that reads a fan-out-on-read author.
+    """
+    _bump([PULL_FEED_KEY])
+
+
+def _etag(*parts):
+    digest = hashlib.blake2b(':'.join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _online(member_id):
+    return presence.is_online(presence.last_seen_many([member_id])[member_id])
+
+
+def post_validators(post_id):
+    """
+    ETag and modification time of a post, or None if it does not exist.
+    """
+    row = Post.objects.filter(id=post_id).values_list('updated_at', 'author_id').first()
+    if row is None:
+        return None
+    updated_at, author_id = row
+    etag = _etag('post', post_id, updated_at.isoformat(), _version(PROFILE_KEY.format(author_id)), _online(author_id))
+    return etag, updated_at
+
+
+def profile_validators(username):
+    member_id = Member.objects.filter(username=username).values_list('id', flat=True).first()
+    if member_id is None:
+        return None
+    return _etag('profile', member_id, _version(PROFILE_KEY.format(member_id)), _online(member_id)), None
+
+
+def feed_validators(member, posts):
+    """
+    ETag of a page of the member's feed, given the posts on it.
+    """
+    author_ids = sorted({post.author_id for post in posts})
+    profiles = _versions([PROFILE_KEY.format(author_id) for author_id in author_ids])
+    online = presence.online_ids(author_ids)
+    return _etag(
+        'feed', member.id, _version(FEED_KEY.format(member.id)), _version(PULL_FEED_KEY),
+        *(f'{post.id}@{post.updated_at.isoformat()}' for post in posts),
+        *(f'{author_id}@{profile}@{author_id in online}' for author_id, profile in zip(author_ids, profiles)),
+    ), None
+
+
+def not_modified(request, validators):
+    """
+    A 304 response if the request's preconditions match, otherwise None.
+    """
+    if validators is None:
+        return None
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        set_validators(request, response, validators)
+    return response
+
+
+def set_validators(request, response, validators):
+    if validators is None:
+        return response
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, no_cache=True, private=request.user.is_authenticated)
+    patch_vary_headers(response, ['Cookie', 'Authorization'])
+    return response
@@ -0,0 +1,104 @@
+"""
+Streaming export of a member's data as NDJSON.
+
+The export is one JSON object per line: the member's profile, then their
+posts, comments, likes, friendships, chats and the messages of those chats,
+each section in id order. Rows are read with ``.values().iterator()`` in
+``EXPORT_ITERATOR_CHUNK_SIZE`` batches and written out in blocks of about
+``EXPORT_BUFFER_SIZE`` bytes, so memory stays flat however long the history.
+
+Every record carries a ``cursor``. Passing the last one received as
+``?cursor=`` resumes the export after that record; a stream that ends with
+an ``end`` record is complete.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework.exceptions import ValidationError
+
+from .models import Chat, Comment, Friendship, Like, Member, Message, Post
+from .renderers import JSONRenderer
+
+SECTIONS = {
+    'member': lambda member: Member.objects.filter(pk=member.pk).values(
+        'id', 'username', 'email', 'avatar', 'last_seen', 'created_at'
+    ),
+    'post': lambda member: Post.objects.filter(author=member).values(
+        'id', 'content', 'media', 'media_urls', 'likes_count', 'comments_count', 'created_at', 'updated_at'
+    ),
+    'comment': lambda member: Comment.objects.filter(author=member).values(
+        'id', 'post_id', 'parent_id', 'text', 'created_at'
+    ),
+    'like': lambda member: Like.objects.filter(member=member).values('id', 'post_id', 'created_at'),
+    'friendship': lambda member: Friendship.objects.filter(
+        Q(from_member=member) | Q(to_member=member)
+    ).values(
+        'id', 'status', 'created_at', from_username=F('from_member__username'), to_username=F('to_member__username')
+    ),
+    'chat': lambda member: Chat.objects.filter(members=member).values('id', 'created_at'),
+    'message': lambda member: Message.objects.filter(chat__members=member).values(
+        'id', 'chat_id', 'text', 'created_at', author_username=F('author__username')
+    ),
+}
+
+
+def parse_cursor(cursor):
+    """
+    The section and last id of an export cursor, or ``(None, 0)`` to start
+    from the beginning.
+    """
+    if not cursor:
+        return None, 0
+    section, _, last_id = cursor.partition(':')
+    if section not in SECTIONS or not last_id.isdigit():
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return section, int(last_id)
+
+
+def records(member, cursor=None):
+    """
+    The export records of ``member`` after ``cursor``.
+    """
+    start, last_id = parse_cursor(cursor)
+    sections = list(SECTIONS)
+    if start is not None:
+        sections = sections[sections.index(start):]
+    for section in sections:
+        rows = SECTIONS[section](member).order_by('id')
+        if section == start:
+            rows = rows.filter(id__gt=last_id)
+        for row in rows.iterator(chunk_size=settings.EXPORT_ITERATOR_CHUNK_SIZE):
+            yield {'type': section, 'cursor': f"{section}:{row['id']}", 'data': row}
+    yield {'type': 'end'}
+
+
+def stream(member, cursor=None):
+    """
+    The export as NDJSON, in blocks of roughly ``EXPORT_BUFFER_SIZE`` bytes.
+    """
+    render = JSONRenderer().render
+    buffer, size = [], 0
+    for record in records(member, cursor):
+        line = render(record) + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= settings.EXPORT_BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def astream(member, cursor=None):
+    """
+    ``stream`` for an event-loop server, which would otherwise read a sync
+    iterator to the end before sending any of it.
+    """
+    blocks = stream(member, cursor)
+    # Thread-sensitive, so every block is read on the thread holding the cursor.
+    pull = sync_to_async(next)
+    try:
+        while (block := await pull(blocks, None)) is not None:
+            yield block
+    finally:
+        await sync_to_async(blocks.close)()
@@ -0,0 +1,185 @@
+"""
+Cache of serialized model fragments.
+
+Serializers using ``FragmentCacheMixin`` store the static part of their
+output in the cache and only compute dynamic fields (nested serializers,
+presence, method fields) per request. List serializers load every fragment of
+a page with one ``get_many`` and write the misses back with one ``set_many``.
+
+Post fragments are keyed by ``updated_at``, which edits and counter changes
+bump, so they never need invalidating. Member fragments are dropped when the
+member is saved.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.fields import SkipField
+from rest_framework.serializers import BaseSerializer
+
+from .compiled import CompiledFieldsMixin
+
+CONTEXT_KEY = 'fragments'
+MEMBER_KINDS = ('member', 'member_min')
+
+
+class FragmentStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_lock = threading.Lock()
+_totals = FragmentStats()
+_request_stats = ContextVar('fragment_stats', default=None)
+
+
+def track():
+    """
+    Start counting hits and misses for the current request.
+    """
+    stats = FragmentStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def totals():
+    """
+    Hits and misses of this process since it started.
+    """
+    return _totals
+
+
+def _record(hits, misses):
+    with _lock:
+        _totals.hits += hits
+        _totals.misses += misses
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.hits += hits
+        stats.misses += misses
+
+
+class FragmentStore:
+    """
+    Fragments loaded for one serialization, plus misses waiting to be saved.
+    """
+
+    def __init__(self):
+        self.loaded = {}
+        self.pending = {}
+
+    def prime(self, keys):
+        missing = [key for key in dict.fromkeys(keys) if key not in self.loaded]
+        if missing:
+            found = cache.get_many(missing)
+            for key in missing:
+                self.loaded[key] = found.get(key)
+
+    def get(self, key):
+        self.prime([key])
+        fragment = self.loaded[key]
+        _record(fragment is not None, fragment is None)
+        return fragment
+
+    def put(self, key, fragment):
+        self.loaded[key] = self.pending[key] = fragment
+
+    def flush(self):
+        if self.pending:
+            cache.set_many(self.pending, settings.FRAGMENT_CACHE_TIMEOUT)
+            self.pending = {}
+
+
+@contextmanager
+def batch(context):
+    """
+    Share one store across a serialization; the outermost caller saves it.
+    """
+    store = context.get(CONTEXT_KEY)
+    if store is not None:
+        yield store
+        return
+    store = context[CONTEXT_KEY] = FragmentStore()
+    try:
+        yield store
+        store.flush()
+    finally:
+        del context[CONTEXT_KEY]
+
+
+def prime(context, keys):
+    with batch(context) as store:
+        store.prime(keys)
+
+
+def member_key(member_id, kind='member'):
+    return f'fragment:{kind}:{member_id}'
+
+
+def post_key(post):
+    return f'fragment:post:{post.id}:{post.updated_at.timestamp()}'
+
+
+def invalidate_members(*member_ids):
+    """
+    Drop cached member fragments, now and again after commit so a request
+    that read the old row cannot put it back.
+    """
+    keys = [member_key(member_id, kind) for member_id in member_ids for kind in MEMBER_KINDS]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_member(sender, instance, **kwargs):
+    invalidate_members(instance.pk)
+
+
+class FragmentCacheMixin(CompiledFieldsMixin):
+    """
+    Caches the representation of a ``ModelSerializer`` except for nested
+    serializers and the fields listed in ``dynamic_fields``. Subclasses
+    define ``fragment_key(instance)``.
+    """
+    dynamic_fields = ()
+
+    def is_dynamic(self, field):
+        return field.field_name in self.dynamic_fields or isinstance(field, BaseSerializer)
+
+    def to_representation(self, instance):
+        store = self.context.get(CONTEXT_KEY)
+        if store is None:
+            with batch(self.context):
+                return self.to_representation(instance)
+        plan = self.compiled_fields()
+        key = self.fragment_key(instance)
+        fragment = store.get(key)
+        if fragment is None:
+            fragment = {}
+            for field, getter in plan:
+                if not self.is_dynamic(field):
+                    try:
+                        fragment[field.field_name] = getter(instance)
+                    except SkipField:
+                        continue
+            store.put(key, fragment)
+        ret = {}
+        for field, getter in plan:
+            name = field.field_name
+            if name in fragment:
+                ret[name] = fragment[name]
+            elif self.is_dynamic(field):
+                try:
+                    ret[name] = getter(instance)
+                except SkipField:
+                    continue
+        return ret
@@ -0,0 +1,79 @@
+"""
+Accepted-friend sets, cached per member.
+
+A member's friends are the other ends of their accepted friendships in
+either direction. The set is computed with two indexed queries on first use
+and kept in Django's cache until a friendship involving the member changes,
+so membership checks, counts and intersections are answered from memory.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Friendship
+
+CACHE_KEY = 'friend_graph:friends:{}'
+
+
+def _load(member_id):
+    sent = Friendship.objects.filter(
+        from_member_id=member_id, status=Friendship.STATUS_ACCEPTED
+    ).values_list('to_member_id', flat=True)
+    received = Friendship.objects.filter(
+        to_member_id=member_id, status=Friendship.STATUS_ACCEPTED
+    ).values_list('from_member_id', flat=True)
+    return frozenset(sent) | frozenset(received)
+
+
+def friend_ids(member_id):
+    """
+    Ids of the member's accepted friends.
+    """
+    key = CACHE_KEY.format(member_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = _load(member_id)
+        cache.set(key, ids, settings.FRIEND_GRAPH_CACHE_TIMEOUT)
+    return ids
+
+
+def friend_ids_many(member_ids):
+    """
+    Map each member id to its friend set, loading misses individually.
+    """
+    keys = {CACHE_KEY.format(member_id): member_id for member_id in member_ids}
+    cached = cache.get_many(keys)
+    result = {keys[key]: ids for key, ids in cached.items()}
+    missing = {}
+    for key, member_id in keys.items():
+        if member_id not in result:
+            result[member_id] = missing[key] = _load(member_id)
+    if missing:
+        cache.set_many(missing, settings.FRIEND_GRAPH_CACHE_TIMEOUT)
+    return result
+
+
+def are_friends(member_id, other_id):
+    return other_id in friend_ids(member_id)
+
+
+def friend_count(member_id):
+    return len(friend_ids(member_id))
+
+
+def mutual_friend_ids(member_id, other_id):
+    friends = friend_ids_many([member_id, other_id])
+    return friends[member_id] & friends[other_id]
+
+
+def invalidate(*member_ids):
+    """
+    Drop the cached friend sets of members whose friendships changed.
+
+    The keys are deleted right away and again once the surrounding
+    transaction commits, so a concurrent request cannot re-cache the set
+    from a snapshot taken before the change became visible.
+    """
+    keys = [CACHE_KEY.format(member_id) for member_id in member_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,146 @@
+import re
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from api.models import Member
+from api.pagination import (
+    ChatMessagesPagination,
+    ChatsPagination,
+    FeedPagination,
+    FriendsPagination,
+)
+from api.seed import seed_social_graph
+from api.views import (
+    ChatMessagesView,
+    FriendsView,
+    MessagesChatsView,
+    PostDetailView,
+    PostsListCreateView,
+    ProfileView,
+)
+
+# Plan lines that mean every row of a table or index is visited.
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\S+)'),
+}
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR (ORDER BY|DISTINCT)'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Explain the queries behind the read views and flag full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--member',
+            help="Username to run the views as. Defaults to the member with the most friends.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            metavar='MEMBERS',
+            help="Seed a synthetic graph of this many members first and roll it back afterwards.",
+        )
+        parser.add_argument(
+            '--strict',
+            action='store_true',
+            help="Exit with an error if any full table scan is found.",
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    seed_social_graph(members=options['seed'], prefix='advisor')
+                    # Give the planner statistics on the freshly seeded tables.
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                findings = self.advise(options['member'])
+                if options['seed']:
+                    raise Rollback
+        except Rollback:
+            pass
+        if findings and options['strict']:
+            raise CommandError(f"{findings} full table scan(s) found")
+
+    def get_member(self, username):
+        if username:
+            try:
+                return Member.objects.get(username=username)
+            except Member.DoesNotExist:
+                raise CommandError(f"Member {username!r} does not exist")
+        member = (
+            Member.objects.annotate(degree=Count('sent_requests') + Count('received_requests'))
+            .order_by('-degree')
+            .first()
+        )
+        if member is None:
+            raise CommandError("The database has no members; use --seed")
+        return member
+
+    def get_querysets(self, member):
+        request = SimpleNamespace(user=member, method='GET', query_params={})
+
+        def view(view_class, **kwargs):
+            instance = view_class()
+            instance.request = request
+            instance.kwargs = kwargs
+            instance.format_kwarg = None
+            return instance
+
+        chat = member.chats.first()
+        post = member.posts.first()
+
+        def first_page(paginator, queryset):
+            return paginator.get_page_queryset(queryset, paginator.start_at_end, None)[
+                : paginator.page_size + 1
+            ]
+
+        querysets = {
+            'posts_list_create': first_page(FeedPagination(), view(PostsListCreateView).get_queryset()),
+            'profile': view(ProfileView).get_queryset().filter(username=member.username),
+            'friends': first_page(FriendsPagination(), view(FriendsView).get_friends_queryset(member)),
+            'messages_chats': first_page(ChatsPagination(), view(MessagesChatsView).get_queryset()),
+        }
+        if post is not None:
+            querysets['post_detail'] = view(PostDetailView).get_queryset().filter(id=post.id)
+        if chat is not None:
+            querysets['chat_messages'] = first_page(
+                ChatMessagesPagination(), view(ChatMessagesView, chat_id=chat.id).get_queryset()
+            )
+        return querysets
+
+    def advise(self, username):
+        member = self.get_member(username)
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f"Query plans are not supported on {vendor}")
+        self.stdout.write(f"Explaining view queries as {member.username} on {vendor}\n")
+        findings = 0
+        for route, queryset in self.get_querysets(member).items():
+            plan = queryset.explain()
+            scans = [m.group(1) for m in FULL_SCAN_PATTERNS[vendor].finditer(plan)]
+            sorts = SORT_PATTERNS[vendor].findall(plan)
+            if scans:
+                findings += len(scans)
+                status = self.style.ERROR(f"FULL SCAN of {', '.join(scans)}")
+            elif sorts:
+                status = self.style.WARNING("temporary sort")
+            else:
+                status = self.style.SUCCESS("ok")
+            self.stdout.write(f"{route}: {status}")
+            if self.verbosity > 1:
+                self.stdout.write(plan + '\n')
+        return findings
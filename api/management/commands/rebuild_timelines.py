@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api import timeline
+from api.models import Member
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized home timelines from posts and friendships."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames',
+            nargs='*',
+            help="Only rebuild the timelines of these members.",
+        )
+
+    def handle(self, *args, **options):
+        members = Member.objects.all()
+        if options['usernames']:
+            members = members.filter(username__in=options['usernames'])
+        count = 0
+        for member in members.iterator():
+            timeline.rebuild(member)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} timelines"))
@@ -0,0 +1,55 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Comment, Like, Post
+
+
+def _count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(post_id=OuterRef('pk'))
+            .order_by()
+            .values('post_id')
+            .annotate(total=Count('id'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Recompute Post.likes_count and Post.comments_count where they drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of posts checked per query.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = fixed = 0
+        while True:
+            ids = list(Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # One UPDATE recomputes the counts, so likes and comments written
+            # while the command runs are counted rather than overwritten.
+            fixed += (
+                Post.objects.filter(id__gte=ids[0], id__lte=ids[-1])
+                .annotate(actual_likes=_count_subquery(Like), actual_comments=_count_subquery(Comment))
+                .filter(~Q(likes_count=F('actual_likes')) | ~Q(comments_count=F('actual_comments')))
+                .update(
+                    likes_count=_count_subquery(Like),
+                    comments_count=_count_subquery(Comment),
+                    updated_at=timezone.now(),
+                )
+            )
+            checked += len(ids)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} posts, fixed {fixed}"))
@@ -0,0 +1,98 @@
+import asyncio
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+
+def encode_push(*items):
+    parts = [b'*%d\r\n' % len(items)]
+    for item in items:
+        if isinstance(item, int):
+            parts.append(b':%d\r\n' % item)
+        else:
+            parts.append(b'$%d\r\n%s\r\n' % (len(item), item))
+    return b''.join(parts)
+
+
+class Broker:
+    """
+    The subset of the Redis protocol used by ``api.realtime.RedisBus``:
+    PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE and QUIT.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    async def read_command(self, reader):
+        header = await reader.readline()
+        if not header:
+            return None
+        if not header.startswith(b'*'):
+            return header.split()
+        args = []
+        for _ in range(int(header[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        channels = set()
+        try:
+            while (command := await self.read_command(reader)) is not None:
+                if not command:
+                    continue
+                name, args = command[0].upper(), command[1:]
+                if name == b'PING':
+                    writer.write(b'+PONG\r\n')
+                elif name == b'PUBLISH' and len(args) == 2:
+                    channel, payload = args
+                    receivers = list(self.subscribers.get(channel, ()))
+                    for receiver in receivers:
+                        receiver.write(encode_push(b'message', channel, payload))
+                    writer.write(b':%d\r\n' % len(receivers))
+                elif name == b'SUBSCRIBE' and args:
+                    for channel in args:
+                        channels.add(channel)
+                        self.subscribers[channel].add(writer)
+                        writer.write(encode_push(b'subscribe', channel, len(channels)))
+                elif name == b'UNSUBSCRIBE':
+                    for channel in args or list(channels):
+                        channels.discard(channel)
+                        self.subscribers[channel].discard(writer)
+                        writer.write(encode_push(b'unsubscribe', channel, len(channels)))
+                elif name == b'QUIT':
+                    writer.write(b'+OK\r\n')
+                    break
+                else:
+                    writer.write(b'-ERR unsupported command\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = "Run a minimal Redis-compatible pub/sub broker for real-time events."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6380)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Event broker listening on {options['host']}:{options['port']}")
+        try:
+            asyncio.run(Broker().serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
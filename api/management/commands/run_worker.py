@@ -0,0 +1,48 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import media, passwords, presence, tasks
+
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = "Run background tasks queued by the API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queues',
+            nargs='*',
+            help="Only run these queues (default: every queue in TASK_QUEUES).",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Run the tasks that are due now and exit.",
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done = tasks.run_pending(options['queues'])
+            self.stdout.write(self.style.SUCCESS(f"Ran {done} tasks"))
+            return
+
+        worker = tasks.Worker(options['queues'])
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        worker.start()
+        self.stdout.write(f"Worker running queues: {', '.join(worker.queues)}")
+        pruned = time.monotonic()
+        while not stopped.wait(max(1, settings.PRESENCE_FLUSH_INTERVAL)):
+            presence.publish_offline()
+            if time.monotonic() - pruned >= PRUNE_INTERVAL:
+                tasks.prune()
+                media.prune_uploads()
+                passwords.prune_failures()
+                pruned = time.monotonic()
+        worker.stop()
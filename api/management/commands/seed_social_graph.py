@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.models import Chat, Member, Message, Post
+from api.seed import DEGREE_DISTRIBUTIONS, seed_social_graph
+
+
+class Command(BaseCommand):
+    help = "Create a synthetic social graph for load tests and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=1000)
+        parser.add_argument('--friends', type=int, default=10, help="Mean number of friends per member.")
+        parser.add_argument(
+            '--degree-distribution',
+            choices=DEGREE_DISTRIBUTIONS,
+            default='fixed',
+            help="How the number of friends varies between members.",
+        )
+        parser.add_argument('--posts', type=int, default=5, help="Posts per member.")
+        parser.add_argument('--likes', type=int, default=3, help="Likes per post.")
+        parser.add_argument('--comments', type=int, default=2, help="Comments per post.")
+        parser.add_argument('--chats', type=int, default=3, help="Chats started per member.")
+        parser.add_argument('--messages', type=int, default=20, help="Messages per chat.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix of the created members.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+
+    def handle(self, *args, **options):
+        created = seed_social_graph(
+            members=options['members'],
+            friends_per_member=options['friends'],
+            posts_per_member=options['posts'],
+            likes_per_post=options['likes'],
+            comments_per_post=options['comments'],
+            chats_per_member=options['chats'],
+            messages_per_chat=options['messages'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            degree_distribution=options['degree_distribution'],
+        )
+        members = Member.objects.filter(id__in=[member.id for member in created])
+        degrees = sorted(
+            members.annotate(
+                degree=Count('sent_requests', distinct=True) + Count('received_requests', distinct=True)
+            ).values_list('degree', flat=True)
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {len(created)} members, "
+                f"{Post.objects.filter(author__in=members).count()} posts, "
+                f"{Chat.objects.filter(members__in=members).distinct().count()} chats and "
+                f"{Message.objects.filter(author__in=members).count()} messages; "
+                f"friends per member: median {degrees[len(degrees) // 2] if degrees else 0}, "
+                f"max {degrees[-1] if degrees else 0}, "
+                f"{members.filter(fanout_on_read=True).count()} members fan out on read"
+            )
+        )
@@ -0,0 +1,246 @@
+"""
+Content-addressed media storage.
+
+Uploads are resumable: the client creates an upload of a known size, then
+sends the bytes in as many requests as it likes, each appending at the
+offset the server last acknowledged. Chunks are streamed to a part file in
+``UPLOAD_TEMP_DIR`` without being held in memory, so an interrupted upload
+resumes where it stopped. The complete file is hashed and moved to
+``<MEDIA_ROOT>/ab/cd/<sha256>/``; when that hash is already stored the new
+copy is dropped, so duplicates cost nothing.
+
+The worker renders the resized variants next to the original. Media URLs
+depend on the hash alone, so posts can carry them before the variants exist;
+until then the original is served in their place.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import tasks
+from .models import Media, Upload
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it the original is served for every variant.
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL = 'original'
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'video/mp4': 'mp4',
+}
+RESIZABLE = {'image/jpeg', 'image/png', 'image/webp'}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff(head):
+    """
+    The content type of a file from its first bytes, or None if it is not a
+    type we accept. The type the client claims is never trusted.
+    """
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    return None
+
+
+def variant_names():
+    return [ORIGINAL, *settings.MEDIA_VARIANTS]
+
+
+def directory(sha256):
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def urls(sha256):
+    """
+    The URL of every variant of the media with this hash.
+    """
+    return {name: reverse('media_file', args=[sha256, name]) for name in variant_names()}
+
+
+def locate(media, variant):
+    """
+    The path of a variant relative to ``MEDIA_ROOT``, and whether it is the
+    variant itself rather than the original standing in for it.
+    """
+    name = media.variants.get(variant)
+    if name is None:
+        return f'{directory(media.sha256)}/{ORIGINAL}.{EXTENSIONS[media.content_type]}', variant == ORIGINAL
+    return f'{directory(media.sha256)}/{name}', True
+
+
+def part_path(upload):
+    return settings.UPLOAD_TEMP_DIR / f'{upload.id}.part'
+
+
+def append(upload, offset, stream, length):
+    """
+    Write ``length`` bytes read from ``stream`` at ``offset`` of the upload
+    and return the new offset. The offset must be the one the server holds,
+    so a chunk that was resent after a lost response is not written twice.
+    If the stream breaks off, the bytes received so far are kept. The chunk
+    that completes the upload stores it while still holding the lock, so
+    concurrent final chunks store it once.
+    """
+    if offset + length > upload.size:
+        raise UploadError('Chunk runs past the end of the upload', 413)
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Upload is being written by another request', 409)
+        # Read again under the lock: a concurrent request may have moved it.
+        upload.offset, upload.media_id = (
+            Upload.objects.filter(pk=upload.pk).values_list('offset', 'media_id').get()
+        )
+        if upload.media_id:
+            # Completed meanwhile; drop the part file opening it recreated.
+            path.unlink(missing_ok=True)
+            upload.media = Media.objects.get(pk=upload.media_id)
+            return upload.offset
+        if offset != upload.offset:
+            raise UploadError('Upload-Offset does not match the upload', 409)
+        file.seek(offset)
+        file.truncate()
+        remaining = length
+        try:
+            while remaining:
+                chunk = stream.read(min(settings.UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                file.write(chunk)
+                remaining -= len(chunk)
+        except OSError:
+            logger.info('Upload %s interrupted at %d bytes', upload.id, offset + length - remaining)
+        file.flush()
+        upload.offset = file.tell()
+        Upload.objects.filter(pk=upload.pk).update(offset=upload.offset, updated_at=timezone.now())
+        if upload.offset == upload.size:
+            complete(upload)
+    return upload.offset
+
+
+def complete(upload):
+    """
+    Store a fully written upload under its content hash and return its
+    ``Media``, queueing the variants of new images.
+    """
+    path = part_path(upload)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        head = file.read(settings.UPLOAD_CHUNK_SIZE)
+        chunk = head
+        while chunk:
+            digest.update(chunk)
+            chunk = file.read(settings.UPLOAD_CHUNK_SIZE)
+    content_type = sniff(head)
+    if content_type is None:
+        path.unlink()
+        upload.delete()
+        raise UploadError('Unsupported media type', 415)
+
+    sha256 = digest.hexdigest()
+    target = settings.MEDIA_ROOT / directory(sha256) / f'{ORIGINAL}.{EXTENSIONS[content_type]}'
+    if target.exists():
+        path.unlink()
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    resizable = content_type in RESIZABLE and Image is not None
+    with transaction.atomic():
+        media, created = Media.objects.get_or_create(
+            sha256=sha256,
+            defaults={
+                'content_type': content_type,
+                'size': upload.size,
+                'status': Media.STATUS_PENDING if resizable else Media.STATUS_READY,
+            },
+        )
+        if created and resizable:
+            tasks.enqueue(render_variants, {'sha256': sha256}, key=f'render_variants:{sha256}')
+        upload.media = media
+        Upload.objects.filter(pk=upload.pk).update(media=media)
+    return media
+
+
+def _render(image, longest, path):
+    image = image.copy()
+    image.thumbnail((longest, longest))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        name = f'{path.name}.png'
+        image.save(path.with_name(f'.{name}'), 'PNG', optimize=True)
+    else:
+        name = f'{path.name}.jpg'
+        image.convert('RGB').save(path.with_name(f'.{name}'), 'JPEG', quality=85, optimize=True)
+    os.replace(path.with_name(f'.{name}'), path.with_name(name))
+    return name
+
+
+@tasks.task(queue='media')
+def render_variants(payload):
+    """
+    Render ``MEDIA_VARIANTS`` of an uploaded image next to its original.
+    """
+    media = Media.objects.get(sha256=payload['sha256'])
+    if Image is None:
+        Media.objects.filter(pk=media.pk).update(status=Media.STATUS_READY)
+        return
+    folder = settings.MEDIA_ROOT / directory(media.sha256)
+    original, _ = locate(media, ORIGINAL)
+    variants, size = {}, (None, None)
+    try:
+        with Image.open(settings.MEDIA_ROOT / original) as image:
+            image = ImageOps.exif_transpose(image)
+            size = image.size
+            for name, longest in settings.MEDIA_VARIANTS.items():
+                variants[name] = _render(image, longest, folder / name)
+    except (OSError, Image.DecompressionBombError):
+        # Leave the original in place of the variants rather than retrying.
+        logger.warning('Cannot render variants of media %s', media.sha256, exc_info=True)
+        variants = {}
+    Media.objects.filter(pk=media.pk).update(
+        variants=variants, width=size[0], height=size[1], status=Media.STATUS_READY
+    )
+
+
+def prune_uploads():
+    """
+    Delete uploads untouched for ``UPLOAD_EXPIRY`` seconds and their part
+    files. Stored media are kept.
+    """
+    stale = Upload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRY))
+    for upload in stale.only('id'):
+        part_path(upload).unlink(missing_ok=True)
+    return stale.delete()[0]
@@ -0,0 +1,125 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import fragments
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    Database execute wrapper that counts queries and their total duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def get_query_budget(route_name):
+    return settings.QUERY_BUDGETS.get(route_name, settings.QUERY_BUDGET_DEFAULT)
+
+
+class QueryBudgetMiddleware:
+    """
+    Reports the SQL query count and database time of every request, and the
+    fragment cache hits and misses, in a ``Server-Timing`` header and logs
+    requests that exceed the query budget configured for their route in
+    ``QUERY_BUDGETS``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        fragment_stats = fragments.track()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        self.report(request, response, stats, fragment_stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        fragment_stats = fragments.track()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = await self.get_response(request)
+        self.report(request, response, stats, fragment_stats, time.perf_counter() - start)
+        return response
+
+    def report(self, request, response, stats, fragment_stats, total):
+        timings = [
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"',
+            f'app;dur={total * 1000:.2f}',
+        ]
+        if fragment_stats.hits or fragment_stats.misses:
+            timings.append(f'frag;desc="{fragment_stats.hits} hits, {fragment_stats.misses} misses"')
+        response['Server-Timing'] = ', '.join(timings)
+
+        match = request.resolver_match
+        route_name = match.url_name if match else None
+        budget = get_query_budget(route_name)
+        if stats.count > budget:
+            logger.warning(
+                "Query budget exceeded on %s %s (%s): %d queries, budget %d, %.2f ms in db",
+                request.method,
+                request.path,
+                route_name,
+                stats.count,
+                budget,
+                stats.duration * 1000,
+            )
+
+
+class AsyncViewMiddleware:
+    """
+    Serves views built on ``api.async_views.AsyncAPIViewMixin`` with their
+    async handlers, under ASGI only. WSGI workers call the view as usual, so
+    its sync handlers run without starting an event loop per request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        async_view = getattr(view_func, 'async_view', None)
+        if async_view is not None:
+            return await async_view(request, *view_args, **view_kwargs)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def populate_last_message(apps, schema_editor):
+    Chat = apps.get_model('api', 'Chat')
+    Message = apps.get_model('api', 'Message')
+    for chat in Chat.objects.iterator():
+        message = Message.objects.filter(chat=chat).order_by('-created_at', '-id').first()
+        chat.last_message = message
+        chat.last_activity = message.created_at if message else chat.created_at
+        chat.save(update_fields=['last_message', 'last_activity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.RunPython(populate_last_message, migrations.RunPython.noop),
+    ]
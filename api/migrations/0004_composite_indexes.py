@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_chat_last_message'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='timeline_member_created',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at'], name='comment_post_created'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['to_member', 'status'], name='friendship_to_status'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(condition=models.Q(('status', 'accepted')), fields=['from_member', 'to_member'], name='friendship_accepted_from'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(condition=models.Q(('status', 'accepted')), fields=['to_member', 'from_member'], name='friendship_accepted_to'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at', 'id'], name='message_chat_created'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['chat', 'author'], name='message_chat_unread'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at'], name='post_author_created'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['member', '-created_at', '-post'], name='timeline_member_feed'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# Full-text indexes for api.search. SQLite keeps FTS5 tables keyed by the
+# object id, filled here and kept in sync by signals. PostgreSQL keeps
+# generated tsvector columns with GIN indexes that the database maintains.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_member_fts USING fts5(username, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE api_post_fts USING fts5(content, author_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE api_message_fts USING fts5(text, chat, tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO api_member_fts (rowid, username) SELECT id, username FROM api_member",
+    "INSERT INTO api_post_fts (rowid, content, author_id) SELECT id, content, author_id FROM api_post",
+    "INSERT INTO api_message_fts (rowid, text, chat) SELECT id, text, chat_id FROM api_message",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE api_member_fts",
+    "DROP TABLE api_post_fts",
+    "DROP TABLE api_message_fts",
+]
+POSTGRESQL_FORWARD = [
+    "ALTER TABLE api_member ADD COLUMN search_vector tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('simple', username)) STORED",
+    "CREATE INDEX api_member_search ON api_member USING gin (search_vector)",
+    "ALTER TABLE api_post ADD COLUMN search_vector tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED",
+    "CREATE INDEX api_post_search ON api_post USING gin (search_vector)",
+    "ALTER TABLE api_message ADD COLUMN search_vector tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED",
+    "CREATE INDEX api_message_search ON api_message USING gin (search_vector)",
+]
+POSTGRESQL_BACKWARD = [
+    "ALTER TABLE api_member DROP COLUMN search_vector",
+    "ALTER TABLE api_post DROP COLUMN search_vector",
+    "ALTER TABLE api_message DROP COLUMN search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
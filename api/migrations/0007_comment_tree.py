@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+    nodes = {}
+    # Parents are always older than their replies, so id order visits them first.
+    for comment in Comment.objects.order_by('id').only('id', 'parent_id').iterator():
+        parent = nodes.get(comment.parent_id)
+        comment.path = (parent.path if parent else '') + format(comment.id, '012d')
+        comment.depth = parent.depth + 1 if parent else 0
+        comment.root_id = parent.root_id if parent else comment.id
+        comment.replies_count = 0
+        if parent:
+            parent.replies_count += 1
+        nodes[comment.id] = comment
+    Comment.objects.bulk_update(list(nodes.values()), ['path', 'depth', 'root', 'replies_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.comment'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'path'], name='comment_root_path'),
+        ),
+    ]
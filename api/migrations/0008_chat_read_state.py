@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, Max, Min, OuterRef
+
+
+def is_read_to_watermarks(apps, schema_editor):
+    """
+    Read each member up to just before the oldest message from someone else
+    that is still unread, or to the end of the chat if there is none.
+    """
+    Chat = apps.get_model('api', 'Chat')
+    ChatReadState = apps.get_model('api', 'ChatReadState')
+    Message = apps.get_model('api', 'Message')
+    last = dict(Message.objects.order_by().values('chat').annotate(last=Max('id')).values_list('chat', 'last'))
+    first_unread = {}
+    rows = Message.objects.filter(is_read=False).order_by().values('chat', 'author').annotate(first=Min('id'))
+    for row in rows.values_list('chat', 'author', 'first'):
+        first_unread.setdefault(row[0], []).append(row[1:])
+    states = []
+    for chat_id, member_id in Chat.members.through.objects.values_list('chat_id', 'member_id').iterator():
+        pending = [first for author_id, first in first_unread.get(chat_id, ()) if author_id != member_id]
+        watermark = min(pending) - 1 if pending else last.get(chat_id, 0)
+        states.append(ChatReadState(chat_id=chat_id, member_id=member_id, last_read_message_id=watermark))
+    ChatReadState.objects.bulk_create(states, batch_size=500)
+
+
+def watermarks_to_is_read(apps, schema_editor):
+    ChatReadState = apps.get_model('api', 'ChatReadState')
+    Message = apps.get_model('api', 'Message')
+    read = ChatReadState.objects.filter(
+        chat=OuterRef('chat'), last_read_message_id__gte=OuterRef('id')
+    ).exclude(member=OuterRef('author'))
+    Message.objects.filter(Exists(read)).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_comment_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='chat',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='api.chat'),
+        ),
+        migrations.AddField(
+            model_name='chatreadstate',
+            name='member',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_states', to='api.member'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatreadstate',
+            constraint=models.UniqueConstraint(fields=('chat', 'member'), name='chat_read_state_unique'),
+        ),
+        migrations.RunPython(is_read_to_watermarks, watermarks_to_is_read),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_chat_unread',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'id', 'author'], name='message_chat_id_author'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:02
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations
+
+
+def backfill_timelines(apps, schema_editor):
+    """
+    Fill the timelines of members who existed before they were materialized,
+    as ``manage.py rebuild_timelines`` would.
+    """
+    Friendship = apps.get_model('api', 'Friendship')
+    Member = apps.get_model('api', 'Member')
+    Post = apps.get_model('api', 'Post')
+    TimelineEntry = apps.get_model('api', 'TimelineEntry')
+
+    friends = defaultdict(set)
+    accepted = Friendship.objects.filter(status='accepted').values_list('from_member_id', 'to_member_id')
+    for from_id, to_id in accepted.iterator():
+        friends[from_id].add(to_id)
+        friends[to_id].add(from_id)
+    pull = {member_id for member_id, ids in friends.items() if len(ids) > settings.TIMELINE_FANOUT_LIMIT}
+    Member.objects.filter(id__in=pull).update(fanout_on_read=True)
+
+    for author_id in Member.objects.values_list('id', flat=True).iterator():
+        posts = Post.objects.filter(author_id=author_id).order_by('-created_at').values_list('id', 'created_at')
+        audience = {author_id} if author_id in pull else friends[author_id] | {author_id}
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(member_id=member_id, post_id=post_id, author_id=author_id, created_at=created_at)
+                for post_id, created_at in posts[:settings.TIMELINE_BACKFILL_SIZE]
+                for member_id in audience
+            ],
+            ignore_conflicts=True,
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_media_uploads'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
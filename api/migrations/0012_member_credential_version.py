@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_login_failure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='credential_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,19 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 
+class MemberQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        # update() sends no post_save; cached principals must not outlive a
+        # deactivation or a new password.
+        if kwargs.keys() & {'is_active', 'credential_version'}:
+            from .authentication import invalidate_principals
+            invalidate_principals(*self.values_list('pk', flat=True))
+        return super().update(**kwargs)
+
+
 class Member(models.Model):
     username = models.CharField(max_length=30, unique=True)
     email = models.EmailField(unique=True)
@@ -8,8 +21,20 @@ class Member(models.Model):
     avatar = models.URLField(blank=True, null=True)
     last_seen = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
+    fanout_on_read = models.BooleanField(default=False)
+    # Bumped when a new password is saved. Tokens and sessions are bound to it
+    # rather than to the hash, so rehashing with a newer hasher keeps them valid.
+    credential_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MemberQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='member_created_at'),
+            models.Index(fields=['last_seen'], name='member_last_seen'),
+        ]
+
     @property
     def is_authenticated(self):
         return True
@@ -28,12 +53,29 @@ class Member(models.Model):
         from django.contrib.auth.hashers import check_password
         return check_password(raw_password, self.password)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        member = super().from_db(db, field_names, values)
+        member._loaded_password = member.__dict__.get('password')
+        return member
+
+    def save(self, *args, **kwargs):
+        # A changed hash here is a new password; rehashes are stored with
+        # update() by api.passwords and adopt the hash as loaded.
+        loaded = getattr(self, '_loaded_password', None)
+        if loaded is not None and self.password != loaded:
+            self.credential_version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'credential_version'}
+        super().save(*args, **kwargs)
+        self._loaded_password = self.password
+
     def get_session_auth_hash(self):
-        from django.contrib.auth.hashers import salted_hmac
+        from django.utils.crypto import salted_hmac
         key_salt = f"django.contrib.auth.Member.{self.pk}"
         return salted_hmac(
             "get_session_auth_hash",
-            self.password,
+            str(self.credential_version),
             key_salt,
         ).hexdigest()
 
@@ -43,6 +85,8 @@ class Member(models.Model):
 class Post(models.Model):
     content = models.TextField()
     media_urls = models.JSONField(default=list)
+    # Hashes of the attached ``Media``; their URLs derive from the hash alone.
+    media = models.JSONField(default=list)
     author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='posts')
     likes_count = models.PositiveIntegerField(default=0)
     comments_count = models.PositiveIntegerField(default=0)
@@ -51,16 +95,43 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['author', '-created_at'], name='post_author_created'),
+        ]
 
 class Comment(models.Model):
+    # Materialized path: the zero-padded ids of the thread from its root down
+    # to this comment, so ordering by path lists a thread depth first and a
+    # subtree shares its root's path as a prefix.
+    PATH_STEP = 12
+
     text = models.TextField()
     author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='comments')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    path = models.CharField(max_length=255, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['post', 'created_at'], name='comment_post_created'),
+            models.Index(fields=['root', 'path'], name='comment_root_path'),
+        ]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id:
+            self.depth = self.parent.depth + 1
+            self.root_id = self.parent.root_id
+        super().save(*args, **kwargs)
+        if creating:
+            self.path = (self.parent.path if self.parent_id else '') + format(self.pk, f'0{self.PATH_STEP}d')
+            self.root_id = self.root_id or self.pk
+            Comment.objects.filter(pk=self.pk).update(path=self.path, root_id=self.root_id)
 
 class Friendship(models.Model):
     STATUS_PENDING = 'pending'
@@ -76,9 +147,26 @@ class Friendship(models.Model):
 
     class Meta:
         unique_together = ('from_member', 'to_member')
+        indexes = [
+            models.Index(fields=['to_member', 'status'], name='friendship_to_status'),
+            models.Index(
+                fields=['from_member', 'to_member'],
+                condition=models.Q(status='accepted'),
+                name='friendship_accepted_from',
+            ),
+            models.Index(
+                fields=['to_member', 'from_member'],
+                condition=models.Q(status='accepted'),
+                name='friendship_accepted_to',
+            ),
+        ]
 
 class Chat(models.Model):
     members = models.ManyToManyField(Member, related_name='chats')
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_activity = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -89,10 +177,29 @@ class Message(models.Model):
     author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='sent_messages')
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['chat', 'created_at', 'id'], name='message_chat_created'),
+            # Covers unread counts: messages after a read watermark, by author.
+            models.Index(fields=['chat', 'id', 'author'], name='message_chat_id_author'),
+        ]
+
+class ChatReadState(models.Model):
+    """
+    How far a member has read a chat: every message with an id up to
+    ``last_read_message_id`` counts as read.
+    """
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='read_states')
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='chat_read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'member'], name='chat_read_state_unique'),
+        ]
 
 class Like(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='post_likes')
@@ -101,3 +208,104 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('member', 'post')
+
+class TimelineEntry(models.Model):
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('member', 'post')
+        indexes = [
+            models.Index(fields=['member', '-created_at', '-post'], name='timeline_member_feed'),
+            models.Index(fields=['member', 'author'], name='timeline_member_author'),
+        ]
+
+class Task(models.Model):
+    """
+    A unit of background work run by ``manage.py run_worker``; see api.tasks.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    queue = models.CharField(max_length=50)
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_at'], name='task_queue_due'),
+            models.Index(fields=['locked_by'], name='task_locked_by'),
+        ]
+
+class Media(models.Model):
+    """
+    An uploaded file, stored once per content hash; see api.media.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # Variant name -> file name next to the original, filled in by the worker.
+    variants = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class Upload(models.Model):
+    """
+    A resumable upload in progress: ``offset`` bytes of ``size`` have been
+    written to its part file.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='uploads')
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    media = models.ForeignKey(Media, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='upload_updated_at'),
+        ]
+
+class LoginFailure(models.Model):
+    """
+    Bad passwords counted per username or client address; see api.passwords.
+    Kept in the database, where a cache cull cannot forget a lockout.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='login_failure_expires_at'),
+        ]
@@ -1,8 +1,231 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from datetime import datetime
 
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-class CustomPagination(PageNumberPagination):
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique, composite ordering key.
+
+    Pages are selected with a ``WHERE (key) < (position)`` range condition
+    instead of ``OFFSET``, and no ``COUNT(*)`` is issued. Cursors are opaque
+    tokens holding the key of the boundary row and the paging direction.
+
+    ``ordering`` must end with a unique column so that every row has a
+    distinct position. With ``start_at_end`` the first request returns the
+    last page of the ordering, and the ``previous`` link walks backwards.
+    """
     page_size = 20
     page_size_query_param = 'limit'
     max_page_size = 100
-    page_query_param = 'page'
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    start_at_end = False
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset, reverse, position = self.prepare_page(queryset, request)
+        return self.finalize_page(list(page_queryset), reverse, position)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_queryset, reverse, position = self.prepare_page(queryset, request)
+        rows = [row async for row in page_queryset]
+        return self.finalize_page(rows, reverse, position)
+
+    def prepare_page(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(queryset, request)
+        page_queryset = self.get_page_queryset(queryset, reverse, position)[:self.page_size + 1]
+        return page_queryset, reverse, position
+
+    def get_page_queryset(self, queryset, reverse, position):
+        ordering = self._directed_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+        return queryset
+
+    def finalize_page(self, rows, reverse, position):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        has_following = has_more if not reverse else position is not None
+        has_preceding = has_more if reverse else position is not None
+        if rows:
+            first, last = self.get_position(rows[0]), self.get_position(rows[-1])
+        else:
+            first = last = position
+        self.next_position = last if has_following else None
+        self.previous_position = first if has_preceding else None
+        return rows
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_position(self, instance):
+        return [getattr(instance, name.lstrip('-')) for name in self.ordering]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(True, self.previous_position)
+
+    def encode_cursor(self, reverse, position):
+        payload = {
+            'r': int(reverse),
+            'p': [value.isoformat() if isinstance(value, datetime) else value for value in position],
+        }
+        token = b64encode(json.dumps(payload, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, queryset, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return self.start_at_end, None
+        try:
+            payload = json.loads(b64decode(token.encode('ascii')).decode('ascii'))
+            reverse = bool(payload['r'])
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._to_python(queryset, name.lstrip('-'), value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    def _directed_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(name[1:] if name.startswith('-') else '-' + name for name in self.ordering)
+
+    def _after(self, ordering, position):
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def _to_python(self, queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = queryset.query.annotations[name].output_field
+        return field.to_python(value)
+
+
+class FeedPagination(KeysetPagination):
+    ordering = ('-feed_created_at', '-feed_post_id')
+
+
+class FriendsPagination(KeysetPagination):
+    ordering = ('username', 'id')
+
+
+class ChatsPagination(KeysetPagination):
+    ordering = ('-last_activity', '-id')
+
+
+class ChatMessagesPagination(KeysetPagination):
+    """
+    Opens on the newest messages; ``previous`` loads older history.
+    """
+    page_size = 50
+    ordering = ('created_at', 'id')
+    start_at_end = True
+
+
+class CommentsPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Pages ranked search hits, best first. ``paginate_search`` takes a
+    function ``(position, limit)`` returning model instances that carry a
+    ``search_score``; search pages only move forwards.
+    """
+    ordering = ('-search_score', '-id')
+
+    def paginate_search(self, search, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(None, request)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        rows = search(position, self.page_size + 1)
+        return self.finalize_page(rows, reverse, position)
+
+    def get_previous_link(self):
+        return None
+
+    def _to_python(self, queryset, name, value):
+        if name == 'search_score':
+            return float(value)
+        return int(value)
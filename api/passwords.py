@@ -0,0 +1,216 @@
+"""
+Password hashing off the request path.
+
+Hashing a password costs a large share of a CPU core and, with scrypt, tens
+of megabytes, so every verification and new hash runs on a small per-process
+thread pool (hashlib releases the GIL while it works). Each hash first takes
+one of ``PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE`` slots shared by all
+workers of the host through ``PASSWORD_HASH_SLOTS_PATH``; with none free,
+the login is answered with 429 at once instead of piling up and starving
+every other route.
+
+Bad passwords are counted per username and per client address for
+``LOGIN_FAILURE_WINDOW`` seconds in ``LoginFailure`` rows, which unlike cache
+entries are never evicted early. Past the limits, logins are refused before
+any hashing, so a credential stuffing run costs one indexed read per attempt.
+
+Passwords stored with an older hasher are rehashed with the preferred one
+(scrypt) on the first successful login. Tokens and sessions are bound to
+``Member.credential_version``, not to the hash, so they survive the rehash.
+"""
+import fcntl
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .authentication import principals
+from .models import LoginFailure, Member
+
+USERNAME_KEY = 'login:failures:user:{}'
+ADDRESS_KEY = 'login:failures:ip:{}'
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+
+
+class Busy(Throttled):
+    default_detail = 'Too many logins in progress, try again shortly.'
+
+
+class Slots:
+    """
+    ``size`` hashing slots shared by the processes that open ``path``, each
+    held as an ``fcntl`` lock on one byte of the file so the slots of a
+    worker that dies are freed with it. Private to the process when ``path``
+    is empty.
+    """
+
+    def __init__(self, path, size):
+        self.size = size
+        self._held = set()
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600) if path else None
+
+    def acquire(self):
+        """
+        A free slot, or None.
+        """
+        # fcntl locks belong to the process, so its threads also need to
+        # stay off each other's slots.
+        with self._lock:
+            for slot in range(self.size):
+                if slot in self._held:
+                    continue
+                if self._fd is not None:
+                    try:
+                        fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+                    except OSError:
+                        continue
+                self._held.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, slot)
+            self._held.discard(slot)
+
+
+def _run(func, *args):
+    """
+    Run ``func`` on the hashing pool and wait for it, or raise ``Busy``
+    when the host already has its fill of hashing in progress.
+    """
+    global _pool, _slots
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _slots = Slots(
+                    settings.PASSWORD_HASH_SLOTS_PATH, settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE
+                )
+                _pool = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    slot = _slots.acquire()
+    if slot is None:
+        raise Busy(wait=1)
+    future = _pool.submit(func, *args)
+    future.add_done_callback(lambda _: _slots.release(slot))
+    return future.result()
+
+
+def _check(raw_password, encoded):
+    """
+    Whether the password matches, and its new hash if the stored one uses an
+    outdated hasher.
+    """
+    upgraded = []
+    valid = hashers.check_password(
+        raw_password, encoded, setter=lambda raw: upgraded.append(hashers.make_password(raw))
+    )
+    return valid, upgraded[0] if upgraded else None
+
+
+def make_password(raw_password):
+    return _run(hashers.make_password, raw_password)
+
+
+def check_password(member, raw_password):
+    """
+    Verify ``raw_password`` against the member's, upgrading the stored hash
+    when needed. Without a member a hash is still computed, so unknown and
+    known usernames take the same time.
+    """
+    if member is None:
+        _run(hashers.make_password, raw_password)
+        return False
+    valid, upgraded = _run(_check, raw_password, member.password)
+    if upgraded:
+        # Conditional so a password changed meanwhile is not overwritten.
+        if Member.objects.filter(pk=member.pk, password=member.password).update(password=upgraded):
+            # update() sends no post_save, which would drop the cached
+            # principal holding the old hash.
+            principals.invalidate(member.pk)
+        # The same password, so saving the member later must not revoke tokens.
+        member.password = member._loaded_password = upgraded
+    return valid
+
+
+def _keys(username, address):
+    keys = [USERNAME_KEY.format(username.lower())]
+    if address:
+        keys.append(ADDRESS_KEY.format(address))
+    return keys
+
+
+def client_address(request):
+    # Honours REST_FRAMEWORK['NUM_PROXIES'] behind nginx.
+    return BaseThrottle().get_ident(request)
+
+
+def check_failures(username, address):
+    """
+    Raise ``Throttled`` if the username or the address has failed too often.
+    """
+    keys = _keys(username, address)
+    counts = dict(
+        LoginFailure.objects.filter(key__in=keys, expires_at__gt=timezone.now()).values_list('key', 'count')
+    )
+    limits = [settings.LOGIN_FAILURE_LIMIT, settings.LOGIN_IP_FAILURE_LIMIT]
+    if any(counts.get(key, 0) >= limit for key, limit in zip(keys, limits)):
+        raise Throttled(wait=settings.LOGIN_FAILURE_WINDOW, detail='Too many failed logins, try again later.')
+
+
+def record_failure(username, address):
+    keys = _keys(username, address)
+    now = timezone.now()
+    live = LoginFailure.objects.filter(key__in=keys, expires_at__gt=now)
+    if live.update(count=F('count') + 1) == len(keys):
+        return
+    counted = set(live.values_list('key', flat=True))
+    # New or expired counters start a new window. One created meanwhile by a
+    # concurrent failure is overwritten and loses a count, fine for a limit.
+    LoginFailure.objects.bulk_create(
+        [
+            LoginFailure(key=key, count=1, expires_at=now + timedelta(seconds=settings.LOGIN_FAILURE_WINDOW))
+            for key in keys
+            if key not in counted
+        ],
+        update_conflicts=True,
+        unique_fields=['key'],
+        update_fields=['count', 'expires_at'],
+    )
+
+
+def clear_failures(username):
+    LoginFailure.objects.filter(key=USERNAME_KEY.format(username.lower())).delete()
+
+
+def prune_failures():
+    """
+    Delete expired failure counters. Returns how many were deleted.
+    """
+    return LoginFailure.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+def authenticate(request, username, password):
+    """
+    The active member with these credentials, or None. Raises ``Throttled``
+    when the caller has failed too often or the hashing pool is full.
+    """
+    address = client_address(request) if request is not None else None
+    check_failures(username, address)
+    member = Member.objects.filter(username=username, is_active=True).first()
+    if check_password(member, password):
+        clear_failures(username)
+        return member
+    record_failure(username, address)
+    return None
@@ -0,0 +1,194 @@
+"""
+Member presence backed by the cache.
+
+Heartbeats only write the member's timestamp to the cache, which all workers
+share, and are buffered per process. The buffer is written to
+``Member.last_seen`` in one bulk UPDATE at most every
+``PRESENCE_FLUSH_INTERVAL`` seconds, by the next heartbeat or else by a timer,
+so frequent heartbeats do not each take the database write lock and the last
+ones before a member leaves are not held back. Reads prefer the cached
+timestamp over the column.
+
+Friends are told when a member comes online, by the heartbeat that finds them
+offline, and when they go offline, by ``publish_offline`` which the task
+worker runs every ``PRESENCE_FLUSH_INTERVAL`` seconds.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from . import friend_graph, realtime
+from .models import Member
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'presence:last_seen:{}'
+SWEPT_KEY = 'presence:swept_until'
+CONTEXT_KEY = 'presence'
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.monotonic()
+_timer = None
+
+
+def _timeout():
+    # Keep heartbeats at least until they have been flushed and have aged
+    # out of the online window.
+    return settings.PRESENCE_ONLINE_WINDOW + settings.PRESENCE_FLUSH_INTERVAL
+
+
+def _schedule_flush():
+    # Called with _lock held.
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(settings.PRESENCE_FLUSH_INTERVAL, _timed_flush)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _timed_flush():
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        flush()
+    finally:
+        # The timer thread's own connection.
+        connection.close()
+
+
+def heartbeat(member_id, when=None):
+    """
+    Record that the member is active. Flushes the buffer when it is due.
+    Returns the heartbeat time and whether the member was offline before.
+    """
+    when = when or timezone.now()
+    key = CACHE_KEY.format(member_id)
+    came_online = not is_online(cache.get(key))
+    cache.set(key, when, _timeout())
+    with _lock:
+        _pending[member_id] = when
+        due = time.monotonic() - _last_flush >= settings.PRESENCE_FLUSH_INTERVAL
+        if not due:
+            _schedule_flush()
+    if due:
+        flush()
+    return when, came_online
+
+
+def flush():
+    """
+    Write buffered heartbeats to ``Member.last_seen``. Returns the number of
+    members written.
+    """
+    global _last_flush, _timer
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+    try:
+        Member.objects.bulk_update(
+            [Member(id=member_id, last_seen=when) for member_id, when in pending.items()],
+            ['last_seen'],
+            batch_size=500,
+        )
+    except DatabaseError as exc:
+        logger.warning("Could not flush %d presence heartbeats: %s", len(pending), exc)
+        with _lock:
+            for member_id, when in pending.items():
+                if _pending.get(member_id, when) <= when:
+                    _pending[member_id] = when
+            _schedule_flush()
+        return 0
+    return len(pending)
+
+
+def went_offline():
+    """
+    Map each member whose last heartbeat left the online window since the
+    previous call, in any process, to that heartbeat.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.PRESENCE_ONLINE_WINDOW)
+    since = cache.get(SWEPT_KEY) or cutoff - timedelta(seconds=settings.PRESENCE_FLUSH_INTERVAL)
+    cache.set(SWEPT_KEY, cutoff, None)
+    if since >= cutoff:
+        return {}
+    stored = dict(Member.objects.filter(last_seen__gt=since, last_seen__lte=cutoff).values_list('id', 'last_seen'))
+    cached = last_seen_many(stored)
+    offline = {}
+    for member_id, seen in stored.items():
+        seen = max(seen, cached[member_id] or seen)
+        if seen <= cutoff:
+            offline[member_id] = seen
+    return offline
+
+
+def publish_offline():
+    """
+    Tell the friends of members who went offline. Returns their number.
+    """
+    offline = went_offline()
+    friends = friend_graph.friend_ids_many(offline)
+    for member_id, seen in offline.items():
+        realtime.publish(friends[member_id], 'presence', {
+            'member_id': member_id,
+            'last_seen': seen,
+            'is_online': False,
+        })
+    return len(offline)
+
+
+def last_seen_many(member_ids):
+    """
+    Map each member id to its cached heartbeat, or None.
+    """
+    keys = {CACHE_KEY.format(member_id): member_id for member_id in member_ids}
+    cached = cache.get_many(keys)
+    return {member_id: cached.get(key) for key, member_id in keys.items()}
+
+
+def is_online(last_seen):
+    if last_seen is None:
+        return False
+    return (timezone.now() - last_seen).total_seconds() < settings.PRESENCE_ONLINE_WINDOW
+
+
+def online_ids(member_ids):
+    """
+    Ids of the given members that are currently online.
+    """
+    return {member_id for member_id, seen in last_seen_many(member_ids).items() if is_online(seen)}
+
+
+def prime(context, member_ids):
+    """
+    Load the heartbeats of members about to be serialized into the
+    serializer context, skipping ones already loaded.
+    """
+    seen = context.setdefault(CONTEXT_KEY, {})
+    missing = [member_id for member_id in member_ids if member_id not in seen]
+    if missing:
+        seen.update(last_seen_many(missing))
+
+
+def last_seen(member, context):
+    """
+    The most recent activity of ``member``, from a primed context.
+    """
+    prime(context, [member.id])
+    heartbeat_at = context[CONTEXT_KEY][member.id]
+    if heartbeat_at is None or heartbeat_at < member.last_seen:
+        return member.last_seen
+    return heartbeat_at
@@ -0,0 +1,75 @@
+"""
+Per-member read watermarks for chats.
+
+A member has read every message of a chat up to their
+``ChatReadState.last_read_message_id``, so marking a chat read moves one row
+forward whatever the number of messages, and works the same in group chats.
+Unread counts are range counts over the ``(chat, id, author)`` message index.
+"""
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ChatReadState, Message
+
+
+def latest_message_id(chat):
+    return Message.objects.filter(chat=chat).aggregate(latest=Max('id'))['latest']
+
+
+def mark_read(chat, member, message_id):
+    """
+    Move the member's watermark forward to ``message_id``. Returns whether
+    it moved.
+    """
+    if ChatReadState.objects.filter(chat=chat, member=member, last_read_message_id__lt=message_id).update(
+        last_read_message_id=message_id, updated_at=timezone.now()
+    ):
+        return True
+    _, created = ChatReadState.objects.get_or_create(
+        chat=chat, member=member, defaults={'last_read_message_id': message_id}
+    )
+    return created
+
+
+def watermark(member, chat=None):
+    """
+    The member's watermark in ``chat`` (by default the outer query's row) as
+    a subquery expression, 0 if the member never read it.
+    """
+    states = ChatReadState.objects.filter(chat=chat or OuterRef('pk'), member=member).values(
+        'last_read_message_id'
+    )
+    return Coalesce(Subquery(states), 0)
+
+
+def unread_count(member):
+    """
+    Expression counting a chat's messages from others past the member's
+    watermark, for annotating chat querysets.
+    """
+    unread = (
+        Message.objects.filter(chat=OuterRef('pk'), id__gt=watermark(member, OuterRef(OuterRef('pk'))))
+        .exclude(author=member)
+        .order_by()
+        .values('chat')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    return Coalesce(Subquery(unread), 0)
+
+
+def unread_summary(member, chat_ids=None):
+    """
+    Chats of the member with unread messages, each with its count and the
+    member's watermark, in one query.
+    """
+    chats = member.chats.all()
+    if chat_ids is not None:
+        chats = chats.filter(id__in=chat_ids)
+    return list(
+        chats.annotate(unread_count=unread_count(member), last_read_message_id=watermark(member))
+        .filter(unread_count__gt=0)
+        .order_by('-last_activity', '-id')
+        .values('id', 'unread_count', 'last_read_message_id')
+    )
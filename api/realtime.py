@@ -0,0 +1,361 @@
+"""
+Real-time events pushed to connected members.
+
+Views publish events to per-member channels once their transaction commits,
+and the event stream endpoint forwards the requesting member's channel as
+server-sent events. The fan-out bus is selected by ``REALTIME_BUS_URL``: when
+empty, an in-process bus that only reaches streams served by the same worker;
+``redis://host:port`` fans out across workers through any server speaking the
+Redis pub/sub protocol, including ``manage.py run_event_broker``.
+
+Streams hold their connection open, so they are only served by the ASGI
+workers. Every event carries a time-ordered id and is kept in the recipient's
+replay buffer in the cache, the last ``REALTIME_REPLAY_SIZE`` events for
+``REALTIME_REPLAY_TTL`` seconds, so a client reconnecting with
+``Last-Event-ID`` first receives what it missed. Clients that were away for
+longer refetch.
+"""
+import asyncio
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'member:{}'
+REPLAY_KEY = 'realtime:replay:{}'
+
+
+class StreamUnavailable(APIException):
+    status_code = status.HTTP_426_UPGRADE_REQUIRED
+    default_detail = 'The event stream is only served by the ASGI workers.'
+    default_code = 'upgrade_required'
+
+
+class Subscription:
+    """
+    Queue of events received on a set of channels. Events can be awaited
+    from an event loop or waited for from a thread.
+    """
+
+    def __init__(self, bus, channels):
+        self.bus = bus
+        self.channels = tuple(channels)
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._waiter = None
+
+    def deliver(self, event):
+        self._queue.put(event)
+        with self._lock:
+            waiter = self._waiter
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            remaining = deadline - loop.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return None
+            waiter = loop.create_future()
+            with self._lock:
+                self._waiter = waiter
+            try:
+                # An event delivered before the waiter was registered would
+                # not wake it.
+                if self._queue.empty():
+                    await asyncio.wait([waiter], timeout=remaining)
+            finally:
+                with self._lock:
+                    self._waiter = None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class InProcessBus:
+    """
+    Delivers events to subscriptions held by the current process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+
+def encode_command(*args):
+    """
+    Encode a command as a RESP array of bulk strings.
+    """
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def read_reply(stream):
+    """
+    Read one RESP value from a binary file object.
+    """
+    line = stream.readline()
+    if not line:
+        raise ConnectionError('Connection closed by the server')
+    kind, value = line[:1], line[1:].rstrip(b'\r\n')
+    if kind == b'+':
+        return value.decode()
+    if kind == b'-':
+        raise ProtocolError(value.decode())
+    if kind == b':':
+        return int(value)
+    if kind == b'$':
+        length = int(value)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(value)
+        if length < 0:
+            return None
+        return [read_reply(stream) for _ in range(length)]
+    raise ProtocolError(f'Unexpected reply {line!r}')
+
+
+class RedisBus:
+    """
+    Fans events out through a Redis pub/sub server. Each subscription holds
+    its own connection, read by a daemon thread.
+    """
+
+    def __init__(self, url):
+        target = urlsplit(url)
+        self.address = (target.hostname or '127.0.0.1', target.port or 6379)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._readers_lock = threading.Lock()
+        self._readers = {}
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, sock.makefile('rb')
+
+    def publish(self, channel, event):
+        payload = json.dumps(event, cls=DjangoJSONEncoder)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None:
+                        self._connection = self.connect()
+                    sock, stream = self._connection
+                    sock.sendall(encode_command('PUBLISH', channel, payload))
+                    return read_reply(stream)
+                except OSError:
+                    self._close_publisher()
+                    if attempt:
+                        raise
+
+    def _close_publisher(self):
+        if self._connection is not None:
+            self._connection[0].close()
+            self._connection = None
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        sock, stream = self.connect()
+        sock.sendall(encode_command('SUBSCRIBE', *subscription.channels))
+        for _ in subscription.channels:
+            read_reply(stream)
+        sock.settimeout(None)
+        with self._readers_lock:
+            self._readers[subscription] = sock
+        threading.Thread(target=self._read, args=(subscription, stream), daemon=True).start()
+        return subscription
+
+    def _read(self, subscription, stream):
+        try:
+            while True:
+                reply = read_reply(stream)
+                if isinstance(reply, list) and reply and reply[0] == b'message':
+                    subscription.deliver(json.loads(reply[2]))
+        except (OSError, ValueError, ProtocolError):
+            pass
+
+    def unsubscribe(self, subscription):
+        with self._readers_lock:
+            sock = self._readers.pop(subscription, None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            url = settings.REALTIME_BUS_URL
+            _bus = RedisBus(url) if url else InProcessBus()
+        return _bus
+
+
+_last_id = 0
+_id_lock = threading.Lock()
+
+
+def next_event_id():
+    """
+    An event id from the clock, increasing within the process.
+    """
+    global _last_id
+    with _id_lock:
+        _last_id = max(_last_id + 1, time.time_ns())
+        return _last_id
+
+
+def remember(member_ids, event):
+    """
+    Append an event to the members' replay buffers. Concurrent appends from
+    other workers may drop one, which only costs those clients a refetch.
+    """
+    keys = [REPLAY_KEY.format(member_id) for member_id in member_ids]
+    buffers = cache.get_many(keys)
+    cache.set_many(
+        {key: (buffers.get(key, []) + [event])[-settings.REALTIME_REPLAY_SIZE:] for key in keys},
+        settings.REALTIME_REPLAY_TTL,
+    )
+
+
+def replay(member_id, last_event_id):
+    """
+    The buffered events of a member after ``last_event_id``, the id of the
+    last event a reconnecting client received.
+    """
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        return []
+    return [event for event in cache.get(REPLAY_KEY.format(member_id), []) if int(event['id']) > last_event_id]
+
+
+def publish(member_ids, event_type, data):
+    """
+    Send an event to each member's channel once the current transaction
+    commits. Delivery is best effort: events a client misses while away for
+    longer than the replay buffer holds are only seen after a refetch.
+    """
+    member_ids = set(member_ids)
+    channels = [CHANNEL.format(member_id) for member_id in member_ids]
+
+    def send():
+        event = {'id': str(next_event_id()), 'type': event_type, 'data': data}
+        remember(member_ids, event)
+        bus = get_bus()
+        try:
+            for channel in channels:
+                bus.publish(channel, event)
+        except OSError as exc:
+            logger.warning("Could not publish %s event: %s", event_type, exc)
+
+    transaction.on_commit(send)
+
+
+def subscribe(member_id):
+    return get_bus().subscribe([CHANNEL.format(member_id)])
+
+
+def format_event(event):
+    data = json.dumps(event['data'], cls=DjangoJSONEncoder)
+    event_id = f"id: {event['id']}\n" if 'id' in event else ''
+    return f"{event_id}event: {event['type']}\ndata: {data}\n\n".encode()
+
+
+def _preamble():
+    return f'retry: {settings.REALTIME_RETRY_MS}\n\n'.encode()
+
+
+async def astream(subscription, backlog=()):
+    """
+    Server-sent events for an event-loop server: the ``backlog`` to replay,
+    then one long-lived connection with keepalive comments every
+    ``REALTIME_HEARTBEAT`` seconds.
+    """
+    deadline = time.monotonic() + settings.REALTIME_STREAM_TIMEOUT
+    # The subscription was opened before the backlog was read, so it may
+    # deliver some of it again.
+    replayed = {event['id'] for event in backlog}
+    try:
+        yield _preamble()
+        for event in backlog:
+            yield format_event(event)
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = await subscription.aget(min(settings.REALTIME_HEARTBEAT, remaining))
+            if event is None:
+                yield b': keepalive\n\n'
+            elif event.get('id') not in replayed:
+                yield format_event(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,65 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; JSONRenderer then renders with the json module.
+    orjson = None
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    DRF's JSON renderer, encoding with orjson when it is installed. The
+    output is the same bytes: compact, UTF-8, U+2028 and U+2029 escaped, and
+    values orjson does not know (including datetimes, which it would format
+    differently) are converted by DRF's encoder. Indented output and data
+    orjson rejects are rendered by DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets clients negotiate ``text/event-stream``. Streams bypass rendering;
+    only error responses reach the renderer, sent as a single ``error`` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f'event: error\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'.encode()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets clients negotiate ``application/x-ndjson``. Streams bypass
+    rendering; only error responses reach the renderer, as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data) + b'\n'
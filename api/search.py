@@ -0,0 +1,207 @@
+"""
+Full-text search over members, posts and messages.
+
+On SQLite the text lives in FTS5 tables (``api_*_fts``) keyed by object id,
+written by model signals in the same transaction as the row; bulk writes that
+skip signals are caught up with ``manage.py rebuild_search_index``. On
+PostgreSQL generated ``search_vector`` columns with GIN indexes are kept up to
+date by the database. Both are created by migration 0005.
+
+Queries are reduced to word tokens, matched together with the last token as a
+prefix, and returned best first as ``(id, score)`` pairs; pages are cut with
+a keyset condition on ``(score, id)``.
+"""
+import json
+import re
+
+from django.db import connection
+
+from .models import Member, Message, Post
+
+MAX_TERMS = 8
+TOKEN = re.compile(r'\w+')
+
+
+def parse_query(text):
+    """
+    Word tokens of a search string, lowercased. Empty if there is nothing
+    to search for.
+    """
+    return TOKEN.findall(text.lower())[:MAX_TERMS]
+
+
+def _keyset(position, score, key):
+    if position is None:
+        return '', []
+    last_score, last_id = position
+    return f' AND ({score} < %s OR ({score} = %s AND {key} < %s))', [last_score, last_score, last_id]
+
+
+class SQLiteBackend:
+
+    def match(self, terms):
+        phrases = [f'"{term}"' for term in terms]
+        phrases[-1] += '*'
+        return ' AND '.join(phrases)
+
+    def hits(self, table, match, position, limit, where='', params=()):
+        keyset, keyset_params = _keyset(position, 'score', 'id')
+        sql = (
+            f'SELECT id, score FROM ('
+            f'SELECT rowid AS id, -bm25({table}) AS score FROM {table} '
+            f'WHERE {table} MATCH %s{where}'
+            f') WHERE 1{keyset} ORDER BY score DESC, id DESC LIMIT %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, *params, *keyset_params, limit])
+            return cursor.fetchall()
+
+    def members(self, terms, position, limit):
+        return self.hits(
+            'api_member_fts', f'username : ({self.match(terms)})', position, limit,
+            ' AND rowid IN (SELECT id FROM api_member WHERE is_active)',
+        )
+
+    def posts(self, terms, author_ids, position, limit):
+        return self.hits(
+            'api_post_fts', f'content : ({self.match(terms)})', position, limit,
+            ' AND author_id IN (SELECT value FROM json_each(%s))', [json.dumps(list(author_ids))],
+        )
+
+    def messages(self, terms, chat_id, position, limit):
+        return self.hits(
+            'api_message_fts', f'text : ({self.match(terms)}) AND chat : "{int(chat_id)}"', position, limit,
+        )
+
+    def index(self, instances):
+        if not instances:
+            return
+        table, values = self.row(instances[0])
+        columns = ', '.join(values)
+        placeholders = ', '.join(['%s'] * len(values))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [[instance.pk] for instance in instances])
+            cursor.executemany(
+                f'INSERT INTO {table} (rowid, {columns}) VALUES (%s, {placeholders})',
+                [[instance.pk, *self.row(instance)[1].values()] for instance in instances],
+            )
+
+    def unindex(self, instance):
+        table, _ = self.row(instance)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [instance.pk])
+
+    def row(self, instance):
+        if isinstance(instance, Member):
+            return 'api_member_fts', {'username': instance.username}
+        if isinstance(instance, Post):
+            return 'api_post_fts', {'content': instance.content, 'author_id': instance.author_id}
+        return 'api_message_fts', {'text': instance.text, 'chat': instance.chat_id}
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for table, source in [
+                ('api_member_fts (rowid, username)', 'id, username FROM api_member'),
+                ('api_post_fts (rowid, content, author_id)', 'id, content, author_id FROM api_post'),
+                ('api_message_fts (rowid, text, chat)', 'id, text, chat_id FROM api_message'),
+            ]:
+                cursor.execute(f'DELETE FROM {table.split()[0]}')
+                cursor.execute(f'INSERT INTO {table} SELECT {source}')
+            for table in ('api_member_fts', 'api_post_fts', 'api_message_fts'):
+                cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+
+class PostgreSQLBackend:
+
+    def match(self, terms):
+        return ' & '.join(terms) + ':*'
+
+    def hits(self, table, terms, position, limit, where='', params=()):
+        keyset, keyset_params = _keyset(position, 'score', 'id')
+        sql = (
+            f'SELECT id, score FROM ('
+            f"SELECT id, ts_rank(search_vector, to_tsquery('simple', %s))::float8 AS score FROM {table} "
+            f"WHERE search_vector @@ to_tsquery('simple', %s){where}"
+            f') AS hits WHERE TRUE{keyset} ORDER BY score DESC, id DESC LIMIT %s'
+        )
+        query = self.match(terms)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query, query, *params, *keyset_params, limit])
+            return cursor.fetchall()
+
+    def members(self, terms, position, limit):
+        return self.hits('api_member', terms, position, limit, ' AND is_active')
+
+    def posts(self, terms, author_ids, position, limit):
+        return self.hits('api_post', terms, position, limit, ' AND author_id = ANY(%s)', [list(author_ids)])
+
+    def messages(self, terms, chat_id, position, limit):
+        return self.hits('api_message', terms, position, limit, ' AND chat_id = %s', [chat_id])
+
+    def index(self, instances):
+        pass
+
+    def unindex(self, instance):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend(),
+    'postgresql': PostgreSQLBackend(),
+}
+
+
+def get_backend():
+    return BACKENDS[connection.vendor]
+
+
+def _load(queryset, hits):
+    objects = queryset.in_bulk([object_id for object_id, _ in hits])
+    results = []
+    for object_id, score in hits:
+        if object_id in objects:
+            obj = objects[object_id]
+            obj.search_score = score
+            results.append(obj)
+    return results
+
+
+def members(terms, position, limit):
+    return _load(Member.objects.all(), get_backend().members(terms, position, limit))
+
+
+def posts(author_ids, terms, position, limit):
+    return _load(
+        Post.objects.select_related('author'),
+        get_backend().posts(terms, author_ids, position, limit),
+    )
+
+
+def messages(chat_id, terms, position, limit):
+    return _load(
+        Message.objects.select_related('author'),
+        get_backend().messages(terms, chat_id, position, limit),
+    )
+
+
+def index(instances):
+    """
+    Index objects written without signals, such as by ``bulk_create``. All
+    must be of the same model.
+    """
+    get_backend().index(list(instances))
+
+
+def index_instance(sender, instance, **kwargs):
+    get_backend().index([instance])
+
+
+def unindex_instance(sender, instance, **kwargs):
+    get_backend().unindex(instance)
+
+
+def rebuild():
+    get_backend().rebuild()
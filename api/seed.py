@@ -0,0 +1,153 @@
+"""
+Synthetic social graph for benchmarks and query plan analysis.
+"""
+import itertools
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import search
+from .models import Chat, Comment, Friendship, Like, Member, Message, Post, TimelineEntry
+
+DEGREE_DISTRIBUTIONS = ('fixed', 'uniform', 'powerlaw')
+
+
+def degree_sequence(distribution, members, mean, rng):
+    """
+    The number of friends each member asks for, ``mean`` on average.
+    ``powerlaw`` draws from a Pareto distribution with exponent 2, so a few
+    members get many times the mean, like the celebrities of a real network.
+    """
+    if distribution == 'fixed':
+        degrees = [mean] * members
+    elif distribution == 'uniform':
+        degrees = [rng.randint(0, 2 * mean) for _ in range(members)]
+    elif distribution == 'powerlaw':
+        degrees = [int(mean / 2 * rng.paretovariate(2)) for _ in range(members)]
+    else:
+        raise ValueError(f'Unknown degree distribution {distribution!r}')
+    return [min(degree, max(members - 1, 0)) for degree in degrees]
+
+
+@transaction.atomic
+def seed_social_graph(
+    members=100,
+    friends_per_member=10,
+    posts_per_member=5,
+    likes_per_post=3,
+    comments_per_post=2,
+    chats_per_member=3,
+    messages_per_chat=20,
+    prefix='seed',
+    seed=0,
+    degree_distribution='fixed',
+):
+    """
+    Bulk-create members, accepted friendships, posts with likes and comments,
+    materialized timelines and two-member chats. Returns the created members.
+
+    ``friends_per_member`` is the mean of ``degree_distribution``. With other
+    distributions than ``fixed``, friends are picked in proportion to the
+    number of friends they ask for, so the hubs befriend each other too.
+    """
+    rng = random.Random(seed)
+    password = make_password('password')
+    created = Member.objects.bulk_create(
+        [
+            Member(
+                username=f'{prefix}{index}',
+                email=f'{prefix}{index}@example.com',
+                password=password,
+            )
+            for index in range(members)
+        ],
+        batch_size=500,
+    )
+    ids = [member.id for member in created]
+
+    friends = {member_id: set() for member_id in ids}
+    friendships = []
+    degrees = degree_sequence(degree_distribution, len(ids), friends_per_member, rng)
+    weights = list(itertools.accumulate(degrees)) if degree_distribution != 'fixed' else None
+    for member_id, wanted in zip(ids, degrees):
+        attempts = 0
+        while len(friends[member_id]) < wanted and attempts < 20 * wanted:
+            attempts += 1
+            other = rng.choices(ids, cum_weights=weights)[0] if weights else rng.choice(ids)
+            if other == member_id or other in friends[member_id]:
+                continue
+            friends[member_id].add(other)
+            friends[other].add(member_id)
+            friendships.append(
+                Friendship(from_member_id=member_id, to_member_id=other, status=Friendship.STATUS_ACCEPTED)
+            )
+    Friendship.objects.bulk_create(friendships, batch_size=500)
+
+    posts = Post.objects.bulk_create(
+        [
+            Post(author_id=member_id, content=f'Post {number} by member {member_id}')
+            for member_id in ids
+            for number in range(posts_per_member)
+        ],
+        batch_size=500,
+    )
+    likes, comments = [], []
+    for post in posts:
+        audience = list(friends[post.author_id])
+        for member_id in rng.sample(audience, min(likes_per_post, len(audience))):
+            likes.append(Like(member_id=member_id, post_id=post.id))
+        for number in range(comments_per_post if audience else 0):
+            comments.append(Comment(post_id=post.id, author_id=rng.choice(audience), text=f'Comment {number}'))
+        post.likes_count = min(likes_per_post, len(audience))
+        post.comments_count = comments_per_post if audience else 0
+    Like.objects.bulk_create(likes, batch_size=500)
+    Comment.objects.bulk_create(comments, batch_size=500)
+    for comment in comments:
+        comment.root_id = comment.id
+        comment.path = format(comment.id, f'0{Comment.PATH_STEP}d')
+    Comment.objects.bulk_update(comments, ['root', 'path'], batch_size=500)
+    Post.objects.bulk_update(posts, ['likes_count', 'comments_count'], batch_size=500)
+
+    entries = []
+    pull = {member_id for member_id in ids if len(friends[member_id]) > settings.TIMELINE_FANOUT_LIMIT}
+    Member.objects.filter(id__in=pull).update(fanout_on_read=True)
+    for post in posts:
+        audience = {post.author_id} if post.author_id in pull else friends[post.author_id] | {post.author_id}
+        entries.extend(
+            TimelineEntry(member_id=member_id, post_id=post.id, author_id=post.author_id, created_at=post.created_at)
+            for member_id in audience
+        )
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000)
+
+    pairs = []
+    for member_id in ids:
+        candidates = list(friends[member_id])
+        for other in rng.sample(candidates, min(chats_per_member, len(candidates))):
+            pairs.append((member_id, other))
+    chats = Chat.objects.bulk_create([Chat() for _ in pairs], batch_size=500)
+    Chat.members.through.objects.bulk_create(
+        [
+            Chat.members.through(chat_id=chat.id, member_id=member_id)
+            for chat, pair in zip(chats, pairs)
+            for member_id in pair
+        ],
+        batch_size=500,
+    )
+    messages = Message.objects.bulk_create(
+        [
+            Message(chat_id=chat.id, author_id=rng.choice(pair), text=f'Message {number}')
+            for chat, pair in zip(chats, pairs)
+            for number in range(messages_per_chat)
+        ],
+        batch_size=500,
+    )
+    if messages_per_chat:
+        for index, chat in enumerate(chats):
+            last = messages[(index + 1) * messages_per_chat - 1]
+            chat.last_message_id = last.id
+            chat.last_activity = last.created_at
+        Chat.objects.bulk_update(chats, ['last_message', 'last_activity'], batch_size=500)
+    search.rebuild()
+    return created
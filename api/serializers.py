@@ -1,19 +1,63 @@
 from rest_framework import serializers
-from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.db import models
 from django.db.models import Q
 
-from .models import Member, Post, Comment, Friendship, Chat, Message
+from . import comment_tree, fragments, friend_graph, passwords, presence
+from .compiled import CompiledFieldsMixin
+from .media import urls as media_urls
+from .models import Member, Post, Comment, Friendship, Chat, Message, Media, Upload
 
-class MinimalMemberSerializer(serializers.ModelSerializer):
+class BatchListSerializer(serializers.ListSerializer):
+    """
+    Lets the child load the presence and cached fragments of the whole list
+    in one round trip each before the items are serialized.
+    """
+
+    def to_representation(self, data):
+        items = data.all() if isinstance(data, models.manager.BaseManager) else data
+        with fragments.batch(self.context):
+            self.child.prime(items)
+            return super().to_representation(items)
+
+class MinimalMemberSerializer(fragments.FragmentCacheMixin, serializers.ModelSerializer):
     class Meta:
         model = Member
         fields = ['id', 'username', 'avatar']
+        list_serializer_class = BatchListSerializer
+
+    def fragment_key(self, instance):
+        return fragments.member_key(instance.id, 'member_min')
+
+    def prime(self, members):
+        fragments.prime(self.context, [self.fragment_key(member) for member in members])
+
+class MemberSerializer(fragments.FragmentCacheMixin, serializers.ModelSerializer):
+    is_online = serializers.SerializerMethodField()
+    dynamic_fields = ('last_seen', 'is_online')
 
-class MemberSerializer(serializers.ModelSerializer):
     class Meta:
         model = Member
-        fields = ['id', 'username', 'email', 'avatar', 'last_seen']
+        fields = ['id', 'username', 'email', 'avatar', 'last_seen', 'is_online']
         read_only_fields = ['id', 'last_seen']
+        list_serializer_class = BatchListSerializer
+
+    def fragment_key(self, instance):
+        return fragments.member_key(instance.id)
+
+    def prime(self, members):
+        presence.prime(self.context, [member.id for member in members])
+        fragments.prime(self.context, [self.fragment_key(member) for member in members])
+
+    def get_is_online(self, obj):
+        return presence.is_online(presence.last_seen(obj, self.context))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['last_seen'] = self.fields['last_seen'].to_representation(
+            presence.last_seen(instance, self.context)
+        )
+        return data
 
 class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
@@ -22,7 +66,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
-        validated_data['password'] = make_password(validated_data['password'])
+        validated_data['password'] = passwords.make_password(validated_data['password'])
         return super().create(validated_data)
 
 class LoginSerializer(serializers.Serializer):
@@ -31,43 +75,83 @@ class LoginSerializer(serializers.Serializer):
 
 class ProfileSerializer(MemberSerializer):
     friends_count = serializers.SerializerMethodField()
+    dynamic_fields = MemberSerializer.dynamic_fields + ('friends_count',)
 
     def get_friends_count(self, obj):
-        return Friendship.objects.filter(
-            status=Friendship.STATUS_ACCEPTED,
-            Q(from_member=obj) | Q(to_member=obj)
-        ).count()
+        return friend_graph.friend_count(obj.id)
 
-class PostSerializer(serializers.ModelSerializer):
-    author = MemberSerializer(read_only=True)
-    likes_count = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
+class MediaListField(serializers.ListField):
+    """
+    Hashes of uploaded media on input, the URLs of their variants on output.
+    """
+    child = serializers.RegexField(r'^[0-9a-f]{64}$')
 
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+    def to_representation(self, data):
+        return [{'id': sha256, 'variants': media_urls(sha256)} for sha256 in data]
 
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+class PostSerializer(fragments.FragmentCacheMixin, serializers.ModelSerializer):
+    author = MemberSerializer(read_only=True)
+    media = MediaListField(required=False, max_length=10)
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'media_urls', 'author', 'likes_count', 'comments_count', 'created_at']
-
-class CommentSerializer(serializers.ModelSerializer):
+        fields = ['id', 'content', 'media_urls', 'media', 'author', 'likes_count', 'comments_count', 'created_at']
+        read_only_fields = ['likes_count', 'comments_count']
+        list_serializer_class = BatchListSerializer
+
+    def validate_media(self, value):
+        if value and len(set(value)) > Media.objects.filter(sha256__in=value).count():
+            raise serializers.ValidationError('Unknown media')
+        return list(dict.fromkeys(value))
+
+    def fragment_key(self, instance):
+        return fragments.post_key(instance)
+
+    def prime(self, posts):
+        authors = [post.author for post in posts]
+        presence.prime(self.context, [author.id for author in authors])
+        fragments.prime(
+            self.context,
+            [self.fragment_key(post) for post in posts]
+            + [self.fields['author'].fragment_key(author) for author in authors],
+        )
+
+class CommentSerializer(CompiledFieldsMixin, serializers.ModelSerializer):
     author = MinimalMemberSerializer(read_only=True)
-    post_id = serializers.IntegerField(source='post.id', read_only=True)
-    parent_id = serializers.IntegerField(source='parent.id', read_only=True, allow_null=True)
+    post_id = serializers.IntegerField(read_only=True)
+    parent_id = serializers.IntegerField(required=False, allow_null=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'text', 'author', 'post_id', 'parent_id', 'created_at']
+        fields = ['id', 'text', 'author', 'post_id', 'parent_id', 'depth', 'replies_count', 'created_at']
+        read_only_fields = ['depth', 'replies_count']
+        list_serializer_class = BatchListSerializer
+
+    def prime(self, comments):
+        self.fields['author'].prime([comment.author for comment in comments])
+
+class CommentThreadSerializer(CommentSerializer):
+    """
+    A comment with the replies loaded by ``comment_tree.attach_replies``.
+    """
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['replies']
+
+    def prime(self, comments):
+        super().prime(comment_tree.flatten(comments))
 
-class ChatSerializer(serializers.ModelSerializer):
+    def get_replies(self, obj):
+        return CommentThreadSerializer(obj.loaded_replies, many=True, context=self.context).data
+
+class ChatSerializer(CompiledFieldsMixin, serializers.ModelSerializer):
     members = MemberSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
 
     def get_last_message(self, obj):
-        message = obj.messages.last()
+        message = obj.last_message
         if message:
             return {
                 'id': message.id,
@@ -83,16 +167,62 @@ class ChatSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Chat
-        fields = ['id', 'members', 'last_message']
+        fields = ['id', 'members', 'last_message', 'unread_count']
+        list_serializer_class = BatchListSerializer
+
+    def prime(self, chats):
+        self.fields['members'].child.prime([member for chat in chats for member in chat.members.all()])
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(CompiledFieldsMixin, serializers.ModelSerializer):
     author = MinimalMemberSerializer(read_only=True)
-    chat_id = serializers.IntegerField(source='chat.id', read_only=True)
-    timestamp = serializers.DateTimeField(source='created_at')
+    chat_id = serializers.IntegerField(read_only=True)
+    timestamp = serializers.DateTimeField(source='created_at', read_only=True)
 
     class Meta:
         model = Message
         fields = ['id', 'chat_id', 'author', 'text', 'timestamp']
+        list_serializer_class = BatchListSerializer
+
+    def prime(self, messages):
+        self.fields['author'].prime([message.author for message in messages])
+
+class MediaSerializer(serializers.ModelSerializer):
+    id = serializers.CharField(source='sha256', read_only=True)
+    variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Media
+        fields = ['id', 'content_type', 'size', 'width', 'height', 'status', 'variants']
+
+    def get_variants(self, obj):
+        return media_urls(obj.sha256)
+
+class UploadSerializer(serializers.ModelSerializer):
+    media = MediaSerializer(read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'size', 'offset', 'media', 'created_at']
+        read_only_fields = ['offset', 'created_at']
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes')
+        return value
+
+class MarkReadSerializer(serializers.Serializer):
+    message_id = serializers.IntegerField(required=False, allow_null=True)
+
+class BatchMessageSerializer(serializers.Serializer):
+    chat_id = serializers.IntegerField()
+    text = serializers.CharField(max_length=5000)
+
+class BatchLikeSerializer(serializers.Serializer):
+    post_id = serializers.IntegerField()
+    liked = serializers.BooleanField()
+
+class BatchFriendRequestSerializer(serializers.Serializer):
+    target_username = serializers.CharField(max_length=30)
 
 class FriendshipSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,213 @@
+"""
+Database-backed background tasks.
+
+Views enqueue work with ``enqueue`` inside their transaction: the task row
+commits together with the change that caused it, so the worker never sees a
+task for a rolled back change and never misses one for a committed change.
+``manage.py run_worker`` claims due tasks under a lease, runs them, and
+retries failures with exponential backoff; tasks whose worker died are taken
+over once their lease expires.
+
+Handlers are functions decorated with ``@task``; their dotted path is stored
+with the task. Batch handlers receive the payloads of every claimed task of
+their kind at once. An idempotency key turns enqueueing the same work twice
+into a no-op for as long as the finished task is kept, and handlers commit
+their changes together with the task's completion.
+"""
+import logging
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def task(queue='default', batch=False, max_attempts=5):
+    """
+    Mark a function as a task handler. Handlers take a payload dict, or a
+    list of payloads if ``batch`` is set.
+    """
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.task_options = {'queue': queue, 'batch': batch, 'max_attempts': max_attempts}
+        return func
+    return decorator
+
+
+def enqueue(handler, payload=None, key=None, delay=0):
+    """
+    Queue ``handler(payload)`` in the current transaction. Does nothing if
+    a task with the same idempotency key already exists.
+    """
+    options = handler.task_options
+    instance = Task(
+        queue=options['queue'],
+        name=handler.task_name,
+        payload=payload or {},
+        idempotency_key=key,
+        max_attempts=options['max_attempts'],
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    # ON CONFLICT DO NOTHING needs no savepoint, unlike catching IntegrityError.
+    Task.objects.bulk_create([instance], ignore_conflicts=True)
+    if settings.TASKS_EAGER:
+        transaction.on_commit(lambda: run_pending([options['queue']]))
+
+
+def _queue_options(queue):
+    return {'concurrency': 1, 'batch_size': 10, **settings.TASK_QUEUES.get(queue, {})}
+
+
+def claim(queue, limit):
+    """
+    Lease up to ``limit`` due tasks of a queue to the caller.
+    """
+    now = timezone.now()
+    due = Q(status=Task.STATUS_QUEUED, run_at__lte=now) | Q(status=Task.STATUS_RUNNING, locked_until__lt=now)
+    ids = list(
+        Task.objects.filter(due, queue=queue).order_by('run_at', 'id').values_list('id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # The due condition is checked again by the UPDATE, so a task claimed by
+    # another worker in the meantime is skipped rather than taken twice.
+    Task.objects.filter(due, id__in=ids).update(
+        status=Task.STATUS_RUNNING,
+        locked_by=token,
+        locked_until=now + timedelta(seconds=settings.TASK_LEASE),
+        attempts=F('attempts') + 1,
+    )
+    return list(Task.objects.filter(locked_by=token).order_by('run_at', 'id'))
+
+
+def _finish(tasks):
+    Task.objects.filter(id__in=[t.id for t in tasks], locked_by=tasks[0].locked_by).update(
+        status=Task.STATUS_DONE,
+        locked_by=None,
+        locked_until=None,
+        finished_at=timezone.now(),
+    )
+
+
+def _retry(tasks, error):
+    now = timezone.now()
+    for t in tasks:
+        changes = {'locked_by': None, 'locked_until': None, 'last_error': error}
+        if t.attempts >= t.max_attempts:
+            changes.update(status=Task.STATUS_FAILED, finished_at=now)
+        else:
+            delay = settings.TASK_RETRY_DELAY * 2 ** (t.attempts - 1)
+            changes.update(status=Task.STATUS_QUEUED, run_at=now + timedelta(seconds=delay))
+        Task.objects.filter(id=t.id, locked_by=t.locked_by).update(**changes)
+
+
+def run_tasks(tasks):
+    """
+    Run claimed tasks, grouped by handler. Returns the number that succeeded.
+    """
+    groups = {}
+    for t in tasks:
+        groups.setdefault(t.name, []).append(t)
+    done = 0
+    for name, group in groups.items():
+        expired = [t for t in group if t.attempts > t.max_attempts]
+        if expired:
+            _retry(expired, 'Lease expired on the last attempt.')
+            group = [t for t in group if t.attempts <= t.max_attempts]
+            if not group:
+                continue
+        try:
+            handler = import_string(name)
+        except ImportError:
+            _retry(group, traceback.format_exc())
+            continue
+        chunks = [group] if handler.task_options['batch'] else [[t] for t in group]
+        for chunk in chunks:
+            try:
+                with transaction.atomic():
+                    if handler.task_options['batch']:
+                        handler([t.payload for t in chunk])
+                    else:
+                        handler(chunk[0].payload)
+                    _finish(chunk)
+            except Exception:
+                logger.exception('Task %s failed', name)
+                _retry(chunk, traceback.format_exc())
+            else:
+                done += len(chunk)
+    return done
+
+
+def run_pending(queues=None):
+    """
+    Run every due task of the given queues (default: all) in this thread.
+    """
+    done = 0
+    for queue in queues or settings.TASK_QUEUES:
+        limit = _queue_options(queue)['batch_size']
+        while tasks := claim(queue, limit):
+            done += run_tasks(tasks)
+    return done
+
+
+def prune():
+    """
+    Delete finished tasks older than ``TASK_RETENTION`` seconds, which also
+    frees their idempotency keys.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_RETENTION)
+    deleted, _ = Task.objects.filter(
+        status__in=[Task.STATUS_DONE, Task.STATUS_FAILED], finished_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+class Worker:
+    """
+    Runs ``concurrency`` polling threads per queue until stopped.
+    """
+
+    def __init__(self, queues=None):
+        self.queues = list(queues or settings.TASK_QUEUES)
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for queue in self.queues:
+            for number in range(_queue_options(queue)['concurrency']):
+                thread = threading.Thread(
+                    target=self.poll, args=(queue,), name=f'task-{queue}-{number}', daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def poll(self, queue):
+        limit = _queue_options(queue)['batch_size']
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    tasks = claim(queue, limit)
+                    if tasks:
+                        run_tasks(tasks)
+                        continue
+                except Exception:
+                    logger.exception('Worker for queue %s failed to claim tasks', queue)
+                self.stopping.wait(settings.TASK_POLL_INTERVAL)
+        finally:
+            connections.close_all()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join(timeout)
@@ -1,3 +1,1937 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from base64 import b64decode, b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework import test
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from rest_framework.request import Request
+
+from . import (
+    authentication, export, fragments, friend_graph, media, passwords, presence, realtime, tasks, throttling, timeline,
+)
+from .cache import FileCache
+from .compiled import CompiledFieldsMixin
+from .management.commands.run_event_broker import Broker
+from .middleware import get_query_budget
+from .models import (
+    Chat, Comment, Friendship, Like, LoginFailure, Media, Member, Message, Post, Task, TimelineEntry, Upload,
+)
+from .pagination import ChatMessagesPagination
+from .renderers import JSONRenderer
+from .serializers import ChatSerializer
+from .urls import urlpatterns
+from .views import PostsListCreateView
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@tasks.task(max_attempts=2)
+def failing_task(payload):
+    raise ValueError(payload['reason'])
+
+
+class APITestCase(test.APITestCase):
+    """
+    Test case that starts every test with an empty cache, since cached
+    friend sets and versions are keyed by ids that the database reuses.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cache.clear()
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        presence.flush()
+        authentication.principals.clear()
+        throttling._store = None
+        super().setUp()
+
+
+def create_member(username, password='secret-pass'):
+    return Member.objects.create(
+        username=username,
+        email=f'{username}@example.com',
+        password=make_password(password),
+    )
+
+
+def befriend(from_member, to_member):
+    friendship = Friendship.objects.create(
+        from_member=from_member,
+        to_member=to_member,
+        status=Friendship.STATUS_ACCEPTED,
+    )
+    friend_graph.invalidate(from_member.id, to_member.id)
+    timeline.connect(from_member, to_member)
+    return friendship
+
+
+def create_post(author, content='Hello'):
+    post = Post.objects.create(author=author, content=content)
+    timeline.fan_out_post(post)
+    return post
+
+
+def seed_network(owner, size):
+    """
+    Give ``owner`` ``size`` friends, each with posts, likes, comments and a
+    private chat, plus a few pending friend requests.
+    """
+    friends = []
+    for index in range(size):
+        friend = create_member(f'{owner.username}_friend{index}')
+        befriend(owner if index % 2 else friend, friend if index % 2 else owner)
+        friends.append(friend)
+        for number in range(2):
+            post = create_post(friend, f'Post {number} by {friend.username}')
+            Like.objects.create(member=owner, post=post)
+            Comment.objects.create(post=post, author=owner, text='Nice')
+            Post.objects.filter(id=post.id).update(likes_count=1, comments_count=1)
+        chat = Chat.objects.create()
+        chat.members.add(owner, friend)
+        for number in range(3):
+            message = Message.objects.create(
+                chat=chat,
+                author=friend if number % 2 else owner,
+                text=f'Message {number}',
+            )
+        Chat.objects.filter(id=chat.id).update(
+            last_message=message, last_activity=message.created_at
+        )
+    for index in range(3):
+        Friendship.objects.create(
+            from_member=create_member(f'{owner.username}_stranger{index}'),
+            to_member=owner,
+        )
+    return friends
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class QueryCountTests(APITestCase):
+    """
+    Every route must run a bounded number of queries, and list routes must
+    not issue more queries as the page grows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = create_member('owner')
+        cls.friends = seed_network(cls.owner, 25)
+        cls.chat = cls.owner.chats.order_by('id').first()
+        cls.post = cls.friends[0].posts.first()
+
+    def setUp(self):
+        super().setUp()
+        self.client = test.APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def count_queries(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+        return len(queries), response
+
+    def assertConstantQueries(self, path, route_name):
+        self.count_queries('get', path)  # warm caches
+        small, _ = self.count_queries('get', f'{path}?limit=5')
+        large, response = self.count_queries('get', f'{path}?limit=20')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(small, large, f'{route_name} queries grow with page size')
+        self.assertLessEqual(large, get_query_budget(route_name))
+
+    def test_feed(self):
+        self.assertConstantQueries('/api/posts/', 'posts_list_create')
+
+    def test_friends_list(self):
+        self.assertConstantQueries(f'/api/friends/{self.owner.username}/', 'friends')
+
+    def test_chat_messages(self):
+        for number in range(20):
+            Message.objects.create(chat=self.chat, author=self.owner, text=f'Extra {number}')
+        self.assertConstantQueries(f'/api/messages/chat/{self.chat.id}/', 'chat_messages')
+
+    def test_chat_inbox(self):
+        self.assertConstantQueries('/api/messages/chats/', 'messages_chats')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/_media/')
+    def test_every_route_within_budget(self):
+        upload = Upload.objects.create(member=self.owner, size=10)
+        stored = Media.objects.create(sha256='0' * 64, content_type='image/png', size=10)
+        pending = Friendship.objects.filter(
+            to_member=self.owner, status=Friendship.STATUS_PENDING
+        ).first()
+        stranger = create_member('stranger')
+        owner = self.owner.username
+        cases = [
+            ('auth_register', 'post', '/api/auth/register/',
+             {'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'secret-pass'}),
+            ('auth_me', 'get', '/api/auth/me/', None),
+            ('posts_list_create', 'get', '/api/posts/', None),
+            ('posts_list_create', 'post', '/api/posts/', {'content': 'Fresh post'}),
+            ('post_detail', 'get', f'/api/posts/{self.post.id}/', None),
+            ('post_like', 'post', f'/api/posts/{self.post.id}/like/', None),
+            ('post_comment', 'post', f'/api/posts/{self.post.id}/comment/', {'text': 'Great'}),
+            ('post_comments', 'get', f'/api/posts/{self.post.id}/comments/', None),
+            ('profile', 'get', f'/api/profile/{owner}/', None),
+            ('profile', 'patch', f'/api/profile/{owner}/', {'avatar': 'https://example.com/a.png'}),
+            ('friends', 'get', f'/api/friends/{owner}/', None),
+            ('friends', 'post', f'/api/friends/{owner}/', {'target_username': stranger.username}),
+            ('accept_friend', 'post', f'/api/friends/{owner}/accept/{pending.id}/', None),
+            ('remove_friend', 'delete', f'/api/friends/{owner}/{self.friends[1].username}/', None),
+            ('messages_chats', 'get', '/api/messages/chats/', None),
+            ('messages_unread', 'get', '/api/messages/unread/', None),
+            ('chat_messages', 'get', f'/api/messages/chat/{self.chat.id}/', None),
+            ('send_message', 'post', f'/api/messages/chat/{self.chat.id}/send/', {'text': 'Hi'}),
+            ('search_members', 'get', f'/api/search/members/?q={owner}_fr', None),
+            ('search_posts', 'get', '/api/search/posts/?q=post', None),
+            ('search_messages', 'get', f'/api/messages/chat/{self.chat.id}/search/?q=message', None),
+            ('batch_messages', 'post', '/api/batch/messages/',
+             {'items': [{'chat_id': chat.id, 'text': 'Synced'} for chat in self.owner.chats.all()[:5]]}),
+            ('batch_likes', 'post', '/api/batch/likes/',
+             {'items': [{'post_id': friend.posts.first().id, 'liked': False} for friend in self.friends[:5]]}),
+            ('batch_friend_requests', 'post', '/api/batch/friend_requests/',
+             {'items': [{'target_username': f'{owner}_stranger{index}'} for index in range(3)]}),
+            ('mark_chat_read', 'post', f'/api/messages/chat/{self.chat.id}/read/', None),
+            ('uploads', 'post', '/api/uploads/', {'size': 1024}),
+            ('upload_detail', 'get', f'/api/uploads/{upload.id}/', None),
+            ('media_file', 'get', f'/api/media/{stored.sha256}/feed/', None),
+            ('update_last_seen', 'put', f'/api/member/{self.owner.id}/last_seen/', None),
+            ('member_export', 'get', f'/api/member/{self.owner.id}/export/', None),
+            ('auth_logout', 'post', '/api/auth/logout/', None),
+        ]
+        anonymous = [
+            ('auth_login', 'post', '/api/auth/login/',
+             {'username': owner, 'password': 'secret-pass'}),
+            ('auth_refresh', 'post', '/api/auth/refresh/',
+             {'refresh': authentication.issue_token(self.owner, authentication.REFRESH)}),
+        ]
+        # Only served under ASGI; the test client is WSGI.
+        asgi_only = [
+            ('events', 'get', '/api/events/', None),
+        ]
+        covered = {name for name, *_ in cases + anonymous + asgi_only}
+        self.assertEqual(covered, {pattern.name for pattern in urlpatterns})
+
+        for route_name, method, path, data in asgi_only:
+            with self.subTest(route=route_name, method=method):
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(path, data)
+                self.assertEqual(response.status_code, 426)
+                self.assertLessEqual(len(queries), get_query_budget(route_name))
+
+        for route_name, method, path, data in cases:
+            with self.subTest(route=route_name, method=method):
+                count, _ = self.count_queries(method, path, data)
+                self.assertLessEqual(count, get_query_budget(route_name))
+
+        self.client = test.APIClient()
+        for route_name, method, path, data in anonymous:
+            with self.subTest(route=route_name, method=method):
+                count, _ = self.count_queries(method, path, data)
+                self.assertLessEqual(count, get_query_budget(route_name))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class KeysetPaginationTests(APITestCase):
+    """
+    Following ``next`` and ``previous`` must visit every row exactly once,
+    also across rows that tie on the leading ordering column.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        befriend(self.alice, self.bob)
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def create_messages(self, count):
+        messages = [
+            Message.objects.create(chat=self.chat, author=self.bob, text=f'Message {number}')
+            for number in range(count)
+        ]
+        # Pages of three split the runs of equal timestamps.
+        start = timezone.now()
+        for index, message in enumerate(messages):
+            Message.objects.filter(id=message.id).update(created_at=start + timedelta(seconds=index // 4))
+        return [message.id for message in messages]
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.data
+
+    def cursor(self, link):
+        return parse_qs(urlsplit(link).query)['cursor'][0]
+
+    def test_cursor_round_trip(self):
+        self.create_messages(5)
+        page = self.page(f'/api/messages/chat/{self.chat.id}/?limit=2')
+        payload = json.loads(b64decode(self.cursor(page['previous'])))
+        self.assertEqual(payload['r'], 1)
+        first = Message.objects.get(id=page['results'][0]['id'])
+        self.assertEqual(payload['p'], [first.created_at.isoformat(), first.id])
+
+        pagination = ChatMessagesPagination()
+        request = Request(test.APIRequestFactory().get('/', {'cursor': self.cursor(page['previous'])}))
+        self.assertEqual(
+            pagination.decode_cursor(Message.objects.all(), request),
+            (True, [first.created_at, first.id]),
+        )
+
+    def test_feed_pages_forward_and_back(self):
+        posts = [create_post(self.bob, f'Post {number}') for number in range(8)]
+        same = timezone.now()
+        Post.objects.filter(author=self.bob).update(created_at=same)
+        TimelineEntry.objects.filter(post__in=posts).update(created_at=same)
+        expected = [post.id for post in reversed(posts)]
+
+        pages = [self.page('/api/posts/?limit=3')]
+        self.assertIsNone(pages[0]['previous'])
+        while pages[-1]['next']:
+            pages.append(self.page(pages[-1]['next']))
+        self.assertEqual([post['id'] for page in pages for post in page['results']], expected)
+
+        backward = [pages[-1]]
+        while backward[-1]['previous']:
+            backward.append(self.page(backward[-1]['previous']))
+        self.assertEqual(
+            [post['id'] for page in reversed(backward) for post in page['results']], expected
+        )
+
+    def test_chat_history_starts_at_newest(self):
+        ids = self.create_messages(10)
+        first = self.page(f'/api/messages/chat/{self.chat.id}/?limit=3')
+        self.assertEqual([message['id'] for message in first['results']], ids[-3:])
+        self.assertIsNone(first['next'])
+
+        pages = [first]
+        while pages[-1]['previous']:
+            pages.append(self.page(pages[-1]['previous']))
+        self.assertEqual([message['id'] for page in reversed(pages) for message in page['results']], ids)
+
+        forward = [pages[-1]]
+        while forward[-1]['next']:
+            forward.append(self.page(forward[-1]['next']))
+        self.assertEqual([message['id'] for page in forward for message in page['results']], ids)
+
+    def test_invalid_cursor(self):
+        self.create_messages(3)
+        for cursor in (
+            'not-base64!',
+            b64encode(b'not json').decode(),
+            b64encode(b'{"r":0}').decode(),
+            b64encode(b'{"r":0,"p":["2024-01-01T00:00:00+00:00"]}').decode(),
+            b64encode(b'{"r":0,"p":["yesterday",1]}').decode(),
+            b64encode(b'{"r":0,"p":5}').decode(),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/messages/chat/{self.chat.id}/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class BatchWriteTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        befriend(self.alice, self.bob)
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def batch(self, route, items):
+        response = self.client.post(f'/api/batch/{route}/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def test_messages(self):
+        private = Chat.objects.create()
+        private.members.add(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription = realtime.subscribe(self.bob.id)
+            results = self.batch('messages', [
+                {'chat_id': self.chat.id, 'text': 'One'},
+                {'chat_id': private.id, 'text': 'Intruding'},
+                {'chat_id': self.chat.id, 'text': ''},
+                {'chat_id': self.chat.id, 'text': 'Two'},
+            ])
+        self.assertEqual([result['status'] for result in results], [201, 404, 400, 201])
+        self.assertEqual(list(self.chat.messages.values_list('text', flat=True)), ['One', 'Two'])
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.last_message_id, results[3]['data']['id'])
+        self.assertEqual(subscription.get(timeout=1)['data']['text'], 'One')
+        subscription.close()
+        search_results = self.client.get(f'/api/messages/chat/{self.chat.id}/search/?q=two').data['results']
+        self.assertEqual([message['text'] for message in search_results], ['Two'])
+
+    def test_likes_are_idempotent(self):
+        posts = [create_post(self.bob, f'Post {number}') for number in range(3)]
+        Like.objects.create(member=self.alice, post=posts[2])
+        Post.objects.filter(id=posts[2].id).update(likes_count=1)
+        items = [
+            {'post_id': posts[0].id, 'liked': True},
+            {'post_id': posts[1].id, 'liked': True},
+            {'post_id': posts[2].id, 'liked': False},
+            {'post_id': 0, 'liked': True},
+        ]
+        for _ in range(2):
+            results = self.batch('likes', items)
+            self.assertEqual([result['status'] for result in results], [200, 200, 200, 404])
+            counts = dict(Post.objects.filter(author=self.bob).values_list('id', 'likes_count'))
+            self.assertEqual(counts, {posts[0].id: 1, posts[1].id: 1, posts[2].id: 0})
+        self.assertEqual(
+            set(Like.objects.filter(member=self.alice).values_list('post_id', flat=True)),
+            {posts[0].id, posts[1].id},
+        )
+
+    def test_friend_requests(self):
+        carol = create_member('carol')
+        results = self.batch('friend_requests', [
+            {'target_username': 'carol'},
+            {'target_username': 'carol'},
+            {'target_username': 'bob'},
+            {'target_username': 'alice'},
+            {'target_username': 'nobody'},
+        ])
+        self.assertEqual([result['status'] for result in results], [201, 409, 409, 400, 404])
+        friendship = Friendship.objects.get(from_member=self.alice, to_member=carol)
+        self.assertEqual(results[0]['data'], {'id': friendship.id, 'target_username': 'carol'})
+
+    @override_settings(BATCH_MAX_ITEMS=2)
+    def test_batch_size_limit(self):
+        response = self.client.post(
+            '/api/batch/likes/', {'items': [{'post_id': 1, 'liked': True}] * 3}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+
+
+class UploadTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=root / 'media', UPLOAD_TEMP_DIR=root / 'uploads'))
+        self.alice = create_member('alice')
+        self.client.force_authenticate(self.alice)
+
+    def start(self, size):
+        response = self.client.post('/api/uploads/', {'size': size}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def send(self, upload_id, offset, chunk):
+        return self.client.patch(
+            f'/api/uploads/{upload_id}/', chunk,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_resumable_upload(self):
+        upload_id = self.start(len(PNG))
+        self.assertEqual(self.send(upload_id, 0, PNG[:1000]).data['offset'], 1000)
+        # A resent chunk is refused with the offset to resume from.
+        response = self.send(upload_id, 0, PNG[:1000])
+        self.assertEqual((response.status_code, response.data['offset']), (409, 1000))
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], 1000)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send(upload_id, 1000, PNG[1000:])
+        self.assertEqual(response.status_code, 200, response.data)
+        sha256 = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(response.data['media']['id'], sha256)
+        self.assertEqual(response.data['media']['content_type'], 'image/png')
+        stored = settings.MEDIA_ROOT / media.directory(sha256) / 'original.png'
+        self.assertEqual(stored.read_bytes(), PNG)
+        self.assertFalse(any(settings.UPLOAD_TEMP_DIR.iterdir()))
+
+    def test_concurrent_final_chunks_store_once(self):
+        upload_id = self.start(len(PNG))
+        self.send(upload_id, 0, PNG[:1000])
+        stale = Upload.objects.get(id=upload_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.send(upload_id, 1000, PNG[1000:]).status_code, 200)
+        # Requests that read the upload before it completed.
+        for offset in (1000, len(PNG)):
+            with self.subTest(offset=offset):
+                media.append(stale, offset, BytesIO(PNG[offset:]), len(PNG) - offset)
+                self.assertEqual(stale.media.sha256, hashlib.sha256(PNG).hexdigest())
+        self.assertEqual(Media.objects.count(), 1)
+        self.assertTrue(Upload.objects.filter(id=upload_id).exists())
+        self.assertFalse(any(settings.UPLOAD_TEMP_DIR.iterdir()))
+
+    def test_duplicates_are_stored_once(self):
+        for _ in range(2):
+            upload_id = self.start(len(PNG))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.send(upload_id, 0, PNG).status_code, 200)
+        self.assertEqual(Media.objects.count(), 1)
+        self.assertEqual(len(list(settings.MEDIA_ROOT.rglob('original.*'))), 1)
+
+    def test_rejects_unknown_types_and_overruns(self):
+        upload_id = self.start(4)
+        self.assertEqual(self.send(upload_id, 0, b'12345').status_code, 413)
+        self.assertEqual(self.send(upload_id, 0, b'1234').status_code, 415)
+        self.assertFalse(Upload.objects.filter(id=upload_id).exists())
+
+    def test_media_in_posts_and_served(self):
+        upload_id = self.start(len(PNG))
+        with self.captureOnCommitCallbacks(execute=True):
+            sha256 = self.send(upload_id, 0, PNG).data['media']['id']
+        response = self.client.post('/api/posts/', {'content': 'Look', 'media': [sha256]}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        feed = self.client.get('/api/posts/').data['results']
+        self.assertEqual(feed[0]['media'][0]['variants']['thumbnail'], f'/api/media/{sha256}/thumbnail/')
+        response = self.client.post('/api/posts/', {'content': 'Gone', 'media': ['f' * 64]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/media/{sha256}/thumbnail/')
+        self.assertEqual(b''.join(response.streaming_content), PNG)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        with override_settings(MEDIA_ACCEL_REDIRECT='/_media/'):
+            response = self.client.get(f'/api/media/{sha256}/original/')
+        self.assertEqual(response['X-Accel-Redirect'], f'/_media/{media.directory(sha256)}/original.png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(f'/api/media/{sha256}/huge/').status_code, 404)
+
+
+class ChatInboxTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        self.quiet_chat = Chat.objects.create()
+        self.quiet_chat.members.add(self.alice)
+
+    def send(self, member, text):
+        self.client.force_authenticate(member)
+        response = self.client.post(
+            f'/api/messages/chat/{self.chat.id}/send/', {'text': text}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_send_updates_preview_and_unread_count(self):
+        self.send(self.bob, 'First')
+        latest = self.send(self.bob, 'Second')
+        self.client.force_authenticate(self.alice)
+        results = self.client.get('/api/messages/chats/').data['results']
+        self.assertEqual([chat['id'] for chat in results], [self.chat.id, self.quiet_chat.id])
+        self.assertEqual(results[0]['last_message']['id'], latest['id'])
+        self.assertEqual(results[0]['last_message']['author']['username'], 'bob')
+        self.assertEqual(results[0]['unread_count'], 2)
+        self.assertIsNone(results[1]['last_message'])
+        self.assertEqual(results[1]['unread_count'], 0)
+
+    def test_group_chat_watermarks(self):
+        carol = create_member('carol')
+        self.chat.members.add(carol)
+        first = self.send(self.bob, 'First')
+        self.send(carol, 'Second')
+        self.send(self.bob, 'Third')
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/messages/chat/{self.chat.id}/read/', {'message_id': first['id']}, format='json')
+        summary = self.client.get('/api/messages/unread/').data
+        self.assertEqual(summary['total'], 2)
+        self.assertEqual(
+            summary['chats'],
+            [{'chat_id': self.chat.id, 'unread_count': 2, 'last_read_message_id': first['id']}],
+        )
+        self.client.force_authenticate(carol)
+        self.assertEqual(self.client.get('/api/messages/unread/').data['total'], 2)
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/messages/chat/{self.chat.id}/read/')
+        self.client.post(f'/api/messages/chat/{self.chat.id}/read/', {'message_id': first['id']}, format='json')
+        self.assertEqual(self.client.get('/api/messages/unread/').data, {'total': 0, 'chats': []})
+        self.client.force_authenticate(self.bob)
+        unread = self.client.get(f'/api/messages/unread/?chat_ids={self.chat.id}').data['chats']
+        self.assertEqual(unread[0]['unread_count'], 1)
+
+    def test_mark_read_rejects_non_integer_ids(self):
+        self.send(self.bob, 'First')
+        self.client.force_authenticate(self.alice)
+        for message_id in (True, False, 'latest', 1.5):
+            with self.subTest(message_id=message_id):
+                response = self.client.post(
+                    f'/api/messages/chat/{self.chat.id}/read/', {'message_id': message_id}, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/messages/unread/').data['total'], 1)
+
+
+class QueryBudgetMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.member = create_member('timed')
+        self.client.force_authenticate(self.member)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/posts/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+
+    @override_settings(QUERY_BUDGETS={'posts_list_create': 0})
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get('/api/posts/')
+        self.assertIn('posts_list_create', logs.output[0])
+
+
+class IndexAdvisorTests(APITestCase):
+
+    def test_feed_and_messages_use_indexes(self):
+        out = StringIO()
+        call_command('index_advisor', seed=40, stdout=out, no_color=True)
+        report = out.getvalue()
+        self.assertIn('posts_list_create: ok', report)
+        self.assertIn('chat_messages: ok', report)
+        self.assertFalse(Member.objects.filter(username__startswith='advisor').exists())
+
+
+class SeedTests(APITestCase):
+
+    def test_powerlaw_degrees_are_skewed(self):
+        out = StringIO()
+        call_command(
+            'seed_social_graph', members=300, friends=6, degree_distribution='powerlaw', posts=1, likes=0,
+            comments=0, chats=1, messages=2, prefix='graph', stdout=out, no_color=True,
+        )
+        self.assertIn('Created 300 members', out.getvalue())
+        members = Member.objects.filter(username__startswith='graph')
+        degrees = [len(friend_graph.friend_ids(member.id)) for member in members]
+        self.assertGreater(max(degrees), 4 * sorted(degrees)[len(degrees) // 2])
+
+
+class FriendGraphTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.carol = create_member('carol')
+        befriend(self.alice, self.bob)
+        befriend(self.carol, self.bob)
+
+    def test_cached_lookups(self):
+        friend_graph.friend_ids(self.bob.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(self.bob.id, self.alice.id))
+            self.assertFalse(friend_graph.are_friends(self.bob.id, self.bob.id))
+            self.assertEqual(friend_graph.friend_count(self.bob.id), 2)
+
+    def test_mutual_friends(self):
+        self.assertEqual(friend_graph.mutual_friend_ids(self.alice.id, self.carol.id), {self.bob.id})
+
+    def test_views_invalidate(self):
+        self.assertEqual(friend_graph.friend_ids(self.alice.id), {self.bob.id})
+        self.client.force_authenticate(self.alice)
+        self.client.delete('/api/friends/alice/bob/')
+        self.assertEqual(friend_graph.friend_ids(self.alice.id), set())
+
+        self.client.post('/api/friends/alice/', {'target_username': 'carol'}, format='json')
+        request = Friendship.objects.get(from_member=self.alice, to_member=self.carol)
+        self.client.force_authenticate(self.carol)
+        self.client.post(f'/api/friends/carol/accept/{request.id}/')
+        self.assertEqual(friend_graph.friend_ids(self.alice.id), {self.carol.id})
+        self.assertEqual(friend_graph.friend_ids(self.carol.id), {self.alice.id, self.bob.id})
+
+        response = self.client.post('/api/friends/carol/', {'target_username': 'alice'}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ExportTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.friends = seed_network(self.alice, 3)
+        create_post(self.alice, 'Mine')
+        self.client.force_authenticate(self.alice)
+
+    def export(self, cursor=None):
+        path = f'/api/member/{self.alice.id}/export/'
+        response = self.client.get(path, {'cursor': cursor} if cursor else None)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_sections(self):
+        records = self.export()
+        counts = {}
+        for record in records:
+            counts[record['type']] = counts.get(record['type'], 0) + 1
+        self.assertEqual(counts, {
+            'member': 1, 'post': 1, 'comment': 6, 'like': 6, 'friendship': 6, 'chat': 3, 'message': 9, 'end': 1,
+        })
+        self.assertEqual(records[0]['data']['username'], 'alice')
+        self.assertEqual(records[-1], {'type': 'end'})
+
+    @override_settings(EXPORT_ITERATOR_CHUNK_SIZE=2, EXPORT_BUFFER_SIZE=1)
+    def test_resume_from_cursor(self):
+        records = self.export()
+        for index in (0, 5, 20, len(records) - 2):
+            with self.subTest(index=index):
+                self.assertEqual(self.export(records[index]['cursor']), records[index + 1:])
+
+    def test_rows_are_iterated(self):
+        with mock.patch('django.db.models.query.QuerySet.iterator', autospec=True,
+                        side_effect=lambda queryset, chunk_size: iter(queryset)) as iterator:
+            self.export()
+        self.assertEqual(iterator.call_count, len(export.SECTIONS))
+        self.assertEqual({call.kwargs['chunk_size'] for call in iterator.call_args_list},
+                         {settings.EXPORT_ITERATOR_CHUNK_SIZE})
+
+    def test_invalid_cursor(self):
+        for cursor in ('posts', 'unknown:1', 'post:x'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/member/{self.alice.id}/export/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_only_own_data(self):
+        response = self.client.get(f'/api/member/{self.friends[0].id}/export/')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            f'/api/member/{self.friends[0].id}/export/', HTTP_ACCEPT='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.content), {'detail': 'Can only export own data.'})
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncViewTests(APITestCase):
+    """
+    The async views served through the ASGI request handler.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        befriend(self.alice, self.bob)
+        self.post = create_post(self.bob, 'Async hello')
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        Message.objects.create(chat=self.chat, author=self.bob, text='Ping')
+
+    async def login(self):
+        await self.async_client.aforce_login(self.alice, backend='api.backends.MemberBackend')
+
+    async def test_feed(self):
+        await self.login()
+        response = await self.async_client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['content'] for post in response.json()['results']], ['Async hello'])
+        self.assertIn('Server-Timing', response)
+
+    async def test_feed_requires_authentication(self):
+        response = await self.async_client.get('/api/posts/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_post_detail(self):
+        response = await self.async_client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response.json()['author']['username'], 'bob')
+        response = await self.async_client.get(f'/api/posts/{self.post.id + 100}/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_profile(self):
+        response = await self.async_client.get('/api/profile/bob/')
+        self.assertEqual(response.json()['username'], 'bob')
+
+    async def test_chat_messages(self):
+        await self.login()
+        response = await self.async_client.get(f'/api/messages/chat/{self.chat.id}/')
+        self.assertEqual([message['text'] for message in response.json()['results']], ['Ping'])
+
+    async def test_export_streams_asynchronously(self):
+        await self.login()
+        response = await self.async_client.get(f'/api/member/{self.alice.id}/export/')
+        self.assertTrue(response.streaming)
+        content = b''.join([block async for block in response.streaming_content])
+        types = [json.loads(line)['type'] for line in content.splitlines()]
+        self.assertEqual(types, ['member', 'friendship', 'chat', 'message', 'end'])
+
+    async def test_caches_are_read_off_the_event_loop(self):
+        await self.login()
+        calls = []
+
+        def guard(method):
+            def call(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    calls.append(method.__name__)
+                    return method(*args, **kwargs)
+                raise AssertionError(f'cache.{method.__name__}() blocked the event loop')
+            return call
+
+        backend = type(caches['default'])
+        names = ['get', 'get_many', 'set', 'set_many', 'add', 'delete']
+        with mock.patch.multiple(backend, **{name: guard(getattr(backend, name)) for name in names}):
+            for path in ('/api/posts/', f'/api/posts/{self.post.id}/', '/api/profile/bob/',
+                         f'/api/messages/chat/{self.chat.id}/'):
+                with self.subTest(path=path):
+                    response = await self.async_client.get(path)
+                    self.assertEqual(response.status_code, 200)
+        self.assertIn('get_many', calls)
+
+    async def test_sync_handlers_still_work(self):
+        await self.login()
+        response = await self.async_client.patch(
+            '/api/profile/alice/', {'avatar': 'https://example.com/a.png'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['avatar'], 'https://example.com/a.png')
+
+    async def test_async_handlers_serve_asgi(self):
+        await self.login()
+        with mock.patch.object(PostsListCreateView, 'get') as get:
+            response = await self.async_client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+        get.assert_not_called()
+
+    def test_sync_handlers_serve_wsgi(self):
+        self.client.force_authenticate(self.alice)
+        self.assertFalse(iscoroutinefunction(resolve('/api/posts/').func))
+        with mock.patch.object(PostsListCreateView, 'aget') as aget:
+            for path in ('/api/posts/', f'/api/posts/{self.post.id}/', '/api/profile/bob/',
+                         f'/api/messages/chat/{self.chat.id}/'):
+                with self.subTest(path=path):
+                    self.assertEqual(self.client.get(path).status_code, 200)
+        aget.assert_not_called()
+
+
+class PasswordTests(APITestCase):
+
+    def login(self, username='alice', password='secret-pass'):
+        return self.client.post('/api/auth/login/', {'username': username, 'password': password}, format='json')
+
+    def test_login_upgrades_old_hashes(self):
+        member = Member.objects.create(
+            username='alice', email='alice@example.com', password=make_password('secret-pass', hasher='pbkdf2_sha1')
+        )
+        self.assertEqual(self.login().status_code, 200)
+        member.refresh_from_db()
+        self.assertTrue(member.password.startswith('scrypt$'))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_upgrade_drops_cached_principal(self):
+        member = Member.objects.create(
+            username='alice', email='alice@example.com', password=make_password('secret-pass', hasher='pbkdf2_sha1')
+        )
+        token = authentication.issue_token(member, authentication.ACCESS)
+        authentication.verify_token(token, authentication.ACCESS)  # caches the principal
+        self.assertEqual(self.login().status_code, 200)
+        self.assertIsNone(authentication.principals.get(member.id))
+        # Rehashing is not a password change: earlier tokens stay valid.
+        self.assertEqual(authentication.verify_token(token, authentication.ACCESS).id, member.id)
+
+    def test_saving_a_rehashed_member_keeps_tokens(self):
+        Member.objects.create(
+            username='alice', email='alice@example.com', password=make_password('secret-pass', hasher='pbkdf2_sha1')
+        )
+        member = Member.objects.get(username='alice')
+        token = authentication.issue_token(member, authentication.ACCESS)
+        self.assertTrue(passwords.check_password(member, 'secret-pass'))
+        member.avatar = 'https://example.com/a.png'
+        member.save()
+        self.assertEqual(Member.objects.get(id=member.id).credential_version, 0)
+        self.assertEqual(authentication.verify_token(token, authentication.ACCESS).id, member.id)
+
+        member.password = make_password('another-pass')
+        member.save(update_fields=['password'])
+        self.assertEqual(Member.objects.get(id=member.id).credential_version, 1)
+        with self.assertRaises(AuthenticationFailed):
+            authentication.verify_token(token, authentication.ACCESS)
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS, LOGIN_FAILURE_LIMIT=2)
+    def test_repeated_failures_are_refused_without_hashing(self):
+        create_member('alice')
+        create_member('bob')
+        with mock.patch.object(passwords, '_run', wraps=passwords._run) as run:
+            self.assertEqual(self.login(password='wrong').status_code, 401)
+            self.assertEqual(self.login(password='wrong').status_code, 401)
+            response = self.login()
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(run.call_count, 2)
+            self.assertEqual(self.login('bob').status_code, 200)
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS, LOGIN_FAILURE_LIMIT=2)
+    def test_failures_survive_the_cache_and_expire(self):
+        create_member('alice')
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        cache.clear()
+        self.assertEqual(self.login().status_code, 429)
+        self.assertEqual(LoginFailure.objects.get(key='login:failures:user:alice').count, 2)
+
+        LoginFailure.objects.update(expires_at=timezone.now())
+        self.assertEqual(passwords.prune_failures(), 2)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(LoginFailure.objects.get(key='login:failures:user:alice').count, 1)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertFalse(LoginFailure.objects.filter(key='login:failures:user:alice').exists())
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+    def test_full_pool_answers_429(self):
+        create_member('alice')
+        passwords._run(len, '')  # creates the pool if this is the first hash
+        with mock.patch.object(passwords, '_slots', passwords.Slots('', 0)):
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_slots_are_shared_between_processes(self):
+        context = multiprocessing.get_context('fork')
+        result = context.Queue()
+
+        def acquire_in_child(path):
+            child = context.Process(target=lambda: result.put(passwords.Slots(path, 2).acquire()))
+            child.start()
+            child.join()
+            return result.get(timeout=5)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'password-hash')
+            slots = passwords.Slots(path, 2)
+            self.assertEqual((slots.acquire(), slots.acquire(), slots.acquire()), (0, 1, None))
+            self.assertIsNone(acquire_in_child(path))
+            slots.release(0)
+            self.assertEqual(acquire_in_child(path), 0)
+            # The child's slot was freed when it exited.
+            self.assertEqual(slots.acquire(), 0)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, RATE_LIMITS={
+    'send_message': '60/min burst 2',
+    'POST friends': '1/min',
+    'auth_register': '1/hour',
+})
+class ThrottleTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def send(self):
+        return self.client.post(f'/api/messages/chat/{self.chat.id}/send/', {'text': 'Hi'}, format='json')
+
+    def test_burst_then_retry_after(self):
+        self.assertEqual([self.send().status_code for _ in range(3)], [201, 201, 429])
+        response = self.send()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_buckets_refill(self):
+        with mock.patch('time.time', return_value=1000.0):
+            self.assertEqual([self.send().status_code for _ in range(3)], [201, 201, 429])
+        with mock.patch('time.time', return_value=1001.0):
+            self.assertEqual([self.send().status_code for _ in range(2)], [201, 429])
+
+    def test_per_member_and_method(self):
+        self.client.post('/api/friends/alice/', {'target_username': 'bob'}, format='json')
+        response = self.client.post('/api/friends/alice/', {'target_username': 'bob'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(self.client.get('/api/friends/alice/').status_code, 200)
+        self.client.force_authenticate(self.bob)
+        response = self.client.post('/api/friends/bob/', {'target_username': 'alice'}, format='json')
+        self.assertNotEqual(response.status_code, 429)
+
+    def test_anonymous_by_address(self):
+        self.client.force_authenticate(None)
+        for index, expected in enumerate([201, 429]):
+            response = self.client.post('/api/auth/register/', {
+                'username': f'new{index}', 'email': f'new{index}@example.com', 'password': 'secret-pass',
+            }, format='json', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, expected)
+
+    def test_shared_memory_store_across_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'throttle')
+            store = throttling.SharedMemoryStore(path, 64)
+            self.assertEqual(store.take('key', 1.0, 2)[0], True)
+            pid = os.fork()
+            if pid == 0:
+                allowed, _ = throttling.SharedMemoryStore(path, 64).take('key', 1.0, 2)
+                os._exit(0 if allowed else 1)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+            allowed, wait = store.take('key', 1.0, 2)
+            self.assertFalse(allowed)
+            self.assertGreater(wait, 0.9)
+
+    def test_shared_memory_file_is_never_shrunk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'throttle')
+            large = throttling.SharedMemoryStore(path, 64)
+            large.take('key', 1.0, 2)
+            small = throttling.SharedMemoryStore(path, 16)
+            self.assertEqual(sorted(os.listdir(tmp)), ['throttle-16', 'throttle-64'])
+            self.assertEqual(os.path.getsize(f'{path}-64'), 64 * throttling.SLOT.size)
+            self.assertTrue(small.take('key', 1.0, 2)[0])
+            self.assertTrue(large.take('key', 1.0, 2)[0])
+            self.assertFalse(large.take('key', 1.0, 2)[0])
+
+    def test_full_table_evicts_instead_of_refusing(self):
+        store = throttling.SharedMemoryStore('', throttling.WAYS)
+        with mock.patch('time.time', return_value=1000.0):
+            for index in range(throttling.WAYS):
+                store.take(f'old{index}', 1.0, 1)
+        with mock.patch('time.time', return_value=1000.5):
+            self.assertEqual(store.take('new', 1.0, 1), (True, 0.0))
+            self.assertFalse(store.take('new', 1.0, 1)[0])
+
+    @override_settings(THROTTLE_STORE='cache')
+    def test_cache_store(self):
+        self.assertEqual([self.send().status_code for _ in range(3)], [201, 201, 429])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class TokenAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.member = create_member('alice')
+
+    def login(self, client=None):
+        client = client or self.client
+        response = client.post(
+            '/api/auth/login/', {'username': 'alice', 'password': 'secret-pass'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def bearer(self, token):
+        client = test.APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def test_login_is_stateless(self):
+        response = self.login()
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertIn('access_token', response.cookies)
+        self.assertEqual(response.cookies['refresh_token']['path'], '/api/auth/refresh/')
+
+    def test_authenticated_reads_skip_auth_queries(self):
+        client = self.bearer(self.login().data['access'])
+        self.assertEqual(client.get('/api/auth/me/').data['username'], 'alice')
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+
+    def test_cookie_requires_csrf(self):
+        client = test.APIClient(enforce_csrf_checks=True)
+        self.login(client)
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+        response = client.post('/api/posts/', {'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = client.post(
+            '/api/posts/', {'content': 'Hi'}, format='json',
+            HTTP_X_CSRFTOKEN=client.cookies['csrftoken'].value,
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_password_change_revokes_tokens(self):
+        client = self.bearer(self.login().data['access'])
+        client.get('/api/auth/me/')
+        self.member.password = make_password('another-pass')
+        self.member.save()
+        self.assertEqual(client.get('/api/auth/me/').status_code, 401)
+
+    def test_deactivation_revokes_tokens(self):
+        client = self.bearer(self.login().data['access'])
+        client.get('/api/auth/me/')
+        self.member.is_active = False
+        self.member.save()
+        self.assertEqual(client.get('/api/auth/me/').status_code, 401)
+
+    def test_deactivation_by_update_revokes_tokens(self):
+        client = self.bearer(self.login().data['access'])
+        client.get('/api/auth/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Member.objects.filter(id=self.member.id).update(is_active=False)
+        self.assertEqual(client.get('/api/auth/me/').status_code, 401)
+
+    def test_invalidation_reaches_other_workers(self):
+        client = self.bearer(self.login().data['access'])
+        client.get('/api/auth/me/')
+        Member.objects.filter(id=self.member.id).update(avatar='https://example.com/a.png')
+        # Another worker saves the member: only the shared version changes here.
+        with mock.patch.object(authentication, 'principals', authentication.PrincipalCache()):
+            with self.captureOnCommitCallbacks(execute=True):
+                Member.objects.get(id=self.member.id).save()
+        self.assertEqual(client.get('/api/auth/me/').data['avatar'], 'https://example.com/a.png')
+
+    def test_stale_principal_is_reloaded_before_rejecting(self):
+        client = self.bearer(self.login().data['access'])
+        client.get('/api/auth/me/')
+        # Another worker changes the password before its version bump lands.
+        Member.objects.filter(id=self.member.id).update(password=make_password('another-pass'))
+        Member.objects.filter(id=self.member.id).update(credential_version=1)
+        authentication.principals.set(
+            self.member.id, self.member, cache.get(authentication.VERSION_KEY.format(self.member.id))
+        )
+        fresh = Member.objects.get(id=self.member.id)
+        client = self.bearer(authentication.issue_token(fresh, authentication.ACCESS))
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+
+    def test_refresh(self):
+        tokens = self.login().data
+        response = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.bearer(response.data['access']).get('/api/auth/me/').status_code, 200)
+        response = self.client.post('/api/auth/refresh/', {'refresh': tokens['access']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(ACCESS_TOKEN_LIFETIME=-1)
+    def test_expired_token(self):
+        response = self.bearer(self.login().data['access']).get('/api/auth/me/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    def test_stale_cookie_does_not_block_login(self):
+        self.client.cookies['access_token'] = 'garbage'
+        self.login()
+
+
+class ConditionalRequestTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        with self.captureOnCommitCallbacks(execute=True):
+            befriend(self.alice, self.bob)
+            self.post = create_post(self.bob, 'Cached')
+
+    def revalidate(self, path, response):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_post_detail(self):
+        path = f'/api/posts/{self.post.id}/'
+        response = self.client.get(path)
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            cached = self.revalidate(path, response)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(
+            self.client.get(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'{path}like/')
+        self.assertEqual(self.revalidate(path, response).status_code, 200)
+
+    def test_post_follows_author_profile(self):
+        path = f'/api/posts/{self.post.id}/'
+        response = self.client.get(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.avatar = 'https://example.com/bob.png'
+            self.bob.save()
+        response = self.revalidate(path, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author']['avatar'], 'https://example.com/bob.png')
+
+    def test_profile(self):
+        response = self.client.get('/api/profile/bob/')
+        self.assertEqual(self.revalidate('/api/profile/bob/', response).status_code, 304)
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/profile/bob/', {'avatar': 'https://example.com/b.png'}, format='json')
+        self.assertEqual(self.revalidate('/api/profile/bob/', response).status_code, 200)
+
+    def test_feed(self):
+        self.client.force_authenticate(self.alice)
+        response = self.client.get('/api/posts/')
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate('/api/posts/', response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_post(self.bob, 'Fresh')
+        response = self.revalidate('/api/posts/', response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['content'], 'Fresh')
+
+        carol = create_member('carol')
+        with self.captureOnCommitCallbacks(execute=True):
+            befriend(self.alice, carol)
+        self.assertEqual(self.revalidate('/api/posts/', response).status_code, 200)
+
+    def test_feed_follows_posts_and_authors(self):
+        self.client.force_authenticate(self.alice)
+        response = self.client.get('/api/posts/')
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        response = self.revalidate('/api/posts/', response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['likes_count'], 1)
+
+        self.client.post(f'/api/posts/{self.post.id}/comment/', {'text': 'Nice'}, format='json')
+        response = self.revalidate('/api/posts/', response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['comments_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.avatar = 'https://example.com/bob.png'
+            self.bob.save()
+        response = self.revalidate('/api/posts/', response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['author']['avatar'], 'https://example.com/bob.png')
+
+        presence.heartbeat(self.bob.id)
+        self.assertEqual(self.revalidate('/api/posts/', response).status_code, 200)
+
+
+class FragmentCacheTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.authors = [create_member(f'author{index}') for index in range(3)]
+        for author in self.authors:
+            befriend(self.alice, author)
+            create_post(author, f'By {author.username}')
+        self.client.force_authenticate(self.alice)
+
+    def fragment_timing(self, response):
+        return response['Server-Timing'].split('frag;desc=')[1]
+
+    def test_feed_served_from_fragments(self):
+        first = self.client.get('/api/posts/')
+        self.assertEqual(self.fragment_timing(first), '"0 hits, 6 misses"')
+        second = self.client.get('/api/posts/')
+        self.assertEqual(self.fragment_timing(second), '"6 hits, 0 misses"')
+        self.assertEqual(first.json()['results'], second.json()['results'])
+
+    def test_counter_change_refreshes_post(self):
+        self.client.get('/api/posts/')
+        post = self.authors[0].posts.get()
+        self.client.post(f'/api/posts/{post.id}/like/')
+        response = self.client.get(f'/api/posts/{post.id}/')
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertEqual(self.fragment_timing(response), '"1 hits, 1 misses"')
+
+    def test_profile_update_refreshes_member(self):
+        self.client.get('/api/posts/')
+        self.client.force_authenticate(self.authors[0])
+        self.client.patch('/api/profile/author0/', {'avatar': 'https://example.com/new.png'}, format='json')
+        self.client.force_authenticate(self.alice)
+        results = self.client.get('/api/posts/').data['results']
+        avatars = {post['author']['username']: post['author']['avatar'] for post in results}
+        self.assertEqual(avatars['author0'], 'https://example.com/new.png')
+
+    def test_dynamic_fields_stay_live(self):
+        Member.objects.filter(username__startswith='author').update(
+            last_seen=self.alice.last_seen - timedelta(days=1)
+        )
+        results = self.client.get('/api/posts/').data['results']
+        self.assertFalse(any(post['author']['is_online'] for post in results))
+        presence.heartbeat(self.authors[1].id)
+        results = self.client.get('/api/posts/').data['results']
+        online = {post['author']['username']: post['author']['is_online'] for post in results}
+        self.assertEqual(online, {'author0': False, 'author1': True, 'author2': False})
+
+    def test_process_totals(self):
+        before = fragments.totals().hits
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+        self.assertEqual(fragments.totals().hits - before, 6)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CompiledSerializerTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.friends = seed_network(self.alice, 3)
+        create_post(self.friends[0], 'Zoë \u2028 says "hi" 👋')
+        chat = Chat.objects.filter(members=self.friends[0]).get()
+        Message.objects.create(chat=chat, author=self.friends[0], text='line\u2029break')
+        self.paths = [
+            '/api/posts/',
+            f'/api/posts/{Post.objects.latest("id").id}/',
+            '/api/messages/chats/',
+            f'/api/messages/chat/{chat.id}/',
+            '/api/friends/alice/',
+        ]
+        self.client.force_authenticate(self.alice)
+
+    def get_all(self):
+        cache.clear()
+        presence.flush()
+        return [self.client.get(path) for path in self.paths]
+
+    def test_same_bytes_as_drf(self):
+        compiled = self.get_all()
+        with mock.patch.object(CompiledFieldsMixin, 'compile_fields', False):
+            reference = self.get_all()
+        for path, response, expected in zip(self.paths, compiled, reference):
+            with self.subTest(path=path):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response.content, DRFJSONRenderer().render(expected.data))
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'text': 'Zoë \u2028\u2029 "quoted" 👋',
+            'when': self.alice.created_at,
+            'id': self.alice.id,
+            'nested': [{'none': None, 'flag': True, 1: 'int key'}],
+        }
+        self.assertEqual(JSONRenderer().render(data), DRFJSONRenderer().render(data))
+        self.assertEqual(JSONRenderer().render(None), b'')
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.stranger = create_member('stranger')
+        befriend(self.alice, self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def test_member_prefix_search(self):
+        create_member('alicia')
+        create_member('alan')
+        response = self.client.get('/api/search/members/?q=Ali')
+        self.assertEqual({member['username'] for member in response.data['results']}, {'alice', 'alicia'})
+        self.assertEqual(self.client.get('/api/search/members/?q=').status_code, 400)
+
+    def test_posts_limited_to_friends(self):
+        create_post(self.bob, 'Sunny weather in Riga')
+        create_post(self.alice, 'Weather report')
+        create_post(self.stranger, 'Weather elsewhere')
+        response = self.client.get('/api/search/posts/?q=weather')
+        authors = {post['author']['username'] for post in response.data['results']}
+        self.assertEqual(authors, {'alice', 'bob'})
+
+    def test_index_follows_edits_and_deletes(self):
+        post = create_post(self.bob, 'Draft about kittens')
+        post.content = 'Final about puppies'
+        post.save()
+        self.assertEqual(self.client.get('/api/search/posts/?q=kittens').data['results'], [])
+        self.assertEqual(len(self.client.get('/api/search/posts/?q=pupp').data['results']), 1)
+        post.delete()
+        self.assertEqual(self.client.get('/api/search/posts/?q=pupp').data['results'], [])
+
+    def test_ranked_message_pages(self):
+        chat = Chat.objects.create()
+        chat.members.add(self.alice, self.bob)
+        other = Chat.objects.create()
+        other.members.add(self.bob, self.stranger)
+        Message.objects.create(chat=other, author=self.bob, text='lunch lunch')
+        best = Message.objects.create(chat=chat, author=self.bob, text='lunch lunch lunch')
+        for number in range(4):
+            Message.objects.create(chat=chat, author=self.bob, text=f'lunch at {number} and some other words')
+        url = f'/api/messages/chat/{chat.id}/search/?q=lunch&limit=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertIsNone(response.data['previous'])
+            seen.extend(message['id'] for message in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen[0], best.id)
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+        self.assertEqual(self.client.get(f'/api/messages/chat/{other.id}/search/?q=lunch').status_code, 404)
+
+    def test_rebuild_indexes_bulk_writes(self):
+        Post.objects.bulk_create([Post(author=self.bob, content='Bulk loaded zeppelin')])
+        self.assertEqual(self.client.get('/api/search/posts/?q=zeppelin').data['results'], [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.client.get('/api/search/posts/?q=zeppelin').data['results']), 1)
+
+
+class TaskQueueTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        befriend(self.alice, self.bob)
+
+    def feed(self, member):
+        self.client.force_authenticate(member)
+        return [post['content'] for post in self.client.get('/api/posts/').data['results']]
+
+    def test_post_fan_out_runs_in_worker(self):
+        self.client.force_authenticate(self.bob)
+        self.client.post('/api/posts/', {'content': 'First'}, format='json')
+        self.client.post('/api/posts/', {'content': 'Second'}, format='json')
+        self.assertEqual(self.feed(self.bob), ['Second', 'First'])
+        self.assertEqual(self.feed(self.alice), [])
+
+        with mock.patch.object(timeline, 'fan_out_posts', wraps=timeline.fan_out_posts) as fan_out:
+            call_command('run_worker', '--once', stdout=StringIO())
+        fan_out.assert_called_once()
+        self.assertEqual(self.feed(self.alice), ['Second', 'First'])
+        self.assertEqual(Task.objects.filter(status=Task.STATUS_DONE).count(), 2)
+
+    def test_idempotency_key(self):
+        post = create_post(self.bob, 'Once')
+        for _ in range(2):
+            timeline.publish_post(post)
+        self.assertEqual(Task.objects.filter(name=timeline.fan_out_posts_task.task_name).count(), 1)
+
+    def test_accepted_friendship_backfilled(self):
+        carol = create_member('carol')
+        create_post(carol, 'Hello from carol')
+        self.client.force_authenticate(carol)
+        self.client.post('/api/friends/carol/', {'target_username': 'alice'}, format='json')
+        request = Friendship.objects.get(from_member=carol)
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/friends/alice/accept/{request.id}/')
+        self.assertEqual(self.feed(self.alice), [])
+        tasks.run_pending()
+        self.assertEqual(self.feed(self.alice), ['Hello from carol'])
+
+    def test_failures_retry_with_backoff(self):
+        tasks.enqueue(failing_task, {'reason': 'boom'})
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(tasks.run_pending(), 0)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.STATUS_QUEUED, 1))
+        self.assertIn('ValueError: boom', task.last_error)
+        self.assertGreater(task.run_at, task.created_at)
+
+        Task.objects.update(run_at=task.created_at)
+        with self.assertLogs('api.tasks', 'ERROR'):
+            tasks.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.STATUS_FAILED, 2))
+
+    def test_expired_lease_is_reclaimed(self):
+        tasks.enqueue(timeline.fan_out_posts_task, {'post_id': create_post(self.bob).id})
+        self.assertEqual(len(tasks.claim('fanout', 10)), 1)
+        self.assertEqual(tasks.claim('fanout', 10), [])
+        Task.objects.update(locked_until=Task.objects.get().created_at)
+        self.assertEqual(tasks.run_tasks(tasks.claim('fanout', 10)), 1)
+
+
+class PresenceTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.stored_last_seen = self.alice.last_seen
+        self.client.force_authenticate(self.alice)
+
+    def heartbeat(self):
+        response = self.client.put(f'/api/member/{self.alice.id}/last_seen/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_heartbeat_skips_database(self):
+        self.heartbeat()  # loads the cached friend set
+        with self.assertNumQueries(0):
+            self.heartbeat()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.last_seen, self.stored_last_seen)
+
+        data = self.client.get('/api/profile/alice/').data
+        self.assertTrue(data['is_online'])
+        self.assertGreater(data['last_seen'], self.stored_last_seen.isoformat())
+
+    def test_flush_writes_in_bulk(self):
+        self.heartbeat()
+        presence.heartbeat(self.bob.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(presence.flush(), 2)
+        self.assertEqual(presence.flush(), 0)
+        self.alice.refresh_from_db()
+        self.assertGreater(self.alice.last_seen, self.stored_last_seen)
+
+    @override_settings(PRESENCE_FLUSH_INTERVAL=0)
+    def test_flush_when_due(self):
+        self.heartbeat()
+        self.alice.refresh_from_db()
+        self.assertGreater(self.alice.last_seen, self.stored_last_seen)
+
+    def test_flush_on_timer(self):
+        with mock.patch.object(presence.threading, 'Timer') as timer:
+            self.heartbeat()
+            presence.heartbeat(self.bob.id)
+        timer.assert_called_once_with(settings.PRESENCE_FLUSH_INTERVAL, presence._timed_flush)
+        timer.return_value.start.assert_called_once()
+        with mock.patch.object(presence.connection, 'close') as close:
+            presence._timed_flush()
+        close.assert_called_once()
+        self.alice.refresh_from_db()
+        self.assertGreater(self.alice.last_seen, self.stored_last_seen)
+        self.assertEqual(presence.flush(), 0)
+
+    def test_heartbeat_reports_coming_online(self):
+        self.assertTrue(presence.heartbeat(self.bob.id)[1])
+        self.assertFalse(presence.heartbeat(self.bob.id)[1])
+        stale = timezone.now() - timedelta(seconds=settings.PRESENCE_ONLINE_WINDOW + 1)
+        self.assertTrue(presence.heartbeat(self.alice.id, stale)[1])
+        self.assertTrue(presence.heartbeat(self.alice.id)[1])
+
+    def test_only_own_presence(self):
+        response = self.client.put(f'/api/member/{self.bob.id}/last_seen/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_patch_is_a_heartbeat(self):
+        response = self.client.patch(f'/api/member/{self.alice.id}/last_seen/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(presence.online_ids([self.alice.id]), {self.alice.id})
+
+    def test_online_lookup(self):
+        presence.heartbeat(self.bob.id)
+        self.assertEqual(presence.online_ids([self.alice.id, self.bob.id]), {self.bob.id})
+
+    def test_chat_members_share_one_lookup(self):
+        chats = []
+        for _ in range(3):
+            chat = Chat.objects.create()
+            chat.members.add(self.alice, self.bob)
+            chats.append(chat)
+        Member.objects.filter(id=self.alice.id).update(last_seen=self.stored_last_seen - timedelta(days=1))
+        presence.heartbeat(self.bob.id)
+        chats = list(Chat.objects.prefetch_related('members'))
+        with mock.patch.object(presence, 'last_seen_many', wraps=presence.last_seen_many) as lookup:
+            data = ChatSerializer(chats, many=True).data
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(
+            {(member['username'], member['is_online']) for chat in data for member in chat['members']},
+            {('alice', False), ('bob', True)},
+        )
+
+
+class RealtimeTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        befriend(self.alice, self.bob)
+        self.chat = Chat.objects.create()
+        self.chat.members.add(self.alice, self.bob)
+        self.subscription = realtime.subscribe(self.bob.id)
+        self.addCleanup(self.subscription.close)
+
+    def test_new_message_is_pushed(self):
+        self.client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/messages/chat/{self.chat.id}/send/', {'text': 'Hi'}, format='json')
+        event = self.subscription.get(0)
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['data']['text'], 'Hi')
+        self.assertEqual(event['data']['chat_id'], self.chat.id)
+
+    def test_read_receipt(self):
+        Message.objects.create(chat=self.chat, author=self.bob, text='Ping')
+        self.client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/messages/chat/{self.chat.id}/read/')
+        event = self.subscription.get(0)
+        self.assertEqual(event['type'], 'read')
+        self.assertEqual(event['data']['member_id'], self.alice.id)
+        self.assertEqual(event['data']['last_message_id'], self.chat.messages.get().id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/messages/chat/{self.chat.id}/read/')
+        self.assertIsNone(self.subscription.get(0))
+
+    def test_presence_reaches_friends(self):
+        self.client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/member/{self.alice.id}/last_seen/')
+        event = self.subscription.get(0)
+        self.assertEqual(event, {
+            'id': event['id'],
+            'type': 'presence',
+            'data': {'member_id': self.alice.id, 'last_seen': event['data']['last_seen'], 'is_online': True},
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/member/{self.alice.id}/last_seen/')
+        self.assertIsNone(self.subscription.get(0))
+
+    def test_offline_reaches_friends_once(self):
+        presence.heartbeat(self.alice.id, timezone.now() - timedelta(seconds=settings.PRESENCE_ONLINE_WINDOW + 1))
+        presence.flush()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(presence.publish_offline(), 1)
+        event = self.subscription.get(0)
+        self.assertEqual(event['type'], 'presence')
+        self.assertEqual((event['data']['member_id'], event['data']['is_online']), (self.alice.id, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(presence.publish_offline(), 0)
+        self.assertIsNone(self.subscription.get(0))
+
+    def test_sync_server_refuses_stream(self):
+        self.client.force_authenticate(self.alice)
+        with mock.patch.object(realtime, 'subscribe') as subscribe:
+            response = self.client.get('/api/events/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 426)
+        self.assertTrue(response.content.startswith(b'event: error'))
+        subscribe.assert_not_called()
+
+    @override_settings(REALTIME_REPLAY_SIZE=2)
+    def test_events_are_buffered_for_replay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(3):
+                realtime.publish([self.bob.id], 'ping', {'n': number})
+        events = [self.subscription.get(0) for _ in range(3)]
+        self.assertEqual([event['data']['n'] for event in events], [0, 1, 2])
+        self.assertEqual(len({event['id'] for event in events}), 3)
+        self.assertEqual(sorted(events, key=lambda event: int(event['id'])), events)
+
+        self.assertEqual(realtime.replay(self.bob.id, '0'), events[1:])
+        self.assertEqual(realtime.replay(self.bob.id, events[1]['id']), events[2:])
+        self.assertEqual(realtime.replay(self.bob.id, events[2]['id']), [])
+        for last_event_id in (None, 'garbage'):
+            self.assertEqual(realtime.replay(self.bob.id, last_event_id), [])
+        self.assertEqual(realtime.replay(self.alice.id, '0'), [])
+
+    def test_stream_requires_authentication(self):
+        response = self.client.get('/api/events/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith(b'event: error'))
+
+    async def test_async_stream(self):
+        await self.async_client.aforce_login(self.alice, backend='api.backends.MemberBackend')
+        response = await self.async_client.get('/api/events/')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 1000\n\n')
+        realtime.get_bus().publish(realtime.CHANNEL.format(self.alice.id), {'type': 'ping', 'data': {}})
+        self.assertEqual(await anext(chunks), b'event: ping\ndata: {}\n\n')
+        await chunks.aclose()
+
+    async def test_async_stream_resumes_after_last_event_id(self):
+        for number in (1, 2):
+            realtime.remember([self.alice.id], {'id': str(number), 'type': 'ping', 'data': {'n': number}})
+        await self.async_client.aforce_login(self.alice, backend='api.backends.MemberBackend')
+        response = await self.async_client.get('/api/events/', headers={'Last-Event-ID': '1'})
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 1000\n\n')
+        self.assertEqual(await anext(chunks), b'id: 2\nevent: ping\ndata: {"n": 2}\n\n')
+        # Already replayed, then new.
+        channel = realtime.CHANNEL.format(self.alice.id)
+        realtime.get_bus().publish(channel, {'id': '2', 'type': 'ping', 'data': {'n': 2}})
+        realtime.get_bus().publish(channel, {'id': '3', 'type': 'ping', 'data': {'n': 3}})
+        self.assertEqual(await anext(chunks), b'id: 3\nevent: ping\ndata: {"n": 3}\n\n')
+        await chunks.aclose()
+
+    def test_redis_bus_through_broker(self):
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        ports = []
+
+        def on_start(port):
+            ports.append(port)
+            started.set()
+
+        task = loop.create_task(Broker().serve('127.0.0.1', 0, on_start))
+
+        def run():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, task.cancel)
+        self.assertTrue(started.wait(5))
+
+        bus = realtime.RedisBus(f'redis://127.0.0.1:{ports[0]}')
+        subscription = bus.subscribe(['member:1'])
+        self.addCleanup(subscription.close)
+        self.assertEqual(bus.publish('member:1', {'type': 'message', 'data': {'id': 7}}), 1)
+        self.assertEqual(bus.publish('member:2', {'type': 'message', 'data': {}}), 0)
+        self.assertEqual(subscription.get(5), {'type': 'message', 'data': {'id': 7}})
+        self.assertIsNone(subscription.get(0.1))
+
+
+@override_settings(RATE_LIMITS={})
+class CommentThreadTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.post = create_post(self.alice)
+        self.client.force_authenticate(self.alice)
+
+    def reply(self, text, parent=None):
+        data = {'text': text, 'parent_id': parent['id'] if parent else None}
+        response = self.client.post(f'/api/posts/{self.post.id}/comment/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def comments(self, query=''):
+        return self.client.get(f'/api/posts/{self.post.id}/comments/{query}').data
+
+    def test_tree_loads_in_constant_queries(self):
+        for thread in range(3):
+            parent = self.reply(f'Thread {thread}')
+            for level in range(4):
+                parent = self.reply(f'Reply {thread}.{level}', parent)
+        self.comments()  # warm member fragments
+        with self.assertNumQueries(3):
+            results = self.comments('?depth=10')['results']
+        self.assertEqual([comment['text'] for comment in results], ['Thread 0', 'Thread 1', 'Thread 2'])
+        node, texts = results[1], []
+        while node['replies']:
+            node = node['replies'][0]
+            texts.append(node['text'])
+        self.assertEqual(texts, [f'Reply 1.{level}' for level in range(4)])
+        self.assertEqual(node['depth'], 4)
+
+    def test_window_and_load_more(self):
+        root = self.reply('Root')
+        children = [self.reply(f'Child {number}', root) for number in range(3)]
+        self.reply('Grandchild', children[0])
+        thread = self.comments('?depth=1&replies=2')['results'][0]
+        self.assertEqual(thread['replies_count'], 3)
+        self.assertEqual([reply['text'] for reply in thread['replies']], ['Child 0', 'Child 1'])
+        self.assertEqual(thread['replies'][0]['replies'], [])
+        self.assertEqual(thread['replies'][0]['replies_count'], 1)
+
+        page = self.comments(f'?parent={root["id"]}&limit=2')
+        self.assertEqual([reply['text'] for reply in page['results']], ['Child 0', 'Child 1'])
+        self.assertEqual(page['results'][0]['replies'][0]['text'], 'Grandchild')
+        page = self.client.get(page['next']).data
+        self.assertEqual([reply['text'] for reply in page['results']], ['Child 2'])
+
+    @override_settings(COMMENT_MAX_DEPTH=1)
+    def test_deep_replies_attach_to_last_level(self):
+        root = self.reply('Root')
+        child = self.reply('Child', root)
+        grandchild = self.reply('Grandchild', child)
+        self.assertEqual((grandchild['parent_id'], grandchild['depth']), (root['id'], 1))
+
+    def test_deepest_path_fits_column(self):
+        max_length = Comment._meta.get_field('path').max_length
+        self.assertLessEqual((settings.COMMENT_MAX_DEPTH + 1) * Comment.PATH_STEP, max_length)
+        parent = None
+        for level in range(settings.COMMENT_MAX_DEPTH + 2):
+            parent = self.reply(f'Level {level}', parent)
+        comment = Comment.objects.get(id=parent['id'])
+        self.assertEqual(comment.depth, settings.COMMENT_MAX_DEPTH)
+        self.assertLessEqual(len(comment.path), max_length)
+
+    def test_parent_must_belong_to_post(self):
+        other = Comment.objects.create(post=create_post(self.alice), author=self.alice, text='Elsewhere')
+        response = self.client.post(
+            f'/api/posts/{self.post.id}/comment/', {'text': 'Hi', 'parent_id': other.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RATE_LIMITS={})
+class PostCounterTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_member('alice')
+        self.bob = create_member('bob')
+        self.post = create_post(self.alice)
+        self.client.force_authenticate(self.bob)
+
+    def counts(self):
+        post = Post.objects.get(id=self.post.id)
+        return post.likes_count, post.comments_count
+
+    def comment(self, text, parent=None):
+        data = {'text': text, 'parent_id': parent.id if parent else None}
+        response = self.client.post(f'/api/posts/{self.post.id}/comment/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Comment.objects.get(id=response.data['id'])
+
+    def test_like_toggles(self):
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.counts(), (1, 0))
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.counts(), (2, 0))
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(list(Like.objects.values_list('member__username', flat=True)), ['bob'])
+
+    def test_comment_create_and_delete(self):
+        root = self.comment('Root')
+        reply = self.comment('Reply', root)
+        self.comment('Other')
+        self.assertEqual(self.counts(), (0, 3))
+        self.assertEqual(Comment.objects.get(id=root.id).replies_count, 1)
+        reply.delete()
+        self.assertEqual(self.counts(), (0, 2))
+        self.assertEqual(Comment.objects.get(id=root.id).replies_count, 0)
+        self.comment('Reply again', root)
+        Comment.objects.get(id=root.id).delete()  # takes its reply along
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_reconcile_fixes_drift_in_one_update(self):
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.comment('Hi')
+        in_step = create_post(self.bob)
+        Post.objects.filter(id=self.post.id).update(likes_count=7, comments_count=0)
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_post_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('Checked 2 posts, fixed 1', out.getvalue())
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(Post.objects.get(id=in_step.id).likes_count, 0)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(all('COUNT(' in sql for sql in updates))
+
+
+@override_settings(TIMELINE_FANOUT_LIMIT=2)
+class TimelineModeTests(APITestCase):
+    """
+    Authors with more friends than ``TIMELINE_FANOUT_LIMIT`` are pulled into
+    feeds at read time, and no post goes missing when they switch modes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_member('author')
+        self.readers = [create_member(f'reader{index}') for index in range(3)]
+        for reader in self.readers[:2]:
+            befriend(reader, self.author)
+
+    def feed(self, member):
+        return [post.content for post in timeline.feed_queryset(member)]
+
+    def entries(self, member):
+        return set(TimelineEntry.objects.filter(member=member).values_list('post__content', flat=True))
+
+    def test_push_under_the_limit(self):
+        create_post(self.author, 'Pushed')
+        self.assertFalse(Member.objects.get(id=self.author.id).fanout_on_read)
+        self.assertEqual(self.entries(self.readers[0]), {'Pushed'})
+        self.assertNotIn(self.author.id, timeline.pull_author_ids())
+
+    def test_pull_over_the_limit(self):
+        befriend(self.readers[2], self.author)
+        create_post(self.author, 'Pulled')
+        self.assertTrue(Member.objects.get(id=self.author.id).fanout_on_read)
+        self.assertIn(self.author.id, timeline.pull_author_ids())
+        self.assertEqual(self.entries(self.readers[0]), set())
+        self.assertEqual(self.entries(self.author), {'Pulled'})
+        create_post(self.readers[0], 'Own post')
+        for reader in self.readers:
+            with self.subTest(reader=reader.username):
+                self.assertEqual(self.feed(reader)[-1:], ['Pulled'])
+        self.assertEqual(self.feed(self.readers[0]), ['Own post', 'Pulled'])
+        self.assertEqual(self.feed(create_member('stranger')), [])
+
+    def test_push_to_pull_keeps_pushed_posts(self):
+        create_post(self.author, 'Pushed')
+        befriend(self.readers[2], self.author)
+        create_post(self.author, 'Pulled')
+        self.assertEqual(self.feed(self.readers[0]), ['Pulled', 'Pushed'])
+        self.assertEqual(self.feed(self.readers[2]), ['Pulled', 'Pushed'])
+
+    def test_pull_to_push_backfills_pulled_posts(self):
+        befriend(self.readers[2], self.author)
+        create_post(self.author, 'Pulled')
+        Friendship.objects.filter(from_member=self.readers[2]).delete()
+        friend_graph.invalidate(self.readers[2].id, self.author.id)
+        timeline.disconnect(self.readers[2], self.author)
+        create_post(self.author, 'Pushed')
+
+        self.assertFalse(Member.objects.get(id=self.author.id).fanout_on_read)
+        self.assertNotIn(self.author.id, timeline.pull_author_ids())
+        for reader in self.readers[:2]:
+            with self.subTest(reader=reader.username):
+                self.assertEqual(self.entries(reader), {'Pulled', 'Pushed'})
+                self.assertEqual(self.feed(reader), ['Pushed', 'Pulled'])
+        self.assertEqual(self.feed(self.readers[2]), [])
+
+
+class FileCacheTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def file_cache(self, **options):
+        return FileCache(self.dir, {'OPTIONS': options})
+
+    def test_directory_scanned_once_per_interval(self):
+        file_cache = self.file_cache(MAX_ENTRIES=1000)
+        with mock.patch.object(file_cache, '_list_cache_files', wraps=file_cache._list_cache_files) as scan:
+            for number in range(20):
+                file_cache.set(f'key{number}', number)
+        self.assertEqual(scan.call_count, 1)
+
+    def test_cull_drops_expired_entries_first(self):
+        file_cache = self.file_cache(MAX_ENTRIES=6, CULL_INTERVAL=0)
+        for number in range(4):
+            file_cache.set(f'old{number}', number, -1)
+        for number in range(4):
+            file_cache.set(f'live{number}', number)
+        self.assertEqual(file_cache.get_many([f'live{number}' for number in range(4)]),
+                         {f'live{number}': number for number in range(4)})
+        self.assertEqual(len(file_cache._list_cache_files()), 4)
+
+    def test_incr_is_atomic(self):
+        file_cache = self.file_cache()
+        file_cache.add('counter', 0)
+
+        def bump():
+            for _ in range(25):
+                file_cache.incr('counter')
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(file_cache.get('counter'), 100)
+        self.assertFalse(file_cache.add('counter', 0))
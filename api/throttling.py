@@ -0,0 +1,185 @@
+"""
+Per-route token-bucket rate limits.
+
+``RATE_LIMITS`` maps a URL name, or ``"<METHOD> <URL name>"`` to limit one
+method only, to a rate such as ``"60/min burst 20"``: the bucket holds up to
+20 tokens (the rate's count when no burst is given) and refills at 60 per
+minute. Each request takes a token; with none left it is answered with 429
+and a ``Retry-After`` of the time until the next one. Members draw from
+their own bucket per route, anonymous clients from their address's.
+
+Buckets are kept in a table of fixed-size slots in a memory-mapped file
+(``THROTTLE_STORE_PATH`` suffixed with the number of slots, under /dev/shm
+by default) shared by the workers of a host. A key hashes to a group of
+``WAYS`` slots, which is locked with ``fcntl`` while its bucket is updated,
+so a check costs microseconds and no round trip. A new key takes a slot
+whose bucket has refilled, or else the one closest to refilling, so a full
+table only ever forgets buckets and never refuses a request it should
+allow. With ``THROTTLE_STORE = "cache"`` the buckets live in the Django
+cache instead, for limits shared between hosts; updates are then not
+atomic, which is fine for a limit.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+CACHE_KEY = 'throttle:{}'
+RATE = re.compile(r'^(\d+)/(s|sec|m|min|h|hour|d|day)(?: burst (\d+))?$')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# Key hash, tokens, last update, time the bucket is full again.
+SLOT = struct.Struct('<Qddd')
+WAYS = 4
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """
+    Tokens per second and bucket size of a rate like ``"60/min burst 20"``.
+    """
+    match = RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}')
+    count, period, burst = match.groups()
+    return int(count) / PERIODS[period[0]], int(burst or count)
+
+
+def refill(tokens, updated, rate, burst, now):
+    """
+    Take a token from a bucket last left with ``tokens`` at ``updated``.
+    Returns whether one was available, the tokens left and the seconds until
+    the next token when there was none.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class SharedMemoryStore:
+    """
+    Buckets in a memory-mapped file, or in anonymous memory private to the
+    process when ``path`` is empty.
+    """
+
+    def __init__(self, path, slots):
+        self.groups = max(1, slots // WAYS)
+        size = self.groups * WAYS * SLOT.size
+        self._lock = threading.Lock()
+        self._fd = None
+        if path:
+            # The table size is part of the name: workers still running with
+            # another THROTTLE_SLOTS keep their own file, which is never
+            # shrunk under their mapping.
+            self._fd = os.open(f'{path}-{self.groups * WAYS}', os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map = mmap.mmap(-1, size)
+
+    @contextmanager
+    def _locked(self, offset):
+        # fcntl locks only exclude other processes; the thread lock covers
+        # threads of this one.
+        with self._lock:
+            if self._fd is None:
+                yield
+                return
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, WAYS * SLOT.size, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, WAYS * SLOT.size, offset)
+
+    def take(self, key, rate, burst):
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        offset = digest % self.groups * WAYS * SLOT.size
+        with self._locked(offset):
+            now = time.time()
+            slots = [SLOT.unpack_from(self._map, offset + way * SLOT.size) for way in range(WAYS)]
+            way = next((way for way, slot in enumerate(slots) if slot[0] == digest), None)
+            if way is None:
+                way = min(range(WAYS), key=lambda way: slots[way][3])
+                tokens, updated = burst, now
+            else:
+                tokens, updated = slots[way][1:3]
+            allowed, tokens, wait = refill(tokens, updated, rate, burst, now)
+            SLOT.pack_into(
+                self._map, offset + way * SLOT.size, digest, tokens, now, now + (burst - tokens) / rate
+            )
+        return allowed, wait
+
+
+class CacheStore:
+    """
+    Buckets in the Django cache, expiring once they have refilled.
+    """
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        cache_key = CACHE_KEY.format(key)
+        tokens, updated = cache.get(cache_key, (burst, now))
+        allowed, tokens, wait = refill(tokens, updated, rate, burst, now)
+        cache.set(cache_key, (tokens, now), int((burst - tokens) / rate) + 1)
+        return allowed, wait
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.THROTTLE_STORE == 'cache':
+                _store = CacheStore()
+            else:
+                _store = SharedMemoryStore(settings.THROTTLE_STORE_PATH, settings.THROTTLE_SLOTS)
+        return _store
+
+
+def rate_for(request):
+    """
+    The configured rule name and rate of the route the request resolved to,
+    or ``(None, None)`` when it is not limited.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not settings.RATE_LIMITS:
+        return None, None
+    for name in (f'{request.method} {match.url_name}', match.url_name):
+        rate = settings.RATE_LIMITS.get(name)
+        if rate is not None:
+            return name, rate
+    return None, None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Applies ``RATE_LIMITS`` to the route of the request.
+    """
+
+    def allow_request(self, request, view):
+        name, rate = rate_for(request)
+        if rate is None:
+            return True
+        if request.user.is_authenticated:
+            ident = f'member:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        allowed, self.retry_after = get_store().take(f'{name}:{ident}', *parse_rate(rate))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
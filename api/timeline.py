@@ -0,0 +1,192 @@
+"""
+Materialized home timelines.
+
+Every member owns a list of ``TimelineEntry`` rows pointing at the posts that
+belong on their feed. Posts are pushed into the timelines of the author's
+accepted friends when they are created (fan-out on write), so reading the feed
+is a range scan over the ``(member, -created_at)`` index instead of a join over
+the whole friend graph.
+
+Authors with more friends than ``TIMELINE_FANOUT_LIMIT`` are switched to
+fan-out on read: their posts only land in their own timeline and readers pull
+them in at query time. An author who drops back under the limit has their
+recent posts backfilled into their friends' timelines on their next post.
+
+Views call ``publish_post`` and ``schedule_connect``, which update the
+member's own timeline inline and leave the fan-out to the ``fanout`` task
+queue.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import conditional, friend_graph, tasks
+from .models import Member, Post, TimelineEntry
+
+PULL_AUTHORS_KEY = 'timeline:pull_authors'
+
+
+def _entries_for(post, member_ids):
+    return [
+        TimelineEntry(
+            member_id=member_id,
+            post_id=post.id,
+            author_id=post.author_id,
+            created_at=post.created_at,
+        )
+        for member_id in member_ids
+    ]
+
+
+@transaction.atomic
+def fan_out_posts(posts):
+    """
+    Push freshly created posts into the timelines of their audience.
+    """
+    friends = friend_graph.friend_ids_many({post.author_id for post in posts})
+    entries = []
+    audience = set()
+    for post in posts:
+        recipients = set(friends[post.author_id])
+        pull = len(recipients) > settings.TIMELINE_FANOUT_LIMIT
+        if pull != post.author.fanout_on_read:
+            Member.objects.filter(id=post.author_id).update(fanout_on_read=pull)
+            if not pull:
+                # Friends pulled the author's posts until now; give them the
+                # recent ones before the author leaves the pull list.
+                _backfill(recipients, post.author_id)
+            post.author.fanout_on_read = pull
+            cache.delete(PULL_AUTHORS_KEY)
+            transaction.on_commit(lambda: cache.delete(PULL_AUTHORS_KEY))
+        if pull:
+            recipients = set()
+            conditional.bump_pulled_feeds()
+        recipients.add(post.author_id)
+        entries.extend(_entries_for(post, recipients))
+        audience |= recipients
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True, batch_size=500)
+    conditional.bump_feeds(audience)
+
+
+def fan_out_post(post):
+    fan_out_posts([post])
+
+
+@tasks.task(queue='fanout', batch=True)
+def fan_out_posts_task(payloads):
+    posts = Post.objects.select_related('author').filter(id__in=[payload['post_id'] for payload in payloads])
+    fan_out_posts(list(posts))
+
+
+def publish_post(post):
+    """
+    Show a new post on its author's feed now and queue the fan-out to
+    friends. Must run in the transaction that created the post.
+    """
+    TimelineEntry.objects.bulk_create(_entries_for(post, [post.author_id]), ignore_conflicts=True)
+    conditional.bump_feeds([post.author_id])
+    tasks.enqueue(fan_out_posts_task, {'post_id': post.id}, key=f'fan_out_post:{post.id}')
+
+
+def _backfill(member_ids, author_id):
+    posts = Post.objects.filter(author_id=author_id).order_by('-created_at')[
+        : settings.TIMELINE_BACKFILL_SIZE
+    ]
+    TimelineEntry.objects.bulk_create(
+        [entry for post in posts for entry in _entries_for(post, member_ids)],
+        ignore_conflicts=True,
+        batch_size=500,
+    )
+
+
+@transaction.atomic
+def connect(member_a, member_b):
+    """
+    Backfill the recent posts of two members who just became friends.
+    """
+    if not member_b.fanout_on_read:
+        _backfill([member_a.id], member_b.id)
+    if not member_a.fanout_on_read:
+        _backfill([member_b.id], member_a.id)
+    conditional.bump_feeds([member_a.id, member_b.id])
+
+
+@tasks.task(queue='fanout')
+def connect_task(payload):
+    members = Member.objects.in_bulk([payload['member_id'], payload['friend_id']])
+    if len(members) == 2 and friend_graph.are_friends(payload['member_id'], payload['friend_id']):
+        connect(members[payload['member_id']], members[payload['friend_id']])
+
+
+def schedule_connect(friendship):
+    """
+    Queue the timeline backfill for an accepted friendship. Skipped by the
+    worker if the members are no longer friends by then.
+    """
+    tasks.enqueue(
+        connect_task,
+        {'member_id': friendship.from_member_id, 'friend_id': friendship.to_member_id},
+        key=f'connect:{friendship.id}',
+    )
+
+
+def disconnect(member_a, member_b):
+    """
+    Prune each member's posts from the other's timeline.
+    """
+    TimelineEntry.objects.filter(
+        Q(member=member_a, author=member_b) | Q(member=member_b, author=member_a)
+    ).delete()
+    conditional.bump_feeds([member_a.id, member_b.id])
+
+
+def pull_author_ids():
+    """
+    Ids of every author whose posts are read at query time, cached globally.
+    """
+    ids = cache.get(PULL_AUTHORS_KEY)
+    if ids is None:
+        ids = frozenset(
+            Member.objects.filter(fanout_on_read=True).values_list('id', flat=True)
+        )
+        cache.set(PULL_AUTHORS_KEY, ids, None)
+    return ids
+
+
+def feed_queryset(member):
+    """
+    Posts on the member's home feed, newest first.
+
+    Rows are annotated with ``feed_created_at`` and ``feed_post_id``, the feed
+    ordering key. Without pulled authors these resolve to the timeline columns
+    so the page is read straight off the ``(member, -created_at, -post)`` index.
+    """
+    pull_ids = list(friend_graph.friend_ids(member.id) & pull_author_ids())
+    if pull_ids:
+        entries = TimelineEntry.objects.filter(member=member).values('post_id')
+        posts = Post.objects.filter(Q(id__in=entries) | Q(author_id__in=pull_ids)).annotate(
+            feed_created_at=F('created_at'),
+            feed_post_id=F('id'),
+        )
+    else:
+        posts = Post.objects.filter(timeline_entries__member=member).annotate(
+            feed_created_at=F('timeline_entries__created_at'),
+            feed_post_id=F('timeline_entries__post_id'),
+        )
+    return posts.select_related('author').order_by('-feed_created_at', '-feed_post_id')
+
+
+def rebuild(member):
+    """
+    Recreate a member's timeline from scratch.
+    """
+    with transaction.atomic():
+        TimelineEntry.objects.filter(member=member).delete()
+        _backfill([member.id], member.id)
+        authors = Member.objects.filter(
+            id__in=friend_graph.friend_ids(member.id), fanout_on_read=False
+        ).values_list('id', flat=True)
+        for author_id in authors:
+            _backfill([member.id], author_id)
+        conditional.bump_feeds([member.id])
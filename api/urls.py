@@ -2,37 +2,67 @@ from django.urls import path
 from .views import (
     RegisterView,
     LoginView,
+    RefreshTokenView,
     LogoutView,
     MeView,
     PostsListCreateView,
     PostDetailView,
     PostLikeView,
     PostCommentView,
+    PostCommentsView,
     ProfileView,
     FriendsView,
     AcceptFriendView,
     RemoveFriendView,
     MessagesChatsView,
+    UnreadSummaryView,
     ChatMessagesView,
     SendMessageView,
-    UpdateLastSeenView
+    MarkChatReadView,
+    MemberSearchView,
+    PostSearchView,
+    ChatMessageSearchView,
+    EventStreamView,
+    BatchMessagesView,
+    BatchLikesView,
+    BatchFriendRequestsView,
+    UploadsView,
+    UploadDetailView,
+    MediaFileView,
+    UpdateLastSeenView,
+    MemberExportView,
 )
 
 urlpatterns = [
     path('auth/register/', RegisterView.as_view(), name='auth_register'),
     path('auth/login/', LoginView.as_view(), name='auth_login'),
+    path('auth/refresh/', RefreshTokenView.as_view(), name='auth_refresh'),
     path('auth/logout/', LogoutView.as_view(), name='auth_logout'),
     path('auth/me/', MeView.as_view(), name='auth_me'),
     path('posts/', PostsListCreateView.as_view(), name='posts_list_create'),
     path('posts/<int:id>/', PostDetailView.as_view(), name='post_detail'),
     path('posts/<int:id>/like/', PostLikeView.as_view(), name='post_like'),
     path('posts/<int:id>/comment/', PostCommentView.as_view(), name='post_comment'),
+    path('posts/<int:id>/comments/', PostCommentsView.as_view(), name='post_comments'),
     path('profile/<str:username>/', ProfileView.as_view(), name='profile'),
     path('friends/<str:username>/', FriendsView.as_view(), name='friends'),
     path('friends/<str:username>/accept/<int:request_id>/', AcceptFriendView.as_view(), name='accept_friend'),
     path('friends/<str:username>/<str:friend_username>/', RemoveFriendView.as_view(), name='remove_friend'),
     path('messages/chats/', MessagesChatsView.as_view(), name='messages_chats'),
+    path('messages/unread/', UnreadSummaryView.as_view(), name='messages_unread'),
     path('messages/chat/<int:chat_id>/', ChatMessagesView.as_view(), name='chat_messages'),
     path('messages/chat/<int:chat_id>/send/', SendMessageView.as_view(), name='send_message'),
+    path('messages/chat/<int:chat_id>/read/', MarkChatReadView.as_view(), name='mark_chat_read'),
+    path('messages/chat/<int:chat_id>/search/', ChatMessageSearchView.as_view(), name='search_messages'),
+    path('search/members/', MemberSearchView.as_view(), name='search_members'),
+    path('search/posts/', PostSearchView.as_view(), name='search_posts'),
+    path('batch/messages/', BatchMessagesView.as_view(), name='batch_messages'),
+    path('batch/likes/', BatchLikesView.as_view(), name='batch_likes'),
+    path('batch/friend_requests/', BatchFriendRequestsView.as_view(), name='batch_friend_requests'),
+    path('uploads/', UploadsView.as_view(), name='uploads'),
+    path('uploads/<uuid:id>/', UploadDetailView.as_view(), name='upload_detail'),
+    path('media/<str:sha256>/<str:variant>/', MediaFileView.as_view(), name='media_file'),
+    path('events/', EventStreamView.as_view(), name='events'),
     path('member/<int:id>/last_seen/', UpdateLastSeenView.as_view(), name='update_last_seen'),
+    path('member/<int:id>/export/', MemberExportView.as_view(), name='member_export'),
 ]
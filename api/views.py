@@ -1,19 +1,51 @@
+import mimetypes
+
 from rest_framework.views import APIView
-from rest_framework.generics import CreateAPIView, RetrieveAPIView, ListCreateAPIView, ListAPIView, RetrieveUpdateAPIView, UpdateAPIView
+from rest_framework.generics import CreateAPIView, RetrieveAPIView, ListCreateAPIView, ListAPIView, RetrieveUpdateAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.pagination import PageNumberPagination
-from django.contrib.auth import login, logout
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import logout
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Max, Prefetch
+from django.db import transaction
+from django.db.models import F, Q, Max, Prefetch
 from django.utils import timezone
-from django.db.models import Subquery
+from django.utils.cache import patch_cache_control
 
 from .models import *
 from .serializers import *
-from .pagination import CustomPagination
+from .async_views import AsyncAPIViewMixin
+from .renderers import EventStreamRenderer, JSONRenderer, NDJSONRenderer
+from .pagination import (
+    FeedPagination,
+    CommentsPagination,
+    FriendsPagination,
+    ChatsPagination,
+    ChatMessagesPagination,
+    SearchPagination,
+)
+from . import (
+    authentication,
+    batch,
+    comment_tree,
+    conditional,
+    export,
+    friend_graph,
+    media,
+    passwords,
+    presence,
+    read_state,
+    realtime,
+    search,
+    timeline,
+)
 
 
 class RegisterView(CreateAPIView):
@@ -36,32 +68,48 @@ class LoginView(APIView):
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         if serializer.is_valid():
-            username = serializer.validated_data['username']
-            password = serializer.validated_data['password']
-            try:
-                member = Member.objects.get(username=username, is_active=True)
-                if member.check_password(password):
-                    login(request, member)
-                    return Response({"message": "Logged in successfully"})
-                else:
-                    return Response(
-                        {"detail": "Invalid credentials"},
-                        status=status.HTTP_401_UNAUTHORIZED,
-                    )
-            except Member.DoesNotExist:
+            member = passwords.authenticate(
+                request, serializer.validated_data['username'], serializer.validated_data['password']
+            )
+            if member is None:
                 return Response(
                     {"detail": "Invalid credentials"},
                     status=status.HTTP_401_UNAUTHORIZED,
                 )
+            tokens = authentication.issue_tokens(member)
+            response = Response({"message": "Logged in successfully", **tokens})
+            authentication.set_token_cookies(response, tokens)
+            get_token(request)
+            return response
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class RefreshTokenView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get_authenticate_header(self, request):
+        return authentication.TokenAuthentication().authenticate_header(request)
+
+    def post(self, request):
+        token = request.data.get('refresh') or request.COOKIES.get(settings.REFRESH_TOKEN_COOKIE)
+        if not token:
+            return Response({'detail': 'Refresh token required'}, status=status.HTTP_400_BAD_REQUEST)
+        member = authentication.verify_token(token, authentication.REFRESH)
+        tokens = authentication.issue_tokens(member)
+        response = Response(tokens)
+        authentication.set_token_cookies(response, tokens)
+        return response
+
+
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         logout(request)
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        authentication.delete_token_cookies(response)
+        return response
 
 
 class MeView(RetrieveAPIView):
@@ -72,32 +120,62 @@ class MeView(RetrieveAPIView):
         return self.request.user
 
 
-class PostsListCreateView(ListCreateAPIView):
+class PostsListCreateView(AsyncAPIViewMixin, ListCreateAPIView):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = FeedPagination
 
     def get_queryset(self):
-        user = self.request.user
-        qs_sent = Member.objects.filter(
-            id__in=user.sent_requests.filter(status=Friendship.STATUS_ACCEPTED).values_list('to_member_id', flat=True)
-        )
-        qs_received = Member.objects.filter(
-            id__in=user.received_requests.filter(status=Friendship.STATUS_ACCEPTED).values_list('from_member_id', flat=True)
-        )
-        friends = (qs_sent | qs_received).distinct()
-        return Post.objects.filter(Q(author__in=friends) | Q(author=user)).prefetch_related('author').order_by('-created_at')
+        return timeline.feed_queryset(self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        validators = conditional.feed_validators(request.user, page)
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+            conditional.set_validators(request, response, validators)
+        return response
+
+    async def aget(self, request, *args, **kwargs):
+        page = await self.apage(request)
+        validators = await sync_to_async(conditional.feed_validators)(request.user, page)
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            response = self.get_paginated_response(await self.aserialize(page, many=True))
+            conditional.set_validators(request, response, validators)
+        return response
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            post = serializer.save(author=self.request.user)
+            timeline.publish_post(post)
 
 
-class PostDetailView(RetrieveAPIView):
+class PostDetailView(AsyncAPIViewMixin, RetrieveAPIView):
     serializer_class = PostSerializer
     permission_classes = [AllowAny]
+    lookup_field = 'id'
 
     def get_queryset(self):
-        return Post.objects.prefetch_related('author')
+        return Post.objects.select_related('author')
+
+    def get(self, request, *args, **kwargs):
+        validators = conditional.post_validators(self.kwargs['id'])
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            response = Response(self.get_serializer(self.get_object()).data)
+            conditional.set_validators(request, response, validators)
+        return response
+
+    async def aget(self, request, *args, **kwargs):
+        validators = await sync_to_async(conditional.post_validators)(self.kwargs['id'])
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            instance = await self.aget_object()
+            response = Response(await self.aserialize(instance))
+            conditional.set_validators(request, response, validators)
+        return response
 
 
 class PostLikeView(APIView):
@@ -105,9 +183,18 @@ class PostLikeView(APIView):
 
     def post(self, request, id):
         post = get_object_or_404(Post, id=id)
-        like, created = Like.objects.get_or_create(member=request.user, post=post)
-        if not created:
-            like.delete()
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(member=request.user, post=post)
+            if created:
+                Post.objects.filter(id=post.id).update(
+                    likes_count=F('likes_count') + 1, updated_at=timezone.now()
+                )
+            else:
+                deleted, _ = Like.objects.filter(id=like.id).delete()
+                if deleted:
+                    Post.objects.filter(id=post.id, likes_count__gt=0).update(
+                        likes_count=F('likes_count') - 1, updated_at=timezone.now()
+                    )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -117,15 +204,75 @@ class PostCommentView(CreateAPIView):
 
     def perform_create(self, serializer):
         post = get_object_or_404(Post, id=self.kwargs['id'])
-        serializer.save(post=post, author=self.request.user)
+        parent_id = serializer.validated_data.pop('parent_id', None)
+        parent = None
+        if parent_id is not None:
+            parent = Comment.objects.filter(id=parent_id, post=post).first()
+            if parent is None:
+                raise ValidationError({'parent_id': 'Comment not found on this post.'})
+            if parent.depth >= settings.COMMENT_MAX_DEPTH:
+                parent = parent.parent
+        with transaction.atomic():
+            serializer.save(post=post, author=self.request.user, parent=parent)
+            if parent is not None:
+                Comment.objects.filter(id=parent.id).update(replies_count=F('replies_count') + 1)
+            Post.objects.filter(id=post.id).update(
+                comments_count=F('comments_count') + 1, updated_at=timezone.now()
+            )
+
+
+class PostCommentsView(APIView):
+    """
+    A page of comments with a window of their replies: top-level comments by
+    default, or the replies of ``?parent=<comment id>``. ``depth`` and
+    ``replies`` bound how many levels and replies per thread are included.
+    """
+    permission_classes = [AllowAny]
 
+    def get_int(self, request, name, default, maximum=None):
+        try:
+            value = max(int(request.query_params.get(name, default)), 0)
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer.'})
+        return value if maximum is None else min(value, maximum)
+
+    def get(self, request, id):
+        post = get_object_or_404(Post.objects.only('id'), id=id)
+        parent = None
+        if 'parent' in request.query_params:
+            parent = get_object_or_404(Comment, id=self.get_int(request, 'parent', 0), post=post)
+        depth = self.get_int(request, 'depth', 2, settings.COMMENT_MAX_DEPTH)
+        replies = self.get_int(request, 'replies', 10, 100)
+        paginator = CommentsPagination()
+        page = paginator.paginate_queryset(comment_tree.siblings_queryset(post, parent), request, view=self)
+        comment_tree.attach_replies(page, depth, replies)
+        serializer = CommentThreadSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
-class ProfileView(RetrieveUpdateAPIView):
+
+class ProfileView(AsyncAPIViewMixin, RetrieveUpdateAPIView):
     serializer_class = MemberSerializer
     permission_classes = [AllowAny]
     queryset = Member.objects.all()
     lookup_field = 'username'
 
+    def get(self, request, *args, **kwargs):
+        validators = conditional.profile_validators(self.kwargs['username'])
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            response = Response(self.get_serializer(self.get_object()).data)
+            conditional.set_validators(request, response, validators)
+        return response
+
+    async def aget(self, request, *args, **kwargs):
+        validators = await sync_to_async(conditional.profile_validators)(self.kwargs['username'])
+        response = conditional.not_modified(request, validators)
+        if response is None:
+            instance = await self.aget_object()
+            response = Response(await self.aserialize(instance))
+            conditional.set_validators(request, response, validators)
+        return response
+
     def get_object(self):
         obj = get_object_or_404(self.queryset, username=self.kwargs[self.lookup_field])
         if self.request.method in ['PATCH', 'PUT']:
@@ -141,19 +288,14 @@ class FriendsView(APIView):
             return [IsAuthenticated()]
         return [AllowAny()]
 
+    def get_friends_queryset(self, member):
+        return Member.objects.filter(id__in=friend_graph.friend_ids(member.id))
+
     def get(self, request, username):
         member = get_object_or_404(Member, username=username)
-        qs_sent = Member.objects.filter(
-            id__in=member.sent_requests.filter(status=Friendship.STATUS_ACCEPTED).values_list('to_member_id', flat=True)
-        )
-        qs_received = Member.objects.filter(
-            id__in=member.received_requests.filter(status=Friendship.STATUS_ACCEPTED).values_list('from_member_id', flat=True)
-        )
-        friends_qs = (qs_sent | qs_received).distinct().exclude(id=member.id).order_by('username')
-        paginator = CustomPagination()
-        page = paginator.paginate_queryset(friends_qs, request)
-        if page is None:
-            return paginator.get_paginated_response([])
+        friends_qs = self.get_friends_queryset(member)
+        paginator = FriendsPagination()
+        page = paginator.paginate_queryset(friends_qs, request, view=self)
         serializer = MemberSerializer(page, many=True)
         return paginator.get_paginated_response(serializer.data)
 
@@ -167,12 +309,12 @@ class FriendsView(APIView):
             return Response({'error': 'Target user not found'}, status=status.HTTP_404_NOT_FOUND)
         if target == request.user:
             return Response({'error': 'Cannot send friend request to yourself'}, status=status.HTTP_400_BAD_REQUEST)
-        friendship_filter = Friendship.objects.filter(from_member=request.user, to_member=target)
-        if friendship_filter.filter(status=Friendship.STATUS_ACCEPTED).exists():
+        if friend_graph.are_friends(request.user.id, target.id):
             return Response({'error': 'Already friends'}, status=status.HTTP_409_CONFLICT)
-        if friendship_filter.exists():
+        if Friendship.objects.filter(from_member=request.user, to_member=target).exists():
             return Response({'error': 'Friend request already sent'}, status=status.HTTP_409_CONFLICT)
         Friendship.objects.create(from_member=request.user, to_member=target)
+        friend_graph.invalidate(request.user.id, target.id)
         return Response({'message': 'Friend request sent'}, status=status.HTTP_201_CREATED)
 
 
@@ -181,7 +323,7 @@ class AcceptFriendView(APIView):
 
     def post(self, request, username, request_id):
         friendship = get_object_or_404(
-            Friendship,
+            Friendship.objects.select_related('from_member', 'to_member'),
             id=request_id,
             to_member__username=username,
             status=Friendship.STATUS_PENDING
@@ -189,7 +331,10 @@ class AcceptFriendView(APIView):
         if friendship.to_member != request.user:
             raise PermissionDenied('Can only accept your own requests.')
         friendship.status = Friendship.STATUS_ACCEPTED
-        friendship.save()
+        with transaction.atomic():
+            friendship.save()
+            friend_graph.invalidate(friendship.from_member_id, friendship.to_member_id)
+            timeline.schedule_connect(friendship)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -201,35 +346,72 @@ class RemoveFriendView(APIView):
         if member != request.user:
             raise PermissionDenied('Can only remove your own friends.')
         friend = get_object_or_404(Member, username=friend_username)
-        Friendship.objects.filter(
-            Q(from_member=member, to_member=friend) |
-            Q(from_member=friend, to_member=member)
-        ).delete()
+        with transaction.atomic():
+            Friendship.objects.filter(
+                Q(from_member=member, to_member=friend) |
+                Q(from_member=friend, to_member=member)
+            ).delete()
+            friend_graph.invalidate(member.id, friend.id)
+            timeline.disconnect(member, friend)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class MessagesChatsView(ListAPIView):
     serializer_class = ChatSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = ChatsPagination
 
     def get_queryset(self):
-        return self.request.user.chats.annotate(
-            last_message_time=Max('messages__created_at')
-        ).order_by('-last_message_time')
+        user = self.request.user
+        return (
+            user.chats.select_related('last_message__author')
+            .prefetch_related('members')
+            .annotate(unread_count=read_state.unread_count(user))
+            .order_by('-last_activity', '-id')
+        )
 
 
-class ChatMessagesView(ListAPIView):
+class UnreadSummaryView(APIView):
+    """
+    Unread counts of every chat with unread messages, or of ``?chat_ids=1,2``.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        chat_ids = None
+        if 'chat_ids' in request.query_params:
+            try:
+                chat_ids = [int(value) for value in request.query_params['chat_ids'].split(',') if value]
+            except ValueError:
+                raise ValidationError({'chat_ids': 'Must be a comma-separated list of ids.'})
+        chats = read_state.unread_summary(request.user, chat_ids)
+        return Response({
+            'total': sum(chat['unread_count'] for chat in chats),
+            'chats': [
+                {
+                    'chat_id': chat['id'],
+                    'unread_count': chat['unread_count'],
+                    'last_read_message_id': chat['last_read_message_id'],
+                }
+                for chat in chats
+            ],
+        })
+
+
+class ChatMessagesView(AsyncAPIViewMixin, ListAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = ChatMessagesPagination
+
+    async def aget(self, request, *args, **kwargs):
+        return await self.alist(request, *args, **kwargs)
 
     def get_queryset(self):
         chat_id = self.kwargs['chat_id']
         return Message.objects.filter(
             chat_id=chat_id,
             chat__members=self.request.user
-        ).order_by('created_at')
+        ).select_related('author').order_by('created_at', 'id')
 
 
 class SendMessageView(CreateAPIView):
@@ -238,18 +420,282 @@ class SendMessageView(CreateAPIView):
 
     def perform_create(self, serializer):
         chat = get_object_or_404(Chat, id=self.kwargs['chat_id'], members=self.request.user)
-        serializer.save(chat=chat, author=self.request.user)
+        with transaction.atomic():
+            message = serializer.save(chat=chat, author=self.request.user)
+            Chat.objects.filter(id=chat.id).update(
+                last_message=message,
+                last_activity=message.created_at,
+            )
+            realtime.publish(
+                chat.members.values_list('id', flat=True),
+                'message',
+                serializer.data,
+            )
+
+
+class MarkChatReadView(APIView):
+    """
+    Marks the chat read up to ``message_id``, by default its latest message.
+    """
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request, chat_id):
+        chat = get_object_or_404(Chat, id=chat_id, members=request.user)
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message_id = serializer.validated_data.get('message_id')
+        if message_id is None:
+            message_id = read_state.latest_message_id(chat)
+        elif not chat.messages.filter(id=message_id).exists():
+            raise ValidationError({'message_id': 'Message not found in this chat.'})
+        if message_id is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            if read_state.mark_read(chat, request.user, message_id):
+                realtime.publish(
+                    chat.members.exclude(id=request.user.id).values_list('id', flat=True),
+                    'read',
+                    {
+                        'chat_id': chat.id,
+                        'member_id': request.user.id,
+                        'last_message_id': message_id,
+                    },
+                )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class UpdateLastSeenView(UpdateAPIView):
+
+class SearchView(APIView):
+    """
+    Ranked full-text search; ``q`` is matched word by word, the last word as
+    a prefix. Subclasses implement ``search(terms, position, limit)``.
+    """
     permission_classes = [IsAuthenticated]
-    queryset = Member.objects.all()
-    lookup_field = 'id'
+    serializer_class = None
+
+    def get(self, request, **kwargs):
+        terms = search.parse_query(request.query_params.get('q', ''))
+        if not terms:
+            return Response({'error': 'q required'}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = SearchPagination()
+        page = paginator.paginate_search(
+            lambda position, limit: self.search(terms, position, limit), request
+        )
+        serializer = self.serializer_class(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
-    def update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        if instance != request.user:
+
+class MemberSearchView(SearchView):
+    serializer_class = MemberSerializer
+
+    def search(self, terms, position, limit):
+        return search.members(terms, position, limit)
+
+
+class PostSearchView(SearchView):
+    """
+    Searches the posts of the member and their friends.
+    """
+    serializer_class = PostSerializer
+
+    def search(self, terms, position, limit):
+        author_ids = friend_graph.friend_ids(self.request.user.id) | {self.request.user.id}
+        return search.posts(author_ids, terms, position, limit)
+
+
+class ChatMessageSearchView(SearchView):
+    serializer_class = MessageSerializer
+
+    def get(self, request, chat_id):
+        get_object_or_404(Chat, id=chat_id, members=request.user)
+        return super().get(request, chat_id=chat_id)
+
+    def search(self, terms, position, limit):
+        return search.messages(self.kwargs['chat_id'], terms, position, limit)
+
+
+class BatchView(APIView):
+    """
+    Applies ``{"items": [...]}`` in one transaction and answers with one
+    result per item. Items that fail validation are reported and skipped.
+    """
+    permission_classes = [IsAuthenticated]
+    item_serializer_class = None
+    apply = None
+
+    def post(self, request):
+        items = request.data.get('items') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'items required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BATCH_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.BATCH_MAX_ITEMS} items per batch'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        results, valid = [], []
+        for item in items:
+            serializer = self.item_serializer_class(data=item)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+                results.append(None)
+            else:
+                results.append({'status': 400, 'error': serializer.errors})
+        applied = iter(self.apply(request.user, valid) if valid else ())
+        results = [result or next(applied) for result in results]
+        return Response({'results': results})
+
+
+class BatchMessagesView(BatchView):
+    item_serializer_class = BatchMessageSerializer
+    apply = staticmethod(batch.send_messages)
+
+
+class BatchLikesView(BatchView):
+    item_serializer_class = BatchLikeSerializer
+    apply = staticmethod(batch.set_likes)
+
+
+class BatchFriendRequestsView(BatchView):
+    item_serializer_class = BatchFriendRequestSerializer
+    apply = staticmethod(batch.send_friend_requests)
+
+
+class UploadsView(APIView):
+    """
+    Starts a resumable upload of ``size`` bytes; the bytes follow in PATCH
+    requests to the upload.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(member=request.user)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class UploadDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, id):
+        return get_object_or_404(Upload.objects.select_related('media'), id=id, member=request.user)
+
+    def get(self, request, id):
+        return Response(UploadSerializer(self.get_upload(request, id)).data)
+
+    def patch(self, request, id):
+        """
+        Appends the body at ``Upload-Offset``. The body is copied from the
+        socket to disk in chunks and never parsed; the last chunk stores the
+        file and answers with its media.
+        """
+        upload = self.get_upload(request, id)
+        if upload.media_id:
+            return Response(UploadSerializer(upload).data)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Upload-Offset and Content-Length headers required'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            media.append(upload, offset, request.stream, length)
+        except media.UploadError as error:
+            return Response({'error': str(error), 'offset': upload.offset}, status=error.status)
+        return Response(UploadSerializer(upload).data)
+
+
+class MediaFileView(APIView):
+    """
+    Sends a variant of an uploaded file, or the original until the variant
+    is rendered. With ``MEDIA_ACCEL_REDIRECT`` set nginx sends the file.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, sha256, variant):
+        if variant not in media.variant_names():
+            raise Http404
+        item = get_object_or_404(Media, sha256=sha256)
+        path, exact = media.locate(item, variant)
+        content_type = None if variant in item.variants else item.content_type
+        if settings.MEDIA_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type or mimetypes.guess_type(path)[0])
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + path
+        else:
+            try:
+                response = FileResponse(open(settings.MEDIA_ROOT / path, 'rb'), content_type=content_type)
+            except FileNotFoundError:
+                raise Http404
+        # Variants never change; a stand-in original is replaced once the
+        # variant is rendered.
+        if exact:
+            patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=60)
+        return response
+
+
+class EventStreamView(AsyncAPIViewMixin, APIView):
+    """
+    Server-sent events for the current member: new chat messages, read
+    receipts and friends' presence. Only served under ASGI, as a stream would
+    hold a sync worker for the lifetime of the connection.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [EventStreamRenderer]
+
+    def get(self, request):
+        raise realtime.StreamUnavailable()
+
+    async def aget(self, request):
+        subscription = await sync_to_async(realtime.subscribe)(request.user.id)
+        backlog = await sync_to_async(realtime.replay)(request.user.id, request.headers.get('Last-Event-ID'))
+        events = realtime.astream(subscription, backlog)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class UpdateLastSeenView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, id):
+        if id != request.user.id:
             raise PermissionDenied('Can only update own last seen.')
-        instance.last_seen = timezone.now()
-        instance.save(update_fields=['last_seen'])
+        last_seen, came_online = presence.heartbeat(request.user.id)
+        if came_online:
+            realtime.publish(
+                friend_graph.friend_ids(request.user.id),
+                'presence',
+                {'member_id': request.user.id, 'last_seen': last_seen, 'is_online': True},
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # Accepted by the former UpdateAPIView; clients still send it.
+    patch = put
+
+
+class MemberExportView(APIView):
+    """
+    The member's posts, comments, likes, friendships, chats and messages as
+    a streamed NDJSON download, resumable with ``?cursor=``.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, NDJSONRenderer]
+
+    def get(self, request, id):
+        if id != request.user.id:
+            raise PermissionDenied('Can only export own data.')
+        cursor = request.query_params.get('cursor')
+        export.parse_cursor(cursor)
+        if isinstance(request._request, ASGIRequest):
+            blocks = export.astream(request.user, cursor)
+        else:
+            blocks = export.stream(request.user, cursor)
+        response = StreamingHttpResponse(blocks, content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="member-{id}-export.ndjson"'
+        response['Cache-Control'] = 'private, no-store'
+        return response
@@ -0,0 +1,85 @@
+"""
+Compare throughput and tail latency of the sync (WSGI) and async (ASGI)
+gunicorn deployments on the read-heavy endpoints.
+
+For each mode the script seeds a throwaway SQLite database, starts gunicorn
+with GUNICORN_SERVER_MODE set, logs in as a seeded member and drives the
+feed, post detail, profile and chat history endpoints under concurrent load.
+
+The asgi mode needs uvicorn (``pip install -r requirements-asgi.txt``) and is
+skipped without it.
+
+    python benchmarks/asgi_vs_wsgi.py --concurrency 64 --duration 15
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import call, gunicorn, login, prepare_database, server_env  # noqa: E402
+from loadgen import Request, run_load  # noqa: E402
+
+
+def build_requests(port, headers):
+    _, feed = call(port, 'GET', '/api/posts/', headers=headers)
+    _, chats = call(port, 'GET', '/api/messages/chats/', headers=headers)
+    post = json.loads(feed)['results'][0]
+    chat = json.loads(chats)['results'][0]
+    return [
+        Request('GET', '/api/posts/', name='feed'),
+        Request('GET', f"/api/posts/{post['id']}/", name='post_detail'),
+        Request('GET', f"/api/profile/{post['author']['username']}/", name='profile'),
+        Request('GET', f"/api/messages/chat/{chat['id']}/", name='chat_messages'),
+    ]
+
+
+def bench_mode(mode, args, workdir):
+    env = server_env(workdir, mode, mode=mode, workers=args.workers)
+    prepare_database(env, args.members)
+    with gunicorn(env) as port:
+        headers = login(port, 'bench0')
+        requests = build_requests(port, headers)
+        summary, _ = run_load(
+            f'http://127.0.0.1:{port}', requests,
+            concurrency=args.concurrency, duration=args.duration, headers=headers,
+        )
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['wsgi', 'asgi'], choices=['wsgi', 'asgi'])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            if mode == 'asgi':
+                try:
+                    import uvicorn  # noqa: F401
+                except ImportError:
+                    print('Skipping asgi: uvicorn is not installed (pip install -r requirements-asgi.txt)', file=sys.stderr)
+                    continue
+            results[mode] = bench_mode(mode, args, Path(tmp))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<6} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for mode, summary in results.items():
+        print(
+            f"{mode:<6} {summary['requests']:>9} {summary['errors']:>7} {summary['rps']:>9.1f} "
+            f"{summary['p50_ms']:>8.1f} {summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
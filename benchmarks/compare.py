@@ -0,0 +1,90 @@
+"""
+Compare two result files written by ``replay.py`` and flag the endpoints
+that got slower or run more queries.
+
+    python benchmarks/compare.py baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 when an endpoint regressed, so it can gate CI. Query
+counts are deterministic and any increase counts; latency and throughput
+are noisy and only count past ``--threshold`` (a fraction of the baseline)
+and, for latency, past ``--min-ms``.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def regressions(before, after, threshold, min_ms):
+    found = []
+    if (after['queries_max'] or 0) > (before['queries_max'] or 0):
+        found.append(f"queries {before['queries_max']} -> {after['queries_max']}")
+    if after['p95_ms'] > before['p95_ms'] * (1 + threshold) and after['p95_ms'] - before['p95_ms'] > min_ms:
+        found.append(f"p95 {before['p95_ms']:.1f} -> {after['p95_ms']:.1f} ms")
+    if after['rps'] < before['rps'] * (1 - threshold):
+        found.append(f"req/s {before['rps']:.1f} -> {after['rps']:.1f}")
+    if after['errors'] and not before['errors']:
+        found.append(f"{after['errors']} errors")
+    return found
+
+
+def compare(baseline, candidate, threshold=0.1, min_ms=1.0):
+    """
+    Returns one row per endpoint of either run as ``(name, before, after,
+    regressions)``; ``before`` or ``after`` is None when only one run has it.
+    """
+    names = sorted(set(baseline['endpoints']) | set(candidate['endpoints']))
+    rows = []
+    for name in names:
+        before = baseline['endpoints'].get(name)
+        after = candidate['endpoints'].get(name)
+        found = regressions(before, after, threshold, min_ms) if before and after else []
+        rows.append((name, before, after, found))
+    return rows
+
+
+def delta(before, after, key):
+    if before is None or after is None or before.get(key) is None or after.get(key) is None:
+        return '-'
+    if not before[key]:
+        return f'{after[key]:.1f}'
+    return f'{(after[key] - before[key]) / before[key]:+.0%}'
+
+
+def report(baseline, candidate, rows, out=sys.stdout):
+    out.write(f"baseline  {baseline.get('commit') or '?'} {baseline.get('label') or ''}\n")
+    out.write(f"candidate {candidate.get('commit') or '?'} {candidate.get('label') or ''}\n\n")
+    out.write(f"{'endpoint':<24} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'queries':>9}  regressions\n")
+    for name, before, after, found in rows:
+        if before is None or after is None:
+            out.write(f"{name:<24} {'only in ' + ('candidate' if before is None else 'baseline'):>41}\n")
+            continue
+        queries = f"{before['queries_max'] if before['queries_max'] is not None else '-'}"
+        queries += f"->{after['queries_max'] if after['queries_max'] is not None else '-'}"
+        out.write(
+            f"{name:<24} {delta(before, after, 'rps'):>7} {delta(before, after, 'p50_ms'):>7} "
+            f"{delta(before, after, 'p95_ms'):>7} {delta(before, after, 'p99_ms'):>7} {queries:>9}  "
+            f"{'; '.join(found)}\n"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--min-ms', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    rows = compare(baseline, candidate, args.threshold, args.min_ms)
+    report(baseline, candidate, rows)
+    return 1 if any(found for *_, found in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Helpers shared by the benchmark scripts: seeding a throwaway database,
+running gunicorn on it and logging in as a seeded member.
+"""
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_env(workdir, name, mode='wsgi', workers=2):
+    return {
+        **os.environ,
+        'DJANGO_DB_ENGINE': 'sqlite',
+        'DJANGO_SQLITE_PATH': str(workdir / f'{name}.sqlite3'),
+        'DJANGO_CACHE_DIR': str(workdir / f'{name}-cache'),
+        'GUNICORN_SERVER_MODE': mode,
+        'GUNICORN_WORKERS': str(workers),
+        # Load comes from a handful of accounts; rate limits would cap it.
+        'RATE_LIMITS': 'off',
+    }
+
+
+def prepare_database(env, members, *seed_args):
+    """
+    Migrate the database of ``env`` and seed it with ``bench``-prefixed
+    members; extra ``seed_social_graph`` command line options pass through.
+    """
+    manage = [sys.executable, 'manage.py']
+    subprocess.run([*manage, 'migrate', '--noinput', '-v', '0'], cwd=ROOT, env=env, check=True)
+    subprocess.run(
+        [*manage, 'seed_social_graph', '--members', str(members), '--prefix', 'bench', *seed_args],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+@contextmanager
+def gunicorn(env):
+    """
+    Run gunicorn with the configuration of ``env`` and yield its port.
+    """
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+            '--bind', f'127.0.0.1:{port}', '--access-logfile', '/dev/null',
+        ],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        wait_for_port(port)
+        yield port
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def call(port, method, path, body=None, headers=None, host='127.0.0.1'):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    payload = response.read()
+    connection.close()
+    return response, payload
+
+
+def login(port, username, password='password', host='127.0.0.1'):
+    """
+    Log in and return the ``Authorization`` header of the member, which
+    unlike the token cookie needs no CSRF token on writes.
+    """
+    response, payload = call(
+        port, 'POST', '/api/auth/login/',
+        body=json.dumps({'username': username, 'password': password}),
+        headers={'Content-Type': 'application/json'},
+        host=host,
+    )
+    if response.status != 200:
+        raise RuntimeError(f'login as {username} failed with status {response.status}')
+    return {'Authorization': f"Bearer {json.loads(payload)['access']}"}
@@ -0,0 +1,114 @@
+"""
+Minimal closed-loop HTTP load generator built on the standard library.
+
+Each worker thread keeps one persistent connection and issues requests back to
+back for the given duration, cycling through the request list.
+"""
+import http.client
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+class Request:
+    def __init__(self, method, path, body=None, headers=None, name=None):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+        self.name = name or path
+
+
+def run_load(base_url, requests, concurrency=16, duration=10.0, headers=None, on_response=None):
+    """
+    Replay ``requests`` against ``base_url`` from ``concurrency`` threads for
+    ``duration`` seconds. Returns the summary and the raw per-request samples
+    as ``(request, status, latency, response_headers)`` tuples.
+    """
+    target = urlsplit(base_url)
+    deadline = time.perf_counter() + duration
+    samples = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        index = offset
+        local = []
+        while time.perf_counter() < deadline:
+            request = requests[index % len(requests)]
+            index += 1
+            request_headers = {**(headers or {}), **request.headers}
+            start = time.perf_counter()
+            try:
+                connection.request(request.method, request.path, body=request.body, headers=request_headers)
+                response = connection.getresponse()
+                response.read()
+                status, response_headers = response.status, dict(response.getheaders())
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+                status, response_headers = 0, {}
+            local.append((request, status, time.perf_counter() - start, response_headers))
+        connection.close()
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [latency for _, status, latency, _ in samples if 200 <= status < 400]
+    errors = len(samples) - len(ok)
+    return summarize(ok, errors, elapsed), samples
+
+
+def breakdown(samples, elapsed):
+    """
+    Summarize ``run_load`` samples per request name, with the SQL query count
+    and database time the server reported in its ``Server-Timing`` header.
+    """
+    groups = {}
+    for request, status, latency, response_headers in samples:
+        groups.setdefault(request.name, []).append((status, latency, response_headers))
+    results = {}
+    for name, group in sorted(groups.items()):
+        ok = [latency for status, latency, _ in group if 200 <= status < 400]
+        summary = summarize(ok, len(group) - len(ok), elapsed)
+        timings = [
+            SERVER_TIMING_DB.search(headers.get('Server-Timing', '')) for _, _, headers in group
+        ]
+        queries = [int(match.group(2)) for match in timings if match]
+        db_ms = sorted(float(match.group(1)) for match in timings if match)
+        summary['statuses'] = sorted({status for status, _, _ in group})
+        summary['queries_mean'] = sum(queries) / len(queries) if queries else None
+        summary['queries_max'] = max(queries) if queries else None
+        summary['db_p50_ms'] = percentile(db_ms, 0.50) if db_ms else None
+        results[name] = summary
+    return results
@@ -0,0 +1,216 @@
+"""
+Replay a scenario of API requests under concurrent load and report
+throughput, latency percentiles and SQL query counts per endpoint.
+
+A scenario is a JSON Lines file with one request per line::
+
+    {"name": "post_detail", "method": "GET", "path": "/api/posts/{post_id}/", "weight": 4}
+    {"name": "send_message", "method": "POST", "path": "/api/messages/chat/{chat_id}/send/",
+     "body": {"text": "hi"}}
+
+``weight`` sets how often the request appears in the mix. The placeholders
+``{member_id}``, ``{username}``, ``{friend}``, ``{post_id}`` and
+``{chat_id}`` are filled from the logged-in member's own data; a body value
+that is exactly one placeholder keeps the type of the value. Blank lines and
+lines starting with ``#`` are ignored.
+
+By default the script seeds a throwaway SQLite database with
+``seed_social_graph``, runs gunicorn on it and replays as ``bench0``; pass
+``--base-url`` to replay against a running deployment instead. The query
+counts come from the ``Server-Timing`` header of ``QueryBudgetMiddleware``.
+
+    python benchmarks/replay.py --members 2000 --degree-distribution powerlaw \\
+        --output results.json --compare baseline.json
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import compare  # noqa: E402
+from harness import ROOT, call, gunicorn, login, prepare_database, server_env  # noqa: E402
+from loadgen import Request, breakdown, run_load  # noqa: E402
+
+DEFAULT_SCENARIO = Path(__file__).resolve().parent / 'scenarios' / 'social.jsonl'
+PLACEHOLDER = re.compile(r'^\{(\w+)\}$')
+
+
+def load_scenario(path):
+    entries = []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line)
+            if 'path' not in entry:
+                raise ValueError(f'{path}:{number}: missing "path"')
+            entries.append(entry)
+    return entries
+
+
+def fill(value, context):
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, context) for item in value]
+    if isinstance(value, str):
+        match = PLACEHOLDER.match(value)
+        return context[match.group(1)] if match else value.format_map(context)
+    return value
+
+
+def scenario_context(host, port, headers):
+    """
+    Ids and usernames of the logged-in member's own data for the
+    placeholders of a scenario.
+    """
+    def get(path):
+        response, payload = call(port, 'GET', path, headers=headers, host=host)
+        if response.status != 200:
+            raise RuntimeError(f'GET {path} failed with status {response.status}')
+        return json.loads(payload)
+
+    me = get('/api/auth/me/')
+    posts = get('/api/posts/')['results']
+    chats = get('/api/messages/chats/')['results']
+    if not posts or not chats:
+        raise RuntimeError(f"{me['username']} needs posts in the feed and a chat to replay the scenario")
+    others = [post for post in posts if post['author']['id'] != me['id']]
+    return {
+        'member_id': me['id'],
+        'username': me['username'],
+        'friend': (others or posts)[0]['author']['username'],
+        'post_id': (others or posts)[0]['id'],
+        'chat_id': chats[0]['id'],
+    }
+
+
+def build_requests(entries, context, seed=0):
+    """
+    Expand the scenario by weight into a shuffled request mix.
+    """
+    requests = []
+    for entry in entries:
+        body = entry.get('body')
+        request = Request(
+            entry.get('method', 'GET'),
+            fill(entry['path'], context),
+            body=json.dumps(fill(body, context)) if body is not None else None,
+            headers={'Content-Type': 'application/json'} if body is not None else {},
+            name=entry.get('name') or entry['path'],
+        )
+        requests.extend([request] * int(entry.get('weight', 1)))
+    random.Random(seed).shuffle(requests)
+    return requests
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def replay(base_url, entries, args):
+    target = urlsplit(base_url)
+    headers = login(target.port, args.username, args.password, host=target.hostname)
+    requests = build_requests(entries, scenario_context(target.hostname, target.port, headers))
+    if args.warmup:
+        run_load(base_url, requests, concurrency=args.concurrency, duration=args.warmup, headers=headers)
+    summary, samples = run_load(
+        base_url, requests, concurrency=args.concurrency, duration=args.duration, headers=headers
+    )
+    return summary, breakdown(samples, summary['seconds'])
+
+
+def print_results(results):
+    print(
+        f"{'endpoint':<24} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+    )
+    for name, row in [*results['endpoints'].items(), ('total', results['total'])]:
+        queries = f"{row['queries_mean']:.1f}" if row.get('queries_mean') is not None else '-'
+        print(
+            f"{name:<24} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {queries:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', nargs='?', default=str(DEFAULT_SCENARIO))
+    parser.add_argument('--base-url', help='Replay against this running server instead of a seeded one.')
+    parser.add_argument('--username', default='bench0')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of load discarded before measuring.')
+    parser.add_argument('--mode', default='wsgi', choices=['wsgi', 'asgi'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--friends', type=int, default=10, help='Mean number of friends per member.')
+    parser.add_argument('--degree-distribution', default='fixed', choices=['fixed', 'uniform', 'powerlaw'])
+    parser.add_argument('--label', help='Free-form note stored with the results.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with an earlier results file.')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    entries = load_scenario(args.scenario)
+    options = {
+        key: getattr(args, key)
+        for key in ('concurrency', 'duration', 'warmup', 'mode', 'workers', 'members', 'friends',
+                    'degree_distribution')
+    }
+    if args.base_url:
+        options = {key: options[key] for key in ('concurrency', 'duration', 'warmup')}
+        summary, endpoints = replay(args.base_url, entries, args)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = server_env(Path(tmp), 'replay', mode=args.mode, workers=args.workers)
+            prepare_database(
+                env, args.members,
+                '--friends', str(args.friends), '--degree-distribution', args.degree_distribution,
+            )
+            with gunicorn(env) as port:
+                summary, endpoints = replay(f'http://127.0.0.1:{port}', entries, args)
+
+    results = {
+        'format': 1,
+        'label': args.label,
+        'commit': git_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'scenario': Path(args.scenario).name,
+        'base_url': args.base_url,
+        'options': options,
+        'total': summary,
+        'endpoints': endpoints,
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        baseline = compare.load(args.compare)
+        rows = compare.compare(baseline, results, args.threshold)
+        print()
+        compare.report(baseline, results, rows)
+        return 1 if any(found for *_, found in rows) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
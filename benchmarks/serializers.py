@@ -0,0 +1,117 @@
+"""
+Measure how many rows per second the list serializers and the JSON renderer
+get through, in process and without HTTP.
+
+Each serializer runs over the same rows loaded from a throwaway SQLite
+database seeded with ``seed_social_graph``, once through DRF's field by
+field path (``compile_fields = False`` and DRF's ``JSONRenderer``) and once
+through the compiled fields and ``api.renderers.JSONRenderer``. ``cold``
+passes start with an empty fragment cache, ``warm`` passes reuse it. The
+two paths must render the same bytes; the script stops if they do not.
+
+    python benchmarks/serializers.py --members 300 --rows 200 --duration 2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def setup(workdir, members):
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'config.settings',
+        'DJANGO_DB_ENGINE': 'sqlite',
+        'DJANGO_SQLITE_PATH': str(workdir / 'serializers.sqlite3'),
+        'DJANGO_CACHE_BACKEND': 'locmem',
+    })
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', '--noinput', verbosity=0)
+    call_command('seed_social_graph', '--members', str(members), '--prefix', 'bench', stdout=open(os.devnull, 'w'))
+
+
+def workloads(rows):
+    from django.db.models import IntegerField, Value
+
+    from api.models import Chat, Member, Message, Post
+    from api.serializers import ChatSerializer, MemberSerializer, MessageSerializer, PostSerializer
+
+    return [
+        ('posts', PostSerializer, list(Post.objects.select_related('author').order_by('-id')[:rows])),
+        ('messages', MessageSerializer, list(Message.objects.select_related('author').order_by('-id')[:rows])),
+        ('chats', ChatSerializer, list(
+            Chat.objects.select_related('last_message__author').prefetch_related('members')
+            .annotate(unread_count=Value(0, output_field=IntegerField())).order_by('-id')[:rows]
+        )),
+        ('members', MemberSerializer, list(Member.objects.order_by('-id')[:rows])),
+    ]
+
+
+def measure(serializer_class, items, renderer, warm, duration):
+    """
+    Serialize and render ``items`` for ``duration`` seconds and return the
+    rows per second of each step and the last rendered bytes.
+    """
+    from django.core.cache import cache
+
+    serialize_seconds = render_seconds = 0.0
+    passes = 0
+    content = serializer_class(items, many=True).data
+    while serialize_seconds + render_seconds < duration:
+        if not warm:
+            cache.clear()
+        started = time.perf_counter()
+        data = serializer_class(items, many=True).data
+        serialized = time.perf_counter()
+        content = renderer.render(data)
+        serialize_seconds += serialized - started
+        render_seconds += time.perf_counter() - serialized
+        passes += 1
+    rows = passes * len(items)
+    return rows / serialize_seconds, rows / render_seconds, content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=300)
+    parser.add_argument('--rows', type=int, default=200, help='Rows per list.')
+    parser.add_argument('--duration', type=float, default=2.0, help='Seconds per measurement.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(Path(tmp), args.members)
+        from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+
+        from api import renderers
+        from api.compiled import CompiledFieldsMixin
+
+        print(f'orjson: {"installed" if renderers.orjson else "not installed, rendering with json"}')
+        print(f"{'serializer':<10} {'cache':<6} {'path':<9} {'rows':>6} {'serialize rows/s':>17} "
+              f"{'render rows/s':>14} {'speedup':>8}")
+        failed = False
+        for name, serializer_class, items in workloads(args.rows):
+            for warm in (False, True):
+                with mock.patch.object(CompiledFieldsMixin, 'compile_fields', False):
+                    base = measure(serializer_class, items, DRFJSONRenderer(), warm, args.duration)
+                fast = measure(serializer_class, items, renderers.JSONRenderer(), warm, args.duration)
+                for path, (serialize, render, _) in (('drf', base), ('compiled', fast)):
+                    total = 1 / (1 / serialize + 1 / render)
+                    speedup = total * (1 / base[0] + 1 / base[1])
+                    print(f"{name:<10} {'warm' if warm else 'cold':<6} {path:<9} {len(items):>6} "
+                          f"{serialize:>17,.0f} {render:>14,.0f} {speedup:>7.2f}x")
+                if base[2] != fast[2]:
+                    print(f'{name}: the compiled path rendered different bytes', file=sys.stderr)
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
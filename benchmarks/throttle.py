@@ -0,0 +1,126 @@
+"""
+Measure the cost of the rate limit check per request.
+
+``TokenBucketThrottle.allow_request`` runs for a limited route with each
+store: the shared-memory table in a file (as under gunicorn), the
+per-process table, and the Django cache with the memory and file backends.
+An unlimited route shows the cost of the lookup alone. Then ``--processes``
+workers hammer the shared file at once, as gunicorn workers would, to show
+the cost under lock contention.
+
+    python benchmarks/throttle.py --requests 200000 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def setup(workdir):
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'config.settings',
+        'DJANGO_CACHE_BACKEND': 'locmem',
+        'THROTTLE_STORE_PATH': str(workdir / 'throttle'),
+    })
+    import django
+
+    django.setup()
+
+
+def make_request(path, method='POST', member_id=1):
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import RequestFactory
+    from django.urls import resolve
+    from rest_framework.request import Request
+
+    from api.models import Member
+
+    request = getattr(RequestFactory(), method.lower())(path)
+    request.resolver_match = resolve(path)
+    request = Request(request)
+    request.user = Member(pk=member_id) if member_id else AnonymousUser()
+    return request
+
+
+def measure(requests, count):
+    """
+    Microseconds per ``allow_request`` call, cycling through ``requests``.
+    """
+    from api.throttling import TokenBucketThrottle
+
+    throttle = TokenBucketThrottle()
+    started = time.perf_counter()
+    for index in range(count):
+        throttle.allow_request(requests[index % len(requests)], None)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def hammer(workdir, count, members, result):
+    setup(workdir)
+    requests = [make_request('/api/messages/chat/1/send/', member_id=member) for member in range(1, members + 1)]
+    result.put(measure(requests, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--members', type=int, default=1000, help='Distinct buckets the requests cycle through.')
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        setup(workdir)
+        from django.test import override_settings
+
+        from api import throttling
+
+        limited = [
+            make_request('/api/messages/chat/1/send/', member_id=member) for member in range(1, args.members + 1)
+        ]
+        unlimited = [make_request('/api/posts/1/', 'GET')]
+        file_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': str(workdir / 'cache'),
+        }}
+        cases = [
+            ('unlimited route', {}, unlimited),
+            ('shared memory file', {}, limited),
+            ('per-process memory', {'THROTTLE_STORE_PATH': ''}, limited),
+            ('locmem cache', {'THROTTLE_STORE': 'cache'}, limited),
+            ('file cache', {'THROTTLE_STORE': 'cache', 'CACHES': file_cache}, limited),
+        ]
+        print(f"{'store':<22} {'us/request':>11} {'requests/s':>12}")
+        for name, options, requests in cases:
+            # The file cache is slow enough that a fraction of the requests will do.
+            count = args.requests // 20 if 'CACHES' in options else args.requests
+            with override_settings(**options):
+                throttling._store = None
+                cost = measure(requests, count)
+            print(f'{name:<22} {cost:>11.2f} {1e6 / cost:>12,.0f}')
+
+        if args.processes > 1:
+            result = multiprocessing.get_context('spawn').Queue()
+            workers = [
+                multiprocessing.get_context('spawn').Process(
+                    target=hammer, args=(workdir, args.requests, args.members, result)
+                )
+                for _ in range(args.processes)
+            ]
+            for worker in workers:
+                worker.start()
+            costs = [result.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            print(f"{f'shared file x{args.processes}':<22} {max(costs):>11.2f} "
+                  f'{sum(1e6 / cost for cost in costs):>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
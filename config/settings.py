@@ -11,11 +11,17 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Running `manage.py test`.
+TESTING = sys.argv[1:2] == ["test"]
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -79,11 +85,171 @@ AUTHENTICATION_BACKENDS = [
 # REST Framework configuration
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "api.authentication.TokenAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # Same bytes as DRF's JSONRenderer, encoded with orjson when installed.
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_THROTTLE_CLASSES": ["api.throttling.TokenBucketThrottle"],
+    # nginx appends the client address to X-Forwarded-For.
+    "NUM_PROXIES": 1,
 }
 
+# Passwords (api.passwords) are hashed with scrypt; hashes made by the other
+# hashers are upgraded on the next login. Hashing runs on
+# PASSWORD_HASH_WORKERS threads per process; the workers of a host share
+# PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE slots for hashes running or
+# waiting through PASSWORD_HASH_SLOTS_PATH (per process when empty), and
+# logins past that get 429. After LOGIN_FAILURE_LIMIT bad passwords for a
+# username, or LOGIN_IP_FAILURE_LIMIT from one address, within
+# LOGIN_FAILURE_WINDOW seconds, logins are refused without hashing.
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "8"))
+PASSWORD_HASH_SLOTS_PATH = os.environ.get(
+    "PASSWORD_HASH_SLOTS_PATH",
+    "" if TESTING else "/dev/shm/django-api-password-hash" if os.path.isdir("/dev/shm")
+    else str(BASE_DIR / "persistent" / "password-hash"),
+)
+LOGIN_FAILURE_LIMIT = int(os.environ.get("LOGIN_FAILURE_LIMIT", "10"))
+LOGIN_IP_FAILURE_LIMIT = int(os.environ.get("LOGIN_IP_FAILURE_LIMIT", "50"))
+LOGIN_FAILURE_WINDOW = int(os.environ.get("LOGIN_FAILURE_WINDOW", "900"))
+
+# Signed API tokens (api.authentication). Lifetimes are in seconds; verified
+# members are cached per process for AUTH_PRINCIPAL_CACHE_TTL seconds.
+ACCESS_TOKEN_LIFETIME = int(os.environ.get("ACCESS_TOKEN_LIFETIME", "900"))
+REFRESH_TOKEN_LIFETIME = int(os.environ.get("REFRESH_TOKEN_LIFETIME", str(14 * 24 * 3600)))
+ACCESS_TOKEN_COOKIE = "access_token"
+REFRESH_TOKEN_COOKIE = "refresh_token"
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.environ.get("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_CACHE_TTL = int(os.environ.get("AUTH_PRINCIPAL_CACHE_TTL", "60"))
+
+# Caches are shared between gunicorn workers through the file system so that
+# invalidations made by one worker are seen by the others. Tests use a
+# per-process memory cache. The cache holds fragments, friend sets, presence,
+# feed versions and replay buffers, a few entries per member: MAX_ENTRIES
+# leaves room for them, and api.cache.FileCache only checks it every
+# CULL_INTERVAL seconds, dropping expired entries before live ones.
+CACHES = {
+    "default": {
+        "BACKEND": "api.cache.FileCache",
+        "LOCATION": os.environ.get("DJANGO_CACHE_DIR", BASE_DIR / "persistent" / "cache"),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("DJANGO_CACHE_MAX_ENTRIES", "1000000")),
+            "CULL_FREQUENCY": 10,
+            "CULL_INTERVAL": 60,
+        },
+    }
+    if os.environ.get("DJANGO_CACHE_BACKEND", "file") == "file" and not TESTING
+    else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get("FRAGMENT_CACHE_TIMEOUT", "600"))
+FRIEND_GRAPH_CACHE_TIMEOUT = int(os.environ.get("FRIEND_GRAPH_CACHE_TIMEOUT", "3600"))
+
+# Token-bucket rate limits (api.throttling) keyed by URL name, or by
+# "<METHOD> <URL name>" for one method: "<count>/<s|min|hour|day>", refilled
+# at that rate, with bursts of up to the count or "burst <n>". Buckets are
+# per member, or per address for anonymous clients, and are shared by the
+# workers of a host through THROTTLE_STORE_PATH (a per-process table when
+# empty). THROTTLE_STORE = "cache" keeps them in the cache instead.
+# RATE_LIMITS=off disables them, e.g. for load tests from one account.
+RATE_LIMITS = {
+    "auth_register": "10/hour burst 5",
+    "POST posts_list_create": "30/min burst 10",
+    "post_like": "60/min burst 20",
+    "post_comment": "30/min burst 10",
+    "POST friends": "20/min burst 10",
+    "send_message": "60/min burst 20",
+    "batch_messages": "10/min burst 5",
+    "batch_likes": "10/min burst 5",
+    "batch_friend_requests": "5/min burst 3",
+    "POST uploads": "30/min burst 10",
+} if os.environ.get("RATE_LIMITS", "on") != "off" else {}
+THROTTLE_STORE = os.environ.get("THROTTLE_STORE", "memory")
+THROTTLE_STORE_PATH = os.environ.get(
+    "THROTTLE_STORE_PATH",
+    "" if TESTING else "/dev/shm/django-api-throttle" if os.path.isdir("/dev/shm")
+    else str(BASE_DIR / "persistent" / "throttle"),
+)
+THROTTLE_SLOTS = int(os.environ.get("THROTTLE_SLOTS", "65536"))
+
+# Home timelines: authors with more friends than TIMELINE_FANOUT_LIMIT are
+# read at query time instead of being pushed into every friend's timeline.
+TIMELINE_FANOUT_LIMIT = int(os.environ.get("TIMELINE_FANOUT_LIMIT", "1000"))
+TIMELINE_BACKFILL_SIZE = int(os.environ.get("TIMELINE_BACKFILL_SIZE", "200"))
+
+# Largest number of operations accepted by one request to the batch/ routes.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+
+# Comment threads nest at most COMMENT_MAX_DEPTH levels below a top-level
+# comment; deeper replies attach to the parent of the comment replied to.
+# Comment.path holds 12 digits per level in 255 characters, so the limit is
+# capped at 20.
+COMMENT_MAX_DEPTH = min(int(os.environ.get("COMMENT_MAX_DEPTH", "20")), 255 // 12 - 1)
+
+# Presence (api.presence): heartbeats go to the cache and are flushed to
+# Member.last_seen in bulk at most every PRESENCE_FLUSH_INTERVAL seconds.
+# Members count as online for PRESENCE_ONLINE_WINDOW seconds after one; the
+# task worker tells friends of those who went offline at the same interval.
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get("PRESENCE_FLUSH_INTERVAL", "60"))
+PRESENCE_ONLINE_WINDOW = int(os.environ.get("PRESENCE_ONLINE_WINDOW", "300"))
+
+# Background tasks (api.tasks), run by `manage.py run_worker`. Each queue gets
+# `concurrency` threads claiming up to `batch_size` tasks at a time. Failed
+# tasks are retried after TASK_RETRY_DELAY * 2**(attempt - 1) seconds, and
+# finished ones are kept for TASK_RETENTION seconds to honour idempotency
+# keys. TASKS_EAGER=1 runs tasks in the web process right after commit.
+TASK_QUEUES = {
+    "default": {"concurrency": 1, "batch_size": 10},
+    "fanout": {"concurrency": 2, "batch_size": 50},
+    "media": {"concurrency": 1, "batch_size": 5},
+}
+TASKS_EAGER = os.environ.get("TASKS_EAGER", "0") == "1"
+TASK_POLL_INTERVAL = float(os.environ.get("TASK_POLL_INTERVAL", "0.5"))
+TASK_LEASE = int(os.environ.get("TASK_LEASE", "300"))
+TASK_RETRY_DELAY = int(os.environ.get("TASK_RETRY_DELAY", "5"))
+TASK_RETENTION = int(os.environ.get("TASK_RETENTION", str(7 * 24 * 3600)))
+
+# Media uploads (api.media). Uploads are appended chunk by chunk to a part
+# file in UPLOAD_TEMP_DIR, then stored under MEDIA_ROOT by content hash. The
+# worker renders MEDIA_VARIANTS (name: longest side in pixels) if Pillow is
+# installed. With MEDIA_ACCEL_REDIRECT set to nginx's internal media
+# location, files are sent by nginx instead of a gunicorn worker.
+UPLOAD_TEMP_DIR = BASE_DIR / "persistent" / "uploads"
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_EXPIRY = int(os.environ.get("UPLOAD_EXPIRY", str(24 * 3600)))
+MEDIA_VARIANTS = {"thumbnail": 160, "feed": 640, "full": 1600}
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT", "")
+
+# Data exports (api.export) read EXPORT_ITERATOR_CHUNK_SIZE rows per fetch and
+# send the NDJSON in blocks of about EXPORT_BUFFER_SIZE bytes.
+EXPORT_ITERATOR_CHUNK_SIZE = int(os.environ.get("EXPORT_ITERATOR_CHUNK_SIZE", "2000"))
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+# Real-time events (api.realtime). An empty REALTIME_BUS_URL uses an
+# in-process bus that only reaches streams held by the same worker; set
+# redis://host:port to fan out through Redis or `manage.py run_event_broker`.
+# The last REALTIME_REPLAY_SIZE events of each member are kept in the cache
+# for REALTIME_REPLAY_TTL seconds and replayed to streams resuming with
+# Last-Event-ID.
+REALTIME_BUS_URL = os.environ.get("REALTIME_BUS_URL", "")
+REALTIME_STREAM_TIMEOUT = int(os.environ.get("REALTIME_STREAM_TIMEOUT", "300"))
+REALTIME_HEARTBEAT = int(os.environ.get("REALTIME_HEARTBEAT", "15"))
+REALTIME_RETRY_MS = int(os.environ.get("REALTIME_RETRY_MS", "1000"))
+REALTIME_REPLAY_SIZE = int(os.environ.get("REALTIME_REPLAY_SIZE", "100"))
+REALTIME_REPLAY_TTL = int(os.environ.get("REALTIME_REPLAY_TTL", "300"))
+
 # drf-spectacular configuration
 SPECTACULAR_SETTINGS = {
     "TITLE": "Easyapp API",
@@ -93,6 +259,7 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    "api.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -100,8 +267,43 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Last, so the other view hooks run before it takes over the view.
+    "api.middleware.AsyncViewMiddleware",
 ]
 
+# Maximum number of SQL queries per request, keyed by URL name. Requests over
+# budget are logged by api.middleware.QueryBudgetMiddleware.
+QUERY_BUDGET_DEFAULT = int(os.environ.get("QUERY_BUDGET_DEFAULT", "10"))
+QUERY_BUDGETS = {
+    "posts_list_create": 8,
+    "post_detail": 4,
+    "post_comments": 4,
+    "profile": 4,
+    "friends": 6,
+    "accept_friend": 12,
+    "messages_chats": 6,
+    "chat_messages": 4,
+    "messages_unread": 2,
+    "update_last_seen": 5,
+    "batch_messages": 8,
+    "batch_likes": 8,
+    "batch_friend_requests": 8,
+    "search_members": 4,
+    "search_posts": 5,
+    "search_messages": 5,
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -120,17 +322,67 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "persistent" / "db" / "db.sqlite3",
+# DJANGO_DB_ENGINE selects "sqlite" (default) or "postgresql". PostgreSQL
+# needs the psycopg driver (psycopg[pool] for DJANGO_DB_POOL=1) installed.
+DB_ENGINE = os.environ.get("DJANGO_DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgresql":
+    DB_POOL = os.environ.get("DJANGO_DB_POOL", "1") == "1"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "app"),
+            "USER": os.environ.get("POSTGRES_USER", "app"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "127.0.0.1"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            # A pool keeps connections open itself; Django requires
+            # CONN_MAX_AGE = 0 alongside it.
+            "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": int(os.environ.get("DJANGO_DB_POOL_MIN", "2")),
+                    "max_size": int(os.environ.get("DJANGO_DB_POOL_MAX", "10")),
+                    "timeout": int(os.environ.get("DJANGO_DB_POOL_TIMEOUT", "10")),
+                },
+            } if DB_POOL else {},
+        }
     }
-}
+elif DB_ENGINE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get(
+                "DJANGO_SQLITE_PATH", BASE_DIR / "persistent" / "db" / "db.sqlite3"
+            ),
+            "CONN_MAX_AGE": int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # WAL lets readers proceed while a writer holds the lock;
+                # IMMEDIATE transactions take the write lock up front so
+                # concurrent writers wait on busy_timeout instead of failing
+                # with "database is locked" on lock upgrade.
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA busy_timeout=5000;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-20000;"
+                ),
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 5,
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported DJANGO_DB_ENGINE {DB_ENGINE!r}")
 
 
 # Password validation
@@ -6,7 +6,8 @@ echo "==> Django Pre-Start Script"
 # Remove existing database for fresh start on each deploy
 echo "==> Removing existing database..."
 if [ -f "/app/persistent/db/db.sqlite3" ]; then
-    rm -f /app/persistent/db/db.sqlite3
+    # WAL mode keeps -wal/-shm files next to the database
+    rm -f /app/persistent/db/db.sqlite3 /app/persistent/db/db.sqlite3-wal /app/persistent/db/db.sqlite3-shm
     echo "==> Database removed successfully"
 else
     echo "==> No existing database found, creating new one"
@@ -1,11 +1,25 @@
 """Gunicorn configuration for Docker deployment"""
 
+import os
+
+# Serving mode: "wsgi" runs sync workers on config.wsgi, "asgi" runs
+# event-loop workers on config.asgi (requires uvicorn, installed from the
+# optional requirements-asgi.txt, e.g. `docker build --build-arg WITH_ASGI=1`).
+SERVER_MODE = os.environ.get("GUNICORN_SERVER_MODE", "wsgi")
+
 # Server socket - bind to different port for nginx upstream
 bind = "127.0.0.1:8001"
 
+# Application
+if SERVER_MODE == "asgi":
+    wsgi_app = "config.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "config.wsgi:application"
+    worker_class = "sync"
+
 # Worker processes
-workers = 2
-worker_class = "sync"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
 worker_connections = 1000
 max_requests = 10000
 max_requests_jitter = 1000
@@ -36,3 +50,10 @@ limit_request_field_size = 8190
 
 # Preload app for better performance
 preload_app = True
+
+
+def worker_exit(server, worker):
+    """Write presence heartbeats still buffered in the exiting worker."""
+    from api import presence
+
+    presence.flush()
@@ -0,0 +1,68 @@
+#!/bin/bash
+# Run the Django test suite against SQLite and PostgreSQL without Docker.
+#
+# The PostgreSQL run uses POSTGRES_HOST/POSTGRES_PORT/POSTGRES_USER/
+# POSTGRES_PASSWORD when POSTGRES_HOST is set. Otherwise it starts a
+# throwaway cluster with the local initdb/pg_ctl binaries. It is skipped
+# when neither PostgreSQL nor the psycopg driver is available.
+#
+# Usage: ./run_tests.sh [sqlite|postgresql ...] [-- manage.py test args]
+set -euo pipefail
+
+cd "$(dirname "$0")"
+PYTHON="${PYTHON:-python}"
+
+engines=()
+while [ $# -gt 0 ] && [ "$1" != "--" ]; do
+    engines+=("$1")
+    shift
+done
+[ "${1:-}" = "--" ] && shift
+[ ${#engines[@]} -eq 0 ] && engines=(sqlite postgresql)
+
+status=0
+
+run_sqlite() {
+    echo "==> Running tests on SQLite"
+    DJANGO_DB_ENGINE=sqlite "$PYTHON" manage.py test "$@" || status=1
+}
+
+run_postgresql() {
+    if ! "$PYTHON" -c "import psycopg" 2>/dev/null; then
+        echo "==> Skipping PostgreSQL: the psycopg driver is not installed"
+        return
+    fi
+
+    local pgdir=""
+    if [ -z "${POSTGRES_HOST:-}" ]; then
+        if ! command -v initdb >/dev/null || ! command -v pg_ctl >/dev/null; then
+            echo "==> Skipping PostgreSQL: set POSTGRES_HOST or install initdb/pg_ctl"
+            return
+        fi
+        pgdir="$(mktemp -d)"
+        export POSTGRES_HOST="$pgdir" POSTGRES_PORT="${POSTGRES_PORT:-55432}"
+        export POSTGRES_USER="${POSTGRES_USER:-$(whoami)}" POSTGRES_DB=postgres
+        echo "==> Starting a throwaway PostgreSQL cluster in $pgdir"
+        initdb -D "$pgdir/data" -U "$POSTGRES_USER" --auth=trust >/dev/null
+        pg_ctl -D "$pgdir/data" -l "$pgdir/log" -w \
+            -o "-k $pgdir -p $POSTGRES_PORT -c listen_addresses=''" start >/dev/null
+    fi
+
+    echo "==> Running tests on PostgreSQL"
+    DJANGO_DB_ENGINE=postgresql "$PYTHON" manage.py test "$@" || status=1
+
+    if [ -n "$pgdir" ]; then
+        pg_ctl -D "$pgdir/data" -m fast stop >/dev/null
+        rm -rf "$pgdir"
+    fi
+}
+
+for engine in "${engines[@]}"; do
+    case "$engine" in
+        sqlite) run_sqlite "$@" ;;
+        postgresql) run_postgresql "$@" ;;
+        *) echo "Unknown engine: $engine" >&2; exit 2 ;;
+    esac
+done
+
+exit $status